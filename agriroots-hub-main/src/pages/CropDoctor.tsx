@@ -70,20 +70,62 @@ const CropDoctor = () => {
       const formData = new FormData();
       formData.append("file", file);
 
-      const response = await fetch("http://localhost:8000/diagnose", {
+      // Streamed as Server-Sent Events: the on-device result arrives first,
+      // then the AI diagnosis field by field, then the final result
+      const response = await fetch("http://localhost:8000/diagnose/stream", {
         method: "POST",
         body: formData,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         const errorData = await response.json().catch(() => ({}));
         throw new Error(errorData.error || errorData.message || errorData.detail || "Failed to analyze image");
       }
 
-      const data = await response.json();
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let partial: Partial<DiagnosisResult> = {};
+      let data: DiagnosisResult | null = null;
+
+      const show = (next: Partial<DiagnosisResult>) => {
+        partial = next;
+        // Render as soon as there is enough to show a header
+        if (partial.disease && partial.crop) {
+          setDiagnosis({ symptoms: [], ...partial } as DiagnosisResult);
+          setIsScanning(false);
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary: number;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const message = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          const event = message.match(/^event: (.*)$/m)?.[1];
+          const payload = message.match(/^data: (.*)$/m)?.[1];
+          if (!event || !payload) continue;
+          const body = JSON.parse(payload);
+
+          if (event === "local") {
+            show(body);
+          } else if (event === "field") {
+            show({ ...partial, [body.field]: body.value });
+          } else if (event === "result") {
+            data = body;
+          } else if (event === "error") {
+            throw new Error(body.error || body.message || "Failed to analyze image");
+          }
+        }
+      }
 
       // Validate the response has required fields
-      if (!data.disease || !data.crop) {
+      if (!data || !data.disease || !data.crop) {
         throw new Error("Invalid response from AI model");
       }
 
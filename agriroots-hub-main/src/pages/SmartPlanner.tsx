@@ -20,8 +20,19 @@ interface SoilData {
   k: number;
   ph: number;
   is_estimated?: boolean;
+  units?: { n: string; p: string; k: string };
 }
 
+const level = (value: number, high: number, medium: number) =>
+  value > high ? "High" : value > medium ? "Medium" : "Low";
+
+// The in-process recommender reports N in g/kg and P/K in mg/kg; the LLM
+// engine answers on the unitless scale of its prompt example
+const nutrientLevels = (soil: SoilData) =>
+  soil.units?.n === "g/kg"
+    ? { n: level(soil.n, 2, 1), p: level(soil.p, 25, 10), k: level(soil.k, 250, 100) }
+    : { n: level(soil.n, 100, 50), p: level(soil.p, 50, 20), k: level(soil.k, 40, 10) };
+
 const SmartPlanner = () => {
   const [activeOverlay, setActiveOverlay] = useState<string>("moisture");
   const [loading, setLoading] = useState(true);
@@ -93,9 +104,7 @@ const SmartPlanner = () => {
           ...fieldData,
           soil: data.soil_data.type || targetSoil,
           ph: data.soil_data.ph.toString(),
-          n: data.soil_data.n > 100 ? "High" : data.soil_data.n > 50 ? "Medium" : "Low",
-          p: data.soil_data.p > 50 ? "High" : data.soil_data.p > 20 ? "Medium" : "Low",
-          k: data.soil_data.k > 40 ? "High" : data.soil_data.k > 10 ? "Medium" : "Low",
+          ...nutrientLevels(data.soil_data),
         });
         setRecommendations(data.recommendations);
       } else {
@@ -1,13 +1,16 @@
-import io
 import os
-import base64
+import sys
 import traceback
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from PIL import Image
-from groq import Groq
 from dotenv import load_dotenv
 
+# Shared image handling and response parsing live in backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from image_pipeline import InvalidImageError, decode_upload
+from llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailableError
+from llm_json import extract_json_object, normalize_diagnosis
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -25,17 +28,41 @@ if not GROQ_API_KEY:
     print("Please set it using: set GROQ_API_KEY=your_api_key_here")
 
 AI_READY = False
-groq_client = None
+LLM_GATEWAY = None
+
+# Groq calls go through a pooled gateway with per-attempt timeouts, jittered
+# retries within a deadline and a circuit breaker (see backend/llm_gateway.py)
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Image sent to Groq: downscaled to LLM_IMAGE_MAX_EDGE and re-encoded
+# (which strips EXIF) instead of shipping the full-resolution upload
+LLM_IMAGE_MAX_EDGE = int(os.getenv("LLM_IMAGE_MAX_EDGE", "1024"))
+LLM_IMAGE_QUALITY = int(os.getenv("LLM_IMAGE_QUALITY", "85"))
+LLM_IMAGE_FORMAT = os.getenv("LLM_IMAGE_FORMAT", "JPEG").upper()
 
 def initialize_ai_engine():
     """Initialize the Groq Vision API client"""
-    global groq_client, AI_READY
+    global LLM_GATEWAY, AI_READY
     try:
         if not GROQ_API_KEY:
             raise Exception("GROQ_API_KEY not set")
         
         print("Initializing Groq Llama Vision API...")
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        LLM_GATEWAY = LLMGateway(
+            GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            pool_size=LLM_POOL_SIZE,
+            timeout_seconds=LLM_TIMEOUT_SECONDS,
+            deadline_seconds=LLM_DEADLINE_SECONDS,
+            max_retries=LLM_MAX_RETRIES,
+            breaker=CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS)
+        )
         
         AI_READY = True
         print("✅ AI ENGINE READY - Groq Llama Vision Initialized")
@@ -48,11 +75,13 @@ def initialize_ai_engine():
 # --- INITIALIZE ENGINE ON STARTUP ---
 initialize_ai_engine()
 
-def encode_image_to_base64(image_data):
-    """Convert image bytes to base64 string"""
-    return base64.b64encode(image_data).decode('utf-8')
+def shape_image_for_llm(upload):
+    """Downscaled, recompressed data URL for the upload, and its size in bytes"""
+    image_base64, mime, sent_bytes = upload.llm_payload(LLM_IMAGE_MAX_EDGE, LLM_IMAGE_QUALITY, LLM_IMAGE_FORMAT)
+    print(f"Image payload: {len(upload.raw)} -> {sent_bytes} bytes")
+    return f"data:{mime};base64,{image_base64}"
 
-def analyze_crop_disease(image_base64):
+def analyze_crop_disease(image_url):
     """Use Groq Llama Vision to analyze crop leaf image for disease"""
     try:
         # Create the vision prompt
@@ -79,7 +108,7 @@ Rules:
 - Be precise and scientific in your analysis"""
 
         # Call Groq Vision API
-        chat_completion = groq_client.chat.completions.create(
+        chat_completion = LLM_GATEWAY.chat(
             messages=[
                 {
                     "role": "user",
@@ -91,7 +120,7 @@ Rules:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": image_url
                             }
                         }
                     ]
@@ -106,83 +135,13 @@ Rules:
         response_text = chat_completion.choices[0].message.content
         print(f"Raw API Response: {response_text[:300]}...")  # Debug log
         
-        # Try to parse JSON from response
-        import json
-        import re
-        
-        # Method 1: Try direct JSON parse
-        try:
-            result = json.loads(response_text)
-            if 'disease' in result and 'crop' in result:
-                print("✅ Direct JSON parse successful")
-                # Ensure all required fields exist
-                result.setdefault('symptoms', [])
-                result.setdefault('additional_notes', '')
-                return result
-        except json.JSONDecodeError:
-            pass
-        
-        # Method 2: Extract from markdown code blocks
-        if "```json" in response_text:
-            try:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted from ```json block")
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    return result
-            except (IndexError, json.JSONDecodeError):
-                pass
-        
-        # Method 3: Extract from any code block
-        if "```" in response_text:
-            try:
-                json_str = response_text.split("```")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted from ``` block")
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    return result
-            except (IndexError, json.JSONDecodeError):
-                pass
-        
-        # Method 4: Use improved regex to find complete JSON object
-        # This pattern handles nested objects and arrays better
-        json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
-        matches = re.findall(json_pattern, response_text, re.DOTALL)
+        # Single pass over the response for the first object with disease and crop
+        result = extract_json_object(response_text, ("disease", "crop"))
+        if result is not None:
+            return normalize_diagnosis(result)
         
-        for match in matches:
-            try:
-                result = json.loads(match)
-                # Validate it has required fields
-                if 'disease' in result and 'crop' in result:
-                    print(f"✅ Extracted using regex (length: {len(match)})")
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    return result
-            except json.JSONDecodeError:
-                continue
-        
-        # Method 5: Try to find JSON between curly braces more aggressively
-        brace_start = response_text.find('{')
-        brace_end = response_text.rfind('}')
-        
-        if brace_start != -1 and brace_end != -1 and brace_end > brace_start:
-            try:
-                json_str = response_text[brace_start:brace_end + 1]
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted using brace position")
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    return result
-            except json.JSONDecodeError:
-                pass
-        
-        # If all methods fail, return a user-friendly error
-        print("⚠️  All JSON parsing methods failed")
+        # No usable object in the response, return a user-friendly error
+        print("⚠️  No diagnosis JSON found in AI response")
         print(f"Response preview: {response_text[:500]}")
         
         return {
@@ -223,19 +182,24 @@ def diagnose_crop():
         
         # Validate it's a valid image
         try:
-            img = Image.open(io.BytesIO(image_data))
-            img.verify()  # Verify it's actually an image
-        except Exception:
+            upload = decode_upload(image_data, LLM_IMAGE_MAX_EDGE)
+        except InvalidImageError:
             return jsonify({"error": "Invalid image file"}), 400
         
-        # Convert to base64
-        image_base64 = encode_image_to_base64(image_data)
+        # Downscale + recompress for the LLM
+        image_url = shape_image_for_llm(upload)
         
         # Analyze with Groq Vision
-        result = analyze_crop_disease(image_base64)
+        result = analyze_crop_disease(image_url)
         
         return jsonify(result), 200
         
+    except LLMUnavailableError as e:
+        print(f"Diagnosis Error: {e}")
+        return jsonify({
+            "error": str(e),
+            "message": "AI service is temporarily unavailable. Please try again shortly."
+        }), 503
     except Exception as e:
         print(f"Diagnosis Error: {e}")
         traceback.print_exc()
@@ -251,6 +215,7 @@ def health_check():
         "status": "online",
         "ai_ready": AI_READY,
         "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+        "llm_gateway": LLM_GATEWAY.stats() if LLM_GATEWAY else None,
         "api_configured": GROQ_API_KEY is not None
     }), 200
 
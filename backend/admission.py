@@ -0,0 +1,345 @@
+"""
+Admission control in front of Groq.
+
+Two checks run before a Groq-bound request does any work:
+
+1. A token bucket per client (API key, else IP). It refills at
+   rate_per_second up to burst tokens. A request needs at least its cost
+   in tokens, or the whole bucket for costs above burst. It then pays its
+   full cost, so a big batch leaves the bucket in debt that refills before
+   the next request. The cost is refunded if the request is then turned
+   away by the queue.
+2. A global cap of max_concurrent requests holding a Groq slot, sized to
+   the Groq quota. When every slot is busy, requests wait in a fair queue.
+   Each client has its own FIFO, and freed slots go to clients in
+   round-robin order, so one client flooding the queue only delays itself.
+   A client may have at most max_queue_per_client requests waiting and the
+   queue at most max_queue. A request that waits longer than
+   max_wait_seconds gives up.
+
+A request that fails either check raises AdmissionRejected with a
+Retry-After hint. The server answers it with a 429 straight away instead of
+letting it time out inside the Groq client.
+"""
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class AdmissionRejected(Exception):
+    """reason: rate_limited, queue_full or queue_timeout"""
+
+    def __init__(self, reason, retry_after, message):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def client_identity(headers, remote_addr, trust_proxy=False):
+    """Bucket key for a request: its X-API-Key (hashed), else the client IP"""
+    api_key = headers.get("X-API-Key")
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if trust_proxy:
+        forwarded = headers.get("X-Forwarded-For")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (remote_addr or "unknown")
+
+
+class Ticket:
+    """A granted admission; release() (or leaving the with block) frees the slot"""
+
+    def __init__(self, controller, holds_slot):
+        self._controller = controller
+        self._holds_slot = holds_slot
+        self._acquired_at = time.perf_counter()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if self._holds_slot:
+            self._controller._release_slot(time.perf_counter() - self._acquired_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def hold(self, iterable):
+        """Keep the slot until a streamed response body (sync or async) is exhausted or closed"""
+        if hasattr(iterable, "__aiter__"):
+            return _HeldAsyncIterator(self, iterable)
+        return _HeldIterator(self, iterable)
+
+
+class _HeldIterator:
+    # A class rather than a generator: a generator that never started does
+    # not run its finally block when the server closes it
+    def __init__(self, ticket, iterable):
+        self._ticket = ticket
+        self._iterator = iter(iterable)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self._ticket.release()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._ticket.release()
+
+
+class _HeldAsyncIterator:
+    """_HeldIterator for async response bodies (ASGI)"""
+
+    def __init__(self, ticket, iterable):
+        self._ticket = ticket
+        self._iterator = iterable.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            self._ticket.release()
+            raise
+
+    async def aclose(self):
+        try:
+            aclose = getattr(self._iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            self._ticket.release()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class _Waiter:
+    """A request waiting for a slot: a threading.Event, or a future for asyncio callers"""
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event, self.future = threading.Event(), None
+        else:
+            self.event, self.future = None, loop.create_future()
+
+    def notify(self):
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+class AdmissionController:
+    """Per-client token buckets plus a fair-queued global concurrency cap"""
+
+    def __init__(
+        self,
+        rate_per_second=0.5,
+        burst=10,
+        max_concurrent=16,
+        max_queue=64,
+        max_queue_per_client=4,
+        max_wait_seconds=10.0,
+        max_clients=10000,
+    ):
+        self.rate = float(rate_per_second)
+        self.burst = float(burst)
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.max_queue_per_client = max(0, int(max_queue_per_client))
+        self.max_wait = float(max_wait_seconds)
+        self.max_clients = max(1, int(max_clients))
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> [tokens, last refill], LRU order
+        self._in_use = 0
+        self._waiting = OrderedDict()  # client -> deque of _Waiter, in round-robin order
+        self._total_waiting = 0
+        self._avg_hold_seconds = 1.0
+
+        self.decisions = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self.total_wait_seconds = 0.0
+
+    def admit(self, client, cost=1, slot=True):
+        """Charge client's bucket and, if slot, wait for a Groq slot.
+
+        Returns a Ticket; raises AdmissionRejected.
+        """
+        self._take_tokens(client, cost)
+        if slot:
+            try:
+                waiter = self._enqueue(client)
+                if waiter is not None:
+                    start = time.perf_counter()
+                    waiter.event.wait(self.max_wait)
+                    self._settle(client, waiter, time.perf_counter() - start)
+            except AdmissionRejected:
+                self._refund_tokens(client, cost)
+                raise
+        self._count("admitted")
+        return Ticket(self, slot)
+
+    async def admit_async(self, client, cost=1, slot=True):
+        """admit() for asyncio callers: waits on a future instead of a thread"""
+        self._take_tokens(client, cost)
+        if slot:
+            try:
+                waiter = self._enqueue(client, asyncio.get_running_loop())
+                if waiter is not None:
+                    start = time.perf_counter()
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    except asyncio.CancelledError:
+                        # The client went away; give back a slot granted meanwhile
+                        self._abandon(client, waiter)
+                        raise
+                    self._settle(client, waiter, time.perf_counter() - start)
+            except AdmissionRejected:
+                self._refund_tokens(client, cost)
+                raise
+        self._count("admitted")
+        return Ticket(self, slot)
+
+    # --- token buckets ---
+
+    def _take_tokens(self, client, cost):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [self.burst, now]
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            needed = min(cost, self.burst)
+            if bucket[0] < needed:
+                self.decisions["rate_limited"] += 1
+                retry_after = (needed - bucket[0]) / self.rate if self.rate > 0 else 60
+                raise AdmissionRejected("rate_limited", retry_after, "Rate limit exceeded for this client")
+            bucket[0] -= cost
+
+    def _refund_tokens(self, client, cost):
+        """Give back what _take_tokens charged a request the queue then turned away"""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    # --- concurrency cap with a fair queue ---
+
+    def _enqueue(self, client, loop=None):
+        """Take a free slot (returns None) or join the client's queue (returns the waiter)"""
+        with self._lock:
+            if self._in_use < self.max_concurrent and not self._total_waiting:
+                self._in_use += 1
+                return None
+            queue = self._waiting.get(client)
+            if (queue is not None and len(queue) >= self.max_queue_per_client) or self._total_waiting >= self.max_queue:
+                self.decisions["queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._expected_wait(), "Server is at capacity")
+            waiter = _Waiter(loop)
+            self._waiting.setdefault(client, deque()).append(waiter)
+            self._total_waiting += 1
+            self.decisions["queued"] += 1
+            return waiter
+
+    def _remove(self, client, waiter):
+        """Take a waiter that was never granted out of its queue (called with the lock held)"""
+        queue = self._waiting[client]
+        queue.remove(waiter)
+        self._total_waiting -= 1
+        if not queue:
+            del self._waiting[client]
+
+    def _settle(self, client, waiter, waited):
+        """After a wait: keep a granted slot, or give up with queue_timeout"""
+        with self._lock:
+            self.total_wait_seconds += waited
+            if waiter.granted:
+                return
+            self._remove(client, waiter)
+            self.decisions["queue_timeout"] += 1
+            retry_after = self._expected_wait()
+        raise AdmissionRejected("queue_timeout", retry_after, "Timed out waiting for capacity")
+
+    def _abandon(self, client, waiter):
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                self._remove(client, waiter)
+        if granted:
+            self._release_slot(None)
+
+    def _release_slot(self, held_seconds):
+        with self._lock:
+            if held_seconds is not None:
+                self._avg_hold_seconds = 0.9 * self._avg_hold_seconds + 0.1 * held_seconds
+            if not self._waiting:
+                self._in_use -= 1
+                return
+            # Hand the slot straight to the next client in round-robin order
+            client, queue = next(iter(self._waiting.items()))
+            waiter = queue.popleft()
+            self._total_waiting -= 1
+            if queue:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            waiter.granted = True
+            waiter.notify()
+
+    def _expected_wait(self):
+        """Seconds until the queue ahead drains (called with the lock held)"""
+        return self._avg_hold_seconds * (self._total_waiting / self.max_concurrent + 1)
+
+    def _count(self, decision):
+        with self._lock:
+            self.decisions[decision] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "max_concurrent": self.max_concurrent,
+                "in_use": self._in_use,
+                "waiting": self._total_waiting,
+                "waiting_clients": len(self._waiting),
+                "tracked_clients": len(self._buckets),
+                "avg_hold_ms": round(self._avg_hold_seconds * 1000, 1),
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                **self.decisions,
+            }
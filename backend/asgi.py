@@ -0,0 +1,735 @@
+"""
+ASGI serving mode for the Crop Disease Detection API.
+
+Exposes the same /, /diagnose, /diagnose/stream, /diagnose/batch, /jobs,
+/health and /api/planner/recommend_satellite routes as main.py, but the
+Groq round-trip is awaited on the gateway's AsyncGroq pool instead of
+blocking a worker thread. CPU-bound work
+(image decode, cache hashing, local TensorFlow inference) is handed to a
+bounded thread pool, so a single process can keep hundreds of diagnoses in
+flight while they wait on the network.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import main as core
+
+log = logging.getLogger("crop_api.asgi")
+
+# Threads available for decode + local inference. Requests beyond this wait
+# in the executor queue instead of piling onto the CPU.
+ASGI_INFERENCE_WORKERS = int(os.getenv("ASGI_INFERENCE_WORKERS", "8"))
+inference_executor = ThreadPoolExecutor(max_workers=ASGI_INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Strong references to fire-and-forget enrichment tasks
+background_tasks = set()
+
+
+async def run_blocking(fn, *args):
+    """Run a CPU-bound helper from main.py on the bounded inference pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, fn, *args)
+
+
+async def no_admission():
+    return core.Ticket(None, False)
+
+
+def request_admission(request, mode="hybrid", cost=1, slot=True):
+    """Async twin of main.request_admission: await admit() just before calling Groq"""
+    if core.ADMISSION is None or mode == "local":
+        return no_admission
+    client = core.admission_client(request.headers, request.client.host if request.client else None)
+    return lambda: core.ADMISSION.admit_async(client, cost, slot)
+
+
+async def admit_request(request, mode="hybrid", cost=1, slot=True):
+    """Async twin of main.admit_request; a queued request waits on the event loop"""
+    return await request_admission(request, mode, cost, slot)()
+
+
+def admission_rejected(e):
+    return JSONResponse(
+        core.admission_rejected_body(e), status_code=429, headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+def held_stream(ticket, body, **kwargs):
+    """StreamingResponse that keeps the admission slot until the body is done"""
+    # The background task covers a body that was never iterated
+    return StreamingResponse(ticket.hold(body), background=BackgroundTask(ticket.release), **kwargs)
+
+
+async def request_llm_diagnosis(prompt, image_url):
+    """Await the Groq Vision API and return the raw response text"""
+    chat_completion = await core.LLM_GATEWAY.achat(**core.build_diagnosis_request(prompt, image_url))
+    response_text = chat_completion.choices[0].message.content
+    log.debug("Raw API response: %.500s", response_text)
+    return response_text
+
+
+async def encode_and_request(prompt, upload):
+    """Shape the LLM image on the inference pool, then await the Groq diagnosis text"""
+    image_url, _ = await run_blocking(core.llm_image_url, upload)
+    return await request_llm_diagnosis(prompt, image_url)
+
+
+async def enrich(llm, keys):
+    """Await the LLM diagnosis and cache it; failures are only logged"""
+    try:
+        response_text = await llm
+        await run_blocking(core.store_diagnosis, keys, core.parse_diagnosis_response(response_text))
+    except Exception as e:
+        log.warning("Background enrichment failed: %s", e)
+
+
+def enrich_in_background(llm, keys):
+    """Cache the LLM diagnosis `llm` (awaitable of the response text) yields, after a local fast-path response"""
+    task = asyncio.create_task(enrich(llm, keys))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def local_answer(local, timings, start):
+    """Fast-path response built from a (class, confidence, ...) local prediction"""
+    timings["total"] = core.elapsed_ms(start)
+    return core.with_meta(core.build_local_result(local[0], local[1]), "local", timings, **core.local_details(local))
+
+
+async def finish_llm_diagnosis(response_text, keys, timings, start, upload, local_prediction, sent_bytes):
+    """Parse, cache and wrap the Groq answer"""
+    stage = time.perf_counter()
+    result = core.parse_diagnosis_response(response_text)
+    timings["parse"] = core.elapsed_ms(stage)
+    await run_blocking(core.store_diagnosis, keys, result)
+
+    timings["total"] = core.elapsed_ms(start)
+    return core.with_meta(
+        result, "llm", timings,
+        hint_included=bool(local_prediction),
+        upload_bytes=len(upload.raw),
+        llm_image_bytes=sent_bytes
+    )
+
+
+async def speculative_diagnosis(upload, keys, timings, start, admit):
+    """PIPELINE_MODE=speculative twin of main.run_diagnosis: the local model and Groq race.
+
+    The Groq request carries the local hint only if the local model answers
+    within PIPELINE_HINT_WAIT_MS. If the local model then finishes first
+    and takes the fast path, the Groq request is left to fill the cache
+    (LOCAL_FAST_PATH_ENRICH) or cancelled.
+    """
+    can_enrich = core.LOCAL_FAST_PATH_ENRICH and keys != (None, None)
+    local_task = asyncio.create_task(run_blocking(core.timed_local_prediction, upload))
+    background_tasks.add(local_task)
+    local_task.add_done_callback(background_tasks.discard)
+    stage = time.perf_counter()
+    image_url, sent_bytes = await run_blocking(core.llm_image_url, upload)
+    timings["encode"] = core.elapsed_ms(stage)
+
+    local = None
+    if core.PIPELINE_HINT_WAIT_MS > 0:
+        try:
+            local = await asyncio.wait_for(asyncio.shield(local_task), core.PIPELINE_HINT_WAIT_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+    if local is not None and core.use_local_fast_path(local):
+        timings["local_inference"] = local[2]
+        if can_enrich:
+            enrich_in_background(request_llm_diagnosis(core.build_diagnosis_prompt(local[0], local[1]), image_url), keys)
+        return local_answer(local, timings, start)
+
+    local_hint = local[0] if local else None
+    prompt = core.build_diagnosis_prompt(*(local[:2] if local else (None, 0)))
+    ticket = await admit()
+    stage = time.perf_counter()
+    llm_task = asyncio.create_task(request_llm_diagnosis(prompt, image_url))
+    llm_task.add_done_callback(lambda _: ticket.release())
+
+    if local is None:
+        await asyncio.wait({local_task, llm_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not llm_task.done():
+            local = local_task.result()
+            if core.use_local_fast_path(local):
+                timings["local_inference"] = local[2]
+                if can_enrich:
+                    enrich_in_background(llm_task, keys)
+                else:
+                    llm_task.cancel()
+                return local_answer(local, timings, start)
+
+    try:
+        response_text = await llm_task
+    except core.LLMUnavailableError as e:
+        local = await local_task
+        timings["local_inference"] = local[2]
+        timings["total"] = core.elapsed_ms(start)
+        return core.local_fallback(local[0], local[1], timings, e)
+    timings["llm"] = core.elapsed_ms(stage)
+    if local_task.done():
+        timings["local_inference"] = local_task.result()[2]
+    return await finish_llm_diagnosis(response_text, keys, timings, start, upload, local_hint, sent_bytes)
+
+
+async def analyze_crop_disease_async(upload, admit=no_admission):
+    """Async twin of main.analyze_crop_disease, for an already decoded upload"""
+    try:
+        start = time.perf_counter()
+        cached, keys = await run_blocking(core.lookup_cached_diagnosis, upload)
+        if cached is not None:
+            cached["meta"]["timings_ms"] = {"cache_lookup": core.elapsed_ms(start), "total": core.elapsed_ms(start)}
+            return cached
+        timings = {"cache_lookup": core.elapsed_ms(start)}
+        if core.PIPELINE_MODE == "speculative":
+            return await speculative_diagnosis(upload, keys, timings, start, admit)
+
+        # 🟢 STEP 1: Local Model Prediction (off the event loop)
+        stage = time.perf_counter()
+        local = await run_blocking(core.predict_disease_local, upload)
+        local_prediction, local_confidence = local
+        timings["local_inference"] = core.elapsed_ms(stage)
+        prompt = core.build_diagnosis_prompt(local_prediction, local_confidence)
+
+        if core.use_local_fast_path(local):
+            if core.LOCAL_FAST_PATH_ENRICH and keys != (None, None):
+                enrich_in_background(encode_and_request(prompt, upload), keys)
+            return local_answer(local, timings, start)
+
+        # 🟢 STEP 2: Groq LLM Analysis, awaited without holding a thread
+        stage = time.perf_counter()
+        image_url, sent_bytes = await run_blocking(core.llm_image_url, upload)
+        timings["encode"] = core.elapsed_ms(stage)
+        stage = time.perf_counter()
+        try:
+            with await admit():
+                response_text = await request_llm_diagnosis(prompt, image_url)
+        except core.LLMUnavailableError as e:
+            timings["total"] = core.elapsed_ms(start)
+            return core.local_fallback(local_prediction, local_confidence, timings, e)
+        timings["llm"] = core.elapsed_ms(stage)
+        return await finish_llm_diagnosis(response_text, keys, timings, start, upload, local_prediction, sent_bytes)
+
+    except core.AdmissionRejected:
+        raise
+    except Exception as e:
+        log.exception("Vision analysis error: %s", e)
+        raise e
+
+
+async def stream_llm_diagnosis(prompt, image_url):
+    """Yield the Groq Vision completion as it is generated, chunk by chunk"""
+    stream = await core.LLM_GATEWAY.achat(stream=True, **core.build_diagnosis_request(prompt, image_url))
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def chain_async(first, rest):
+    """Re-attach an already awaited first item to an async iterator"""
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def stream_diagnosis_async(upload, admit=no_admission):
+    """Async twin of main.stream_diagnosis"""
+    try:
+        start = time.perf_counter()
+        cached, keys = await run_blocking(core.lookup_cached_diagnosis, upload)
+        if cached is not None:
+            cached["meta"]["timings_ms"] = {"cache_lookup": core.elapsed_ms(start), "total": core.elapsed_ms(start)}
+            yield core.result_event(cached)
+            return
+        timings = {"cache_lookup": core.elapsed_ms(start)}
+
+        # 🟢 STEP 1: Local Model Prediction, sent before the LLM is even called
+        stage = time.perf_counter()
+        local = await run_blocking(core.predict_disease_local, upload)
+        local_prediction, local_confidence = local
+        timings["local_inference"] = core.elapsed_ms(stage)
+        if local_prediction is not None:
+            local_result = core.build_local_result(local_prediction, local_confidence)
+            yield core.sse_event("local", core.with_meta(
+                local_result, "local", dict(timings), mode="stream", **core.local_details(local)
+            ))
+
+        prompt = core.build_diagnosis_prompt(local_prediction, local_confidence)
+        if core.use_local_fast_path(local):
+            if core.LOCAL_FAST_PATH_ENRICH and keys != (None, None):
+                enrich_in_background(encode_and_request(prompt, upload), keys)
+            timings["total"] = core.elapsed_ms(start)
+            yield core.result_event(core.with_meta(local_result, "local", timings, mode="stream", **core.local_details(local)))
+            return
+
+        # 🟢 STEP 2: Groq LLM Analysis, forwarded field by field
+        try:
+            ticket = await admit()
+        except core.AdmissionRejected as e:
+            yield core.sse_event("error", {**core.admission_rejected_body(e), "retry_after": e.retry_after})
+            return
+        with ticket:
+            stage = time.perf_counter()
+            image_url, sent_bytes = await run_blocking(core.llm_image_url, upload)
+            timings["encode"] = core.elapsed_ms(stage)
+            parser = core.ProgressiveObjectParser()
+            stage = time.perf_counter()
+            deltas = stream_llm_diagnosis(prompt, image_url)
+            try:
+                first = await anext(deltas, "")
+            except core.LLMUnavailableError as e:
+                result = core.local_fallback(local_prediction, local_confidence, timings, e)
+                result["meta"]["mode"] = "stream"
+                timings["total"] = core.elapsed_ms(start)
+                yield core.result_event(result)
+                return
+            async for delta in chain_async(first, deltas):
+                if "llm_first_token" not in timings:
+                    timings["llm_first_token"] = core.elapsed_ms(stage)
+                for key, value in parser.feed(delta):
+                    if key == "additional_notes":
+                        value = core.flatten_notes(value)
+                    yield core.sse_event("field", {"field": key, "value": value})
+        timings["llm"] = core.elapsed_ms(stage)
+        log.debug("Raw API response: %.500s", parser.text)
+
+        stage = time.perf_counter()
+        result = core.parse_diagnosis_response(parser.text)
+        timings["parse"] = core.elapsed_ms(stage)
+        await run_blocking(core.store_diagnosis, keys, result)
+
+        timings["total"] = core.elapsed_ms(start)
+        yield core.result_event(core.with_meta(
+            result, "llm", timings,
+            mode="stream",
+            hint_included=bool(local_prediction),
+            upload_bytes=len(upload.raw),
+            llm_image_bytes=sent_bytes
+        ))
+
+    except Exception as e:
+        # Headers are already sent, so the failure travels as an event
+        log.exception("Streaming diagnosis error: %s", e)
+        yield core.sse_event("error", {"error": str(e), "message": "Failed to analyze image"})
+
+
+async def stream_local_diagnosis_async(upload, fallback=None):
+    """Async twin of main.stream_local_diagnosis"""
+    try:
+        result = await run_blocking(core.diagnose_local, upload, fallback)
+        result["meta"]["mode"] = "stream"
+        yield core.result_event(result)
+    except Exception as e:
+        log.exception("Streaming diagnosis error: %s", e)
+        yield core.sse_event("error", {"error": str(e), "message": "Failed to analyze image"})
+
+
+async def diagnose_crop(request):
+    """Endpoint to diagnose crop disease from uploaded image"""
+    form = await request.form()
+    mode, fallback, error = core.select_diagnosis_mode(request.query_params.get("mode") or form.get("mode"))
+    if error:
+        status, message = error
+        return JSONResponse({"error": message}, status_code=status)
+    file = form.get('file')
+    if file is None or not hasattr(file, 'read'):
+        return JSONResponse({"error": "No file uploaded"}, status_code=400)
+
+    if not file.filename:
+        return JSONResponse({"error": "No file selected"}, status_code=400)
+
+    # Admission is only taken if the diagnosis reaches Groq
+    admit = request_admission(request, mode)
+
+    try:
+        image_data = await file.read()
+
+        try:
+            upload = await run_blocking(core.timed_decode, image_data)
+        except core.InvalidImageError:
+            return JSONResponse({"error": "Invalid image file"}, status_code=400)
+
+        if mode == "local":
+            result = await run_blocking(core.diagnose_local, upload, fallback)
+        else:
+            result = await analyze_crop_disease_async(upload, admit)
+        return JSONResponse(core.record_diagnosis(result), status_code=200)
+
+    except core.AdmissionRejected as e:
+        return admission_rejected(e)
+    except core.LLMUnavailableError as e:
+        # Groq is down and there is no local model to fall back on
+        log.warning("Diagnosis error: %s", e)
+        return JSONResponse({
+            "error": str(e),
+            "message": "AI service is temporarily unavailable. Please try again shortly."
+        }, status_code=503)
+    except Exception as e:
+        log.exception("Diagnosis error: %s", e)
+        return JSONResponse({
+            "error": str(e),
+            "message": "Failed to analyze image"
+        }, status_code=500)
+
+
+async def diagnose_crop_stream(request):
+    """Same as /diagnose, but streams the diagnosis as Server-Sent Events"""
+    form = await request.form()
+    mode, fallback, error = core.select_diagnosis_mode(request.query_params.get("mode") or form.get("mode"))
+    if error:
+        status, message = error
+        return JSONResponse({"error": message}, status_code=status)
+    file = form.get('file')
+    if file is None or not hasattr(file, 'read'):
+        return JSONResponse({"error": "No file uploaded"}, status_code=400)
+
+    if not file.filename:
+        return JSONResponse({"error": "No file selected"}, status_code=400)
+
+    try:
+        upload = await run_blocking(core.timed_decode, await file.read())
+    except core.InvalidImageError:
+        return JSONResponse({"error": "Invalid image file"}, status_code=400)
+
+    # Admission is only taken (and held while Groq streams) if the diagnosis reaches Groq
+    return StreamingResponse(
+        stream_local_diagnosis_async(upload, fallback)
+        if mode == "local" else stream_diagnosis_async(upload, request_admission(request, mode)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def diagnose_crop_batch(request):
+    """Diagnose many images in one request (multipart field `files`, repeated).
+
+    Same contract as main.diagnose_crop_batch. The batch is driven from
+    Starlette's thread pool rather than the inference pool, since it mostly
+    waits on main.BATCH_EXECUTOR.
+    """
+    form = await request.form()
+    mode, fallback, error = core.select_diagnosis_mode(request.query_params.get("mode") or form.get("mode"))
+    if error:
+        status, message = error
+        return JSONResponse({"error": message}, status_code=status)
+
+    files = [f for f in form.getlist("files") + form.getlist("file") if hasattr(f, "read") and f.filename]
+    if not files:
+        return JSONResponse({"error": "No files uploaded"}, status_code=400)
+    if len(files) > core.BATCH_MAX_FILES:
+        return JSONResponse(
+            {"error": f"Too many files: {len(files)} (at most {core.BATCH_MAX_FILES} per batch)"},
+            status_code=413
+        )
+
+    try:
+        ticket = await admit_request(request, mode, cost=len(files))
+    except core.AdmissionRejected as e:
+        return admission_rejected(e)
+
+    start = time.perf_counter()
+    named = [(f.filename, await f.read()) for f in files]
+    items = await asyncio.gather(*(run_blocking(core.decode_batch_file, item) for item in named))
+    entries = core.iter_batch_diagnoses(items, mode, fallback)
+
+    if request.query_params.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        return held_stream(
+            ticket,
+            (json.dumps(entry) + "\n" for entry in entries),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    with ticket:
+        results = await run_in_threadpool(list, entries)
+    succeeded = sum(1 for entry in results if entry["ok"])
+    return JSONResponse({
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+        "timings_ms": {"total": core.elapsed_ms(start)}
+    }, status_code=200)
+
+
+async def submit_diagnosis_job(request):
+    """Queue a diagnosis and return its job id straight away (202)"""
+    if core.JOB_QUEUE is None:
+        return JSONResponse({"error": "Job queue is disabled (JOBS_ENABLED=0)"}, status_code=503)
+
+    form = await request.form()
+    mode, fallback, error = core.select_diagnosis_mode(request.query_params.get("mode") or form.get("mode"))
+    if error:
+        status, message = error
+        return JSONResponse({"error": message}, status_code=status)
+
+    file = form.get('file')
+    if file is None or not hasattr(file, 'read'):
+        return JSONResponse({"error": "No file uploaded"}, status_code=400)
+
+    if not file.filename:
+        return JSONResponse({"error": "No file selected"}, status_code=400)
+
+    webhook_url = form.get("webhook_url") or None
+    # Resolving the webhook host blocks, so not on the event loop
+    webhook_error = webhook_url and await run_in_threadpool(core.webhook_url_error, webhook_url)
+    if webhook_error:
+        return JSONResponse({"error": webhook_error}, status_code=400)
+
+    try:
+        await admit_request(request, mode, slot=False)
+    except core.AdmissionRejected as e:
+        return admission_rejected(e)
+
+    payload = await file.read()
+    try:
+        job_id = await run_in_threadpool(
+            core.JOB_QUEUE.submit, payload, {"mode": mode, "fallback": fallback}, webhook_url
+        )
+    except core.JobQueueFullError as e:
+        return JSONResponse(
+            {"error": str(e), "message": "Too many queued diagnoses. Please retry later."},
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    status_url = f"/jobs/{job_id}"
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued", "status_url": status_url},
+        status_code=202,
+        headers={"Location": status_url}
+    )
+
+
+async def get_diagnosis_job(request):
+    """Status of a queued diagnosis, with the result once it has succeeded"""
+    if core.JOB_QUEUE is None:
+        return JSONResponse({"error": "Job queue is disabled (JOBS_ENABLED=0)"}, status_code=503)
+    job = await run_in_threadpool(core.JOB_QUEUE.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job, status_code=200)
+
+
+async def metrics(request):
+    """Prometheus scrape endpoint"""
+    if not core.METRICS_ENABLED:
+        return JSONResponse({"error": "Metrics are disabled (METRICS_ENABLED=0)"}, status_code=404)
+    return Response(core.METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+class RequestMetricsMiddleware:
+    """Same per-request metrics as main.py's before/after_request hooks"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not core.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # The router stores the matched endpoint in the shared scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            core.HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+            core.HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        core.HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_record)
+        except Exception:
+            record(500)
+            raise
+        finally:
+            core.HTTP_IN_FLIGHT.dec()
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    status = core.health_status()
+    status["server"] = "asgi"
+    status["inference_workers"] = ASGI_INFERENCE_WORKERS
+    return JSONResponse(status, status_code=200)
+
+
+async def readiness_check(request):
+    """Readiness probe for load balancers: 200 only once the instance is warm"""
+    ready = core.is_ready()
+    return JSONResponse({"ready": ready, "local_model_state": core.MODEL_STATE}, status_code=200 if ready else 503)
+
+
+async def list_local_models(request):
+    """Loaded local model versions and the traffic split"""
+    return JSONResponse(core.local_models_status(), status_code=200)
+
+
+async def put_model_routes(request):
+    """Change the traffic split across model versions (loads and unloads models as needed)"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    body, status = await run_in_threadpool(core.update_model_routes, request.headers.get("authorization"), payload)
+    return JSONResponse(body, status_code=status)
+
+
+async def home(request):
+    """Home endpoint"""
+    return JSONResponse({
+        "service": "Crop Disease Detection API (Hybrid Edition, ASGI)",
+        "version": "1.1.0",
+        "local_engine": "TensorFlow network.h5 (38 Classes)",
+        "cloud_engine": "Groq Llama 4 Scout",
+        "endpoints": {
+            "/diagnose": "POST - Upload crop leaf image for hybrid analysis (?mode=local for offline diagnosis)",
+            "/diagnose/stream": "POST - Same as /diagnose, streamed as Server-Sent Events (local, field, result)",
+            "/diagnose/batch": "POST - Diagnose many images at once (repeated `files` field; ?format=ndjson to stream)",
+            "/jobs/diagnose": "POST - Queue a diagnosis, returns a job id (optional webhook_url)",
+            "/jobs/<id>": "GET - Status and result of a queued diagnosis",
+            "/health": "GET - Check API and Model health status",
+            "/metrics": "GET - Prometheus metrics",
+            "/health/ready": "GET - Readiness probe (503 until the local model is warm)",
+            "/models": "GET - Loaded local model versions and the A/B traffic split",
+            "/models/routes": "PUT - Change the traffic split ({\"model id\": weight}; needs MODEL_ADMIN_TOKEN)",
+            "/api/planner/recommend_satellite": "POST - Get crop recommendations (\"narrative\": true for AI-written reasons)"
+        }
+    }, status_code=200)
+
+
+async def narrate_recommendation_async(request, field, result):
+    """Async twin of main.narrate_recommendation"""
+    key, hit = core.lookup_narrative(field, result)
+    if hit:
+        return "cache"
+    if not core.AI_READY:
+        return "unavailable"
+    try:
+        with await admit_request(request):
+            chat_completion = await core.LLM_GATEWAY.achat(**core.build_narrative_request(field, result))
+        reasons = core.parse_narrative_response(chat_completion.choices[0].message.content)
+    except core.AdmissionRejected:
+        return "rate_limited"
+    except (core.LLMUnavailableError, ValueError) as e:
+        log.warning("Recommendation narrative failed: %s", e)
+        return "failed"
+    core.apply_narrative(result, reasons)
+    await run_in_threadpool(core.store_recommendation, key, reasons)
+    return "llm"
+
+
+async def recommend_satellite(request):
+    """Endpoint for satellite-based crop recommendations using Groq AI"""
+    if request.method == "OPTIONS":
+        return JSONResponse({"status": "ok"}, status_code=200)
+
+    try:
+        start = time.perf_counter()
+        data = await request.json()
+        field = core.parse_field_request(data)
+
+        if core.RECOMMENDATION_ENGINE == "local":
+            try:
+                result = core.recommend_local(field)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+            timings = {"local_recommendation": core.elapsed_ms(start)}
+            wants_narrative = (request.query_params.get("narrative") == "1"
+                               or (isinstance(data, dict) and data.get("narrative") is True))
+            narrative = await narrate_recommendation_async(request, field, result) if wants_narrative else "not_requested"
+            timings["total"] = core.elapsed_ms(start)
+            result = core.finish_recommendation(result, field, "local", timings, None, narrative=narrative)
+            return JSONResponse(result, status_code=200)
+
+        cached, key, representative = core.lookup_recommendation(field)
+        if cached is not None:
+            return JSONResponse(cached, status_code=200)
+
+        try:
+            ticket = await admit_request(request)
+        except core.AdmissionRejected as e:
+            return admission_rejected(e)
+
+        with ticket:
+            chat_completion = await core.LLM_GATEWAY.achat(**core.build_recommendation_request(representative))
+        result = core.parse_recommendation_response(chat_completion.choices[0].message.content)
+        await run_in_threadpool(core.store_recommendation, key, result)
+
+        result = core.finish_recommendation(result, field, "llm", {"total": core.elapsed_ms(start)}, key)
+        return JSONResponse(result, status_code=200)
+
+    except core.LLMUnavailableError as e:
+        log.warning("Recommendation error: %s", e)
+        return JSONResponse({
+            "error": str(e),
+            "message": "AI service is temporarily unavailable. Please try again shortly."
+        }, status_code=503)
+    except Exception as e:
+        log.exception("Recommendation error: %s", e)
+        return JSONResponse({
+            "error": str(e),
+            "message": "Failed to generate crop recommendations"
+        }, status_code=500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    core.start_job_queue()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/", home, methods=["GET"]),
+        Route("/diagnose", diagnose_crop, methods=["POST"]),
+        Route("/diagnose/stream", diagnose_crop_stream, methods=["POST"]),
+        Route("/diagnose/batch", diagnose_crop_batch, methods=["POST"]),
+        Route("/jobs/diagnose", submit_diagnosis_job, methods=["POST"]),
+        Route("/jobs/{job_id}", get_diagnosis_job, methods=["GET"]),
+        Route("/health", health_check, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/health/ready", readiness_check, methods=["GET"]),
+        Route("/models", list_local_models, methods=["GET"]),
+        Route("/models/routes", put_model_routes, methods=["PUT"]),
+        Route("/api/planner/recommend_satellite", recommend_satellite, methods=["POST", "OPTIONS"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(RequestMetricsMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
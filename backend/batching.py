@@ -0,0 +1,125 @@
+"""
+Micro-batching queue for the local disease classifier.
+
+Concurrent /diagnose requests each hand a single preprocessed image to the
+batcher. A background worker collects whatever arrives within a short window
+(or until the batch is full), runs ONE forward pass over the stacked batch and
+hands each caller back its own row of predictions.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import numpy as np
+
+# Queued by close(): the worker finishes what is ahead of it, then exits
+_STOP = object()
+
+
+class MicroBatcher:
+    """Collects single-item requests into batches for one batched predict call"""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, name="local-batcher", collate=None):
+        self.predict_fn = predict_fn
+        # collate(items) -> batch array; runs on the worker thread only
+        self.collate = collate or np.stack
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        # Counters (read by /health and the benchmark)
+        self.batches_run = 0
+        self.items_run = 0
+        self.max_batch_seen = 0
+
+    def _ensure_worker(self):
+        """Start the worker thread lazily (and again in a forked child)"""
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            if self._worker_pid != os.getpid():
+                # Queue state inherited through fork() belongs to the parent
+                self._queue = Queue()
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._worker.start()
+
+    def submit(self, item):
+        """Queue one input array and return a Future for its prediction row"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def predict(self, item, timeout=None):
+        """Blocking helper: submit one item and wait for its prediction"""
+        return self.submit(item).result(timeout=timeout)
+
+    def predict_many(self, items, timeout=None):
+        """Submit several items at once; they share batches with other callers"""
+        futures = [self.submit(item) for item in items]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def close(self):
+        """Stop the worker thread once the items already queued have run"""
+        self._queue.put((_STOP, None))
+
+    def _collect(self):
+        """Block for the first item, then gather more until full or the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stop = any(item is _STOP for item, _ in batch)
+            live = [(item, f) for item, f in batch if item is not _STOP and f.set_running_or_notify_cancel()]
+            if not live:
+                if stop:
+                    return
+                continue
+            items = [item for item, _ in live]
+            futures = [f for _, f in live]
+            try:
+                outputs = self.predict_fn(self.collate(items))
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+            else:
+                self.batches_run += 1
+                self.items_run += len(items)
+                self.max_batch_seen = max(self.max_batch_seen, len(items))
+                for f, row in zip(futures, outputs):
+                    f.set_result(row)
+            if stop:
+                return
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "avg_batch_size": round(self.items_run / self.batches_run, 2) if self.batches_run else 0,
+            "max_batch_seen": self.max_batch_seen,
+            "queued": self._queue.qsize(),
+        }
@@ -0,0 +1,140 @@
+"""
+Latency of well-behaved clients while another client floods the server.
+
+Runs for --duration seconds. --clients well-behaved clients each send one
+diagnosis every --interval seconds under their own X-API-Key, and honour
+Retry-After on a 429. --abusers threads share a single key and send
+back-to-back requests without backing off. Reports latency p50/p95/p99 and
+status codes for both groups. Compare a server started with admission
+control off and on:
+
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 ADMISSION_ENABLED=0 python main.py
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 python main.py
+
+then, from the backend/ folder:
+
+    python benchmarks/bench_admission.py --url http://localhost:8000 --clients 8 --abusers 32
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import requests
+from PIL import Image
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def sample_jpegs(count):
+    """count distinct JPEGs, so no request is answered from a cache"""
+    sources = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            sources.append(Image.open(os.path.join(SAMPLE_DIR, name)).convert("RGB"))
+    images = []
+    for i in range(count):
+        buf = io.BytesIO()
+        sources[i % len(sources)].save(buf, format="JPEG", quality=50 + i % 45)
+        images.append(buf.getvalue())
+    return images
+
+
+class Group:
+    """Latencies and status codes for one class of client"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, status, ms):
+        with self.lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(ms)
+
+    def report(self, name):
+        total = sum(self.statuses.values())
+        line = f"{name:<13} {total:>5} requests  " + "  ".join(f"{k}: {v}" for k, v in sorted(self.statuses.items()))
+        print(line)
+        if self.latencies:
+            p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99])
+            print(f"{'':<13} 200 latency p50 {p50:.0f} ms  p95 {p95:.0f} ms  p99 {p99:.0f} ms  max {max(self.latencies):.0f} ms")
+
+
+def post(session, url, api_key, data, timeout):
+    t0 = time.perf_counter()
+    try:
+        r = session.post(url, headers={"X-API-Key": api_key}, files={"file": ("leaf.jpg", data)}, timeout=timeout)
+        status, retry_after = r.status_code, float(r.headers.get("Retry-After", "0"))
+    except requests.RequestException:
+        status, retry_after = "error", 0.0
+    return status, retry_after, (time.perf_counter() - t0) * 1000
+
+
+def well_behaved(url, key, images, interval, deadline, group, timeout):
+    session = requests.Session()
+    i = 0
+    next_at = time.perf_counter()
+    while time.perf_counter() < deadline:
+        status, retry_after, ms = post(session, url, key, images[i % len(images)], timeout)
+        group.record(status, ms)
+        i += 1
+        next_at = max(next_at + interval, time.perf_counter() + retry_after)
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+def abuser(url, images, offset, deadline, group, timeout):
+    session = requests.Session()
+    i = offset
+    while time.perf_counter() < deadline:
+        status, _, ms = post(session, url, "abuser", images[i % len(images)], timeout)
+        group.record(status, ms)
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=8, help="Well-behaved clients")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between a well-behaved client's requests")
+    parser.add_argument("--abusers", type=int, default=32, help="Concurrent threads of the abusive client")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client-side request timeout")
+    args = parser.parse_args()
+    url = args.url.rstrip("/") + "/diagnose"
+    images = sample_jpegs(200)
+
+    good, bad = Group(), Group()
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=well_behaved, args=(url, f"client-{i}", images[i::args.clients] or images,
+                                                   args.interval, deadline, good, args.timeout))
+        for i in range(args.clients)
+    ] + [
+        threading.Thread(target=abuser, args=(url, images, i, deadline, bad, args.timeout))
+        for i in range(args.abusers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{args.duration:.0f} s, {args.clients} well-behaved clients every {args.interval:g} s, "
+          f"{args.abusers} abusive threads")
+    good.report("well-behaved")
+    bad.report("abusive")
+    try:
+        admission = requests.get(args.url.rstrip("/") + "/health", timeout=10).json().get("admission")
+        if admission:
+            print("server admission:", {k: admission[k] for k in ("admitted", "rate_limited", "queue_full", "queue_timeout")})
+    except requests.RequestException:
+        pass
+
+
+if __name__ == "__main__":
+    main()
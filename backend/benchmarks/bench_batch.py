@@ -0,0 +1,101 @@
+"""
+Throughput of /diagnose/batch vs. the same images sent one by one.
+
+Builds a scouting walk of --count images by cycling through sample_images
+(each copy slightly re-encoded so the caches cannot answer it), then times:
+
+- "sequential": N back-to-back /diagnose calls, as the frontend does today
+- "batch": one /diagnose/batch request with all N files
+- "batch ndjson": the same with ?format=ndjson, plus time to the first line
+
+Start the server with the caches off so every image reaches the model and
+Groq:
+
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 python main.py
+
+then, from the backend/ folder:
+
+    python benchmarks/bench_batch.py --url http://localhost:8000 --count 50
+    python benchmarks/bench_batch.py --url http://localhost:8000 --count 200 --mode local
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+import requests
+from PIL import Image
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def scouting_walk(count):
+    """count distinct JPEGs: sample images re-encoded at varying quality"""
+    sources = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            sources.append(Image.open(os.path.join(SAMPLE_DIR, name)).convert("RGB"))
+    images = []
+    for i in range(count):
+        buf = io.BytesIO()
+        sources[i % len(sources)].save(buf, format="JPEG", quality=70 + i % 25)
+        images.append((f"leaf_{i:03d}.jpg", buf.getvalue()))
+    return images
+
+
+def time_sequential(base_url, images, mode):
+    t0 = time.perf_counter()
+    for name, data in images:
+        r = requests.post(f"{base_url}/diagnose", params={"mode": mode}, files={"file": (name, data)}, timeout=120)
+        r.raise_for_status()
+    return time.perf_counter() - t0, None
+
+
+def time_batch(base_url, images, mode):
+    files = [("files", (name, data)) for name, data in images]
+    t0 = time.perf_counter()
+    r = requests.post(f"{base_url}/diagnose/batch", params={"mode": mode}, files=files, timeout=600)
+    r.raise_for_status()
+    body = r.json()
+    if body["failed"]:
+        print(f"  batch: {body['failed']} of {body['count']} items failed")
+    return time.perf_counter() - t0, None
+
+
+def time_batch_ndjson(base_url, images, mode):
+    files = [("files", (name, data)) for name, data in images]
+    first = None
+    t0 = time.perf_counter()
+    with requests.post(f"{base_url}/diagnose/batch", params={"mode": mode, "format": "ndjson"},
+                       files=files, stream=True, timeout=600) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if line:
+                json.loads(line)
+                if first is None:
+                    first = time.perf_counter() - t0
+    return time.perf_counter() - t0, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--mode", default="hybrid", choices=["hybrid", "local"])
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+    images = scouting_walk(args.count)
+
+    print(f"{args.count} images, mode={args.mode}")
+    print(f"{'run':>14} {'total s':>9} {'img/s':>8} {'first ms':>9}")
+    baseline = None
+    for label, fn in (("sequential", time_sequential), ("batch", time_batch), ("batch ndjson", time_batch_ndjson)):
+        seconds, first = fn(base_url, images, args.mode)
+        baseline = baseline or seconds
+        first_ms = f"{first * 1000:.0f}" if first is not None else "-"
+        print(f"{label:>14} {seconds:>9.2f} {args.count / seconds:>8.1f} {first_ms:>9}  ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
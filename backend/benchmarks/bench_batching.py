@@ -0,0 +1,109 @@
+"""
+Load benchmark for the local micro-batching queue.
+
+Fires concurrent single-image predictions through MicroBatcher and reports
+images/sec for a range of batch windows. Run from the backend/ folder:
+
+    python benchmarks/bench_batching.py --clients 32 --requests 512
+
+Uses the real network.h5 when TensorFlow and the model are available,
+otherwise pass --synthetic to use a stand-in model with a fixed per-call
+overhead (useful only to sanity check the queue itself).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher
+from image_pipeline import scale_into
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def load_sample_inputs(preprocess):
+    """Preprocess every image in sample_images once"""
+    inputs = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                inputs.append(preprocess(f.read()))
+    return inputs
+
+
+def synthetic_model(call_overhead_ms, per_image_ms):
+    """Stand-in with a fixed per-call cost plus a per-image cost"""
+    def predict(batch):
+        time.sleep((call_overhead_ms + per_image_ms * len(batch)) / 1000.0)
+        return np.full((len(batch), 38), 1.0 / 38, dtype=np.float32)
+    return predict
+
+
+def run(predict_fn, inputs, clients, total, max_batch_size, max_wait_ms):
+    buffer = np.empty((max_batch_size, *inputs[0].shape), dtype=np.float32)
+    batcher = MicroBatcher(
+        predict_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+        collate=lambda items: scale_into(items, buffer)
+    )
+    batcher.predict(inputs[0])  # start worker / warm up
+
+    def one(i):
+        t0 = time.perf_counter()
+        batcher.predict(inputs[i % len(inputs)])
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    stats = batcher.stats()
+    return {
+        "images_per_sec": total / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "avg_batch": stats["avg_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--windows", default="0,1,2,5,10,20", help="Comma separated max_wait_ms values")
+    parser.add_argument("--synthetic", action="store_true", help="Use a stand-in model instead of network.h5")
+    args = parser.parse_args()
+
+    import main as server
+
+    if args.synthetic or not server.MODEL_LOADED:
+        if not args.synthetic:
+            print("network.h5 not loaded - falling back to --synthetic")
+        predict_fn = synthetic_model(call_overhead_ms=20, per_image_ms=2)
+        label = "synthetic (20ms/call + 2ms/image)"
+    else:
+        predict_fn = server.DISEASE_MODEL.predict
+        label = "network.h5"
+
+    inputs = load_sample_inputs(server.preprocess_image_local)
+    print(f"Model: {label} | clients={args.clients} requests={args.requests}")
+
+    # Baseline: batch size 1 == one predict call per request (old behaviour)
+    rows = [("unbatched", run(predict_fn, inputs, args.clients, args.requests, 1, 0))]
+    for window in args.windows.split(","):
+        w = float(window)
+        rows.append((f"{w:g} ms", run(predict_fn, inputs, args.clients, args.requests, args.max_batch_size, w)))
+
+    print(f"\n{'window':>10} {'img/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'avg batch':>10}")
+    for label, r in rows:
+        print(f"{label:>10} {r['images_per_sec']:>10.1f} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} {r['avg_batch']:>10}")
+
+
+if __name__ == "__main__":
+    main()
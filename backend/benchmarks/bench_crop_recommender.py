@@ -0,0 +1,123 @@
+"""
+Latency of the in-process crop recommender (RECOMMENDATION_ENGINE=local).
+
+Times LocalCropRecommender.recommend for random fields in two setups:
+
+- "defaults": no AgroLens artifacts; soil values come from the soil type.
+- "agrolens": nearest-point lookup in a Sentinel feature table, then the
+  soil models. By default the table is synthetic (--points rows over
+  Europe) and the models are stand-ins with the same predict() interface.
+  With --model-dir and --dataset-path it loads the real trained models and
+  {config}_norm.csv instead, the same way main.py does.
+
+Run from the backend/ folder:
+
+    python benchmarks/bench_crop_recommender.py --requests 5000
+    python benchmarks/bench_crop_recommender.py --model-dir $MODEL_PATH --dataset-path $DATASET_PATH
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_recommender import CropScorer, LocalCropRecommender, NutrientPredictors, SentinelFeatureStore
+
+SOILS = ("Red Loam", "Black Cotton", "Alluvial", "Laterite", "Sandy", "Clay", "Loam")
+
+
+class StandInPredictors:
+    """Cheap linear "models" with the NutrientPredictors interface"""
+    name = "agrolens:stand-in"
+
+    def __init__(self, n_features, seed=0):
+        self.weights = np.random.default_rng(seed).random((4, n_features), dtype=np.float32) / n_features
+
+    def predict(self, features):
+        ph, n, p, k = self.weights @ np.asarray(features, dtype=np.float32)
+        return {"pH_H2O": 4.5 + 4 * float(ph), "N": 4 * float(n), "P": 100 * float(p), "K": 500 * float(k)}
+
+
+def synthetic_table(path, points, n_features, seed=0):
+    rng = random.Random(seed)
+    columns = [f"norm_B{i:02d}" for i in range(n_features)]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["POINTID", "TH_LAT", "TH_LONG", *columns])
+        for i in range(points):
+            writer.writerow([i, rng.uniform(35, 60), rng.uniform(-10, 30), *(rng.random() for _ in columns)])
+    return columns
+
+
+def random_fields(count, lat_range, lon_range, seed=1):
+    rng = random.Random(seed)
+    return [
+        (rng.uniform(*lat_range), rng.uniform(*lon_range), {
+            "soil_type": rng.choice(SOILS),
+            "temperature": rng.uniform(12, 35),
+            "humidity": rng.uniform(35, 90),
+            "rainfall": rng.uniform(20, 300),
+        })
+        for _ in range(count)
+    ]
+
+
+def timed(recommender, fields):
+    latencies = []
+    for lat, lon, field in fields:
+        t0 = time.perf_counter()
+        recommender.recommend(field, lat, lon)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return np.array(latencies)
+
+
+def report(label, latencies, recommender):
+    stats = recommender.stats()
+    print(f"{label:>10} {len(latencies):>8} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}"
+          f" {latencies.max():>9.3f}   predicted={stats['predicted']} defaults={stats['soil_type_defaults']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--points", type=int, default=20000, help="Rows in the synthetic Sentinel table")
+    parser.add_argument("--features", type=int, default=12, help="Feature columns in the synthetic table")
+    parser.add_argument("--model-dir", default=None, help="AgroLens MODEL_PATH with trained models")
+    parser.add_argument("--dataset-path", default=None, help="AgroLens DATASET_PATH with {config}_norm.csv")
+    parser.add_argument("--config", default="Model_A")
+    parser.add_argument("--variant", default="xgboost", choices=["xgboost", "rf"])
+    args = parser.parse_args()
+    scorer = CropScorer()
+    fields = random_fields(args.requests, (40, 55), (-5, 25))
+
+    print(f"{'setup':>10} {'calls':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    defaults = LocalCropRecommender(scorer)
+    report("defaults", timed(defaults, fields), defaults)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        if args.model_dir and args.dataset_path:
+            with open(os.path.join(args.dataset_path, "Feature_Cols", "model_settings.json")) as f:
+                settings = json.load(f)[args.config]
+            columns = settings["feature_columns"] + settings.get("optional_feature_columns", [])
+            store = SentinelFeatureStore(os.path.join(args.dataset_path, f"{args.config}_norm.csv"), columns)
+            predictors = NutrientPredictors(args.model_dir, args.config, args.variant)
+        else:
+            path = os.path.join(tmp, "features.csv")
+            columns = synthetic_table(path, args.points, args.features)
+            store = SentinelFeatureStore(path, columns)
+            predictors = StandInPredictors(len(columns))
+        print(f"{'':>10} loaded {len(store)} points and {predictors.name} in {time.perf_counter() - t0:.2f} s")
+        agrolens = LocalCropRecommender(scorer, store, predictors)
+        report("agrolens", timed(agrolens, fields), agrolens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Per-request CPU time and peak allocation of the /diagnose image handling.
+
+Compares the old path (verify, then three separate decodes for the cache
+keys and the float64 model input, plus base64 of the upload) with the
+single-decode pipeline in image_pipeline.py. Sample images are small, so
+--upscale also re-encodes each one as a phone-sized JPEG. Run from the
+backend/ folder:
+
+    python benchmarks/bench_decode.py --upscale 4000
+"""
+import argparse
+import base64
+import hashlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_pipeline import decode_upload, scale_into
+from phash_index import dhash
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+MODEL_INPUT_SIZE = (224, 224)
+
+
+def legacy_path(raw):
+    Image.open(io.BytesIO(raw)).verify()
+    img = Image.open(io.BytesIO(raw)).convert('RGB')
+    hashlib.blake2b(img.tobytes(), digest_size=16).hexdigest()
+    dhash(img)
+    img = Image.open(io.BytesIO(raw)).convert('RGB').resize(MODEL_INPUT_SIZE)
+    np.expand_dims(np.array(img) / 255.0, axis=0)
+    base64.b64encode(raw).decode('utf-8')
+
+
+_buffer = np.empty((1, *MODEL_INPUT_SIZE, 3), dtype=np.float32)
+
+
+def pipeline_path(raw):
+    upload = decode_upload(raw, 512)
+    hashlib.blake2b(upload.image.tobytes(), digest_size=16).hexdigest()
+    dhash(upload.image)
+    scale_into([upload.model_input(MODEL_INPUT_SIZE)], _buffer)
+    upload.base64()
+
+
+def load_samples(upscale):
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+            continue
+        with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+            raw = f.read()
+        if upscale:
+            img = Image.open(io.BytesIO(raw)).convert('RGB')
+            scale = upscale / max(img.size)
+            img = img.resize((int(img.width * scale), int(img.height * scale)))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=90)
+            raw = out.getvalue()
+        samples.append((name, raw))
+    return samples
+
+
+def measure(fn, raw, repeats):
+    fn(raw)  # warm up
+    cpu = time.process_time()
+    for _ in range(repeats):
+        fn(raw)
+    cpu_ms = (time.process_time() - cpu) / repeats * 1000
+
+    tracemalloc.start()
+    fn(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_ms, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--upscale", type=int, default=0, help="Re-encode samples with this long edge (0 = as is)")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'image':>28} {'bytes':>10} {'path':>9} {'cpu ms':>8} {'peak MB':>8}")
+    for name, raw in load_samples(args.upscale):
+        for label, fn in (("legacy", legacy_path), ("pipeline", pipeline_path)):
+            cpu_ms, peak_mb = measure(fn, raw, args.repeats)
+            print(f"{name[-28:]:>28} {len(raw):>10} {label:>9} {cpu_ms:>8.2f} {peak_mb:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold start, memory and per-image latency: Keras network.h5 vs. TFLite.
+
+Each engine is measured in a fresh subprocess so import cost and RSS are not
+shared. Convert the model first (python export_model.py [--int8]), then run
+from the backend/ folder:
+
+    python benchmarks/bench_engines.py --engines keras,tflite,tflite-int8
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "sample_images")
+
+
+def measure(engine, model_path, iterations):
+    """Runs inside the subprocess: load one engine and time it"""
+    t0 = time.perf_counter()
+    import numpy as np
+    from inference_engine import KerasEngine, TFLiteEngine, tflite_path_for
+    from export_model import load_images
+
+    if engine == "keras":
+        runtime = KerasEngine(model_path)
+    else:
+        runtime = TFLiteEngine(tflite_path_for(model_path, int8=engine == "tflite-int8"))
+    image = next(load_images(SAMPLE_DIR, tuple(runtime.input_shape[:2])))[1][None]
+    runtime.predict(image)
+    cold_start = time.perf_counter() - t0
+
+    latencies = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        runtime.predict(image)
+        latencies.append(time.perf_counter() - t)
+
+    return {
+        "engine": engine,
+        "cold_start_s": cold_start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", default="keras,tflite,tflite-int8")
+    parser.add_argument("--model", default=os.path.join(BACKEND_DIR, "network.h5"))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, BACKEND_DIR)
+        print(json.dumps(measure(args.worker, args.model, args.iterations)))
+        return
+
+    print(f"{'engine':>12} {'cold start s':>13} {'peak RSS MB':>12} {'p50 ms':>8} {'p95 ms':>8}")
+    for engine in args.engines.split(","):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", engine,
+             "--model", args.model, "--iterations", str(args.iterations)],
+            capture_output=True, text=True, env={**os.environ, "TF_CPP_MIN_LOG_LEVEL": "2"}
+        )
+        if proc.returncode != 0:
+            print(f"{engine:>12} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr else 'unknown error'}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{engine:>12} {r['cold_start_s']:>13.2f} {r['peak_rss_mb']:>12.0f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Sustained throughput of the /jobs diagnosis queue.
+
+Submits --jobs diagnoses from --clients concurrent submitters (backing off
+on 429 by the Retry-After the server sends), then polls every job until it
+is finished. Reports submit latency p50/p99, how many submissions were
+pushed back, and jobs/sec from the first submit to the last finished job.
+Start the server with the caches off so every job does real work:
+
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 JOBS_WORKERS=8 python main.py
+
+then, from the backend/ folder:
+
+    python benchmarks/bench_jobs.py --url http://localhost:8000 --jobs 200 --clients 16
+"""
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def distinct_images(count):
+    """count distinct JPEGs: sample images re-encoded at varying quality"""
+    sources = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            sources.append(Image.open(os.path.join(SAMPLE_DIR, name)).convert("RGB"))
+    images = []
+    for i in range(count):
+        buf = io.BytesIO()
+        sources[i % len(sources)].save(buf, format="JPEG", quality=60 + i % 35)
+        images.append(buf.getvalue())
+    return images
+
+
+def submit(base_url, data, mode):
+    """(job id, submit latency ms of the accepted attempt, number of 429s)"""
+    pushed_back = 0
+    while True:
+        t0 = time.perf_counter()
+        r = requests.post(f"{base_url}/jobs/diagnose", params={"mode": mode},
+                          files={"file": ("leaf.jpg", data)}, timeout=30)
+        latency = (time.perf_counter() - t0) * 1000
+        if r.status_code == 429:
+            pushed_back += 1
+            time.sleep(float(r.headers.get("Retry-After", "1")))
+            continue
+        r.raise_for_status()
+        return r.json()["job_id"], latency, pushed_back
+
+
+def wait_for(base_url, job_id, poll_seconds):
+    while True:
+        job = requests.get(f"{base_url}/jobs/{job_id}", timeout=30).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--mode", default="hybrid", choices=["hybrid", "local"])
+    parser.add_argument("--poll", type=float, default=0.25, help="Seconds between status polls")
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+    images = distinct_images(args.jobs)
+
+    start_wall = time.time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        submitted = list(pool.map(lambda data: submit(base_url, data, args.mode), images))
+    submit_seconds = time.perf_counter() - start
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        jobs = list(pool.map(lambda s: wait_for(base_url, s[0], args.poll), submitted))
+
+    latencies = np.array([latency for _, latency, _ in submitted])
+    pushed_back = sum(n for _, _, n in submitted)
+    failed = sum(1 for job in jobs if job["status"] == "failed")
+    last_finished = max(job["finished_at"] for job in jobs)
+    run_ms = np.array([(job["finished_at"] - job["started_at"]) * 1000 for job in jobs if job["started_at"]])
+
+    print(f"{args.jobs} jobs, {args.clients} submitters, mode={args.mode}")
+    print(f"submit latency    p50 {np.percentile(latencies, 50):.1f} ms  p99 {np.percentile(latencies, 99):.1f} ms")
+    print(f"submit phase      {submit_seconds:.2f} s ({pushed_back} submissions pushed back with 429)")
+    print(f"job run time      p50 {np.percentile(run_ms, 50):.0f} ms  p99 {np.percentile(run_ms, 99):.0f} ms")
+    print(f"sustained         {args.jobs / (last_finished - start_wall):.1f} jobs/s ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Crop-to-leaf preprocessing: per-image cost, LLM payload and accuracy.
+
+Every image is decoded twice, as the server does: once as it is and once
+with the LeafCropper. The table reports:
+
+- decode and leaf-finding time (p50/p95 ms);
+- how often a leaf was cropped, and the share of the frame kept;
+- bytes of the image sent to Groq, with and without the crop;
+- with the local model loaded: top-1 accuracy (labelled images) and the
+  mean confidence of the local prediction, with and without the crop.
+
+Images come from --images (searched recursively; a file's parent folder
+name is its label when it is a PlantVillage class name), else
+sample_images/. PlantVillage photos are already cropped to the leaf, so
+--field N pastes each one at a random spot on a soil-textured canvas N
+times its size, a stand-in for a farmer's photo. Run from the backend/
+folder:
+
+    python benchmarks/bench_leaf_crop.py --images ~/plantvillage/val --limit 500
+    python benchmarks/bench_leaf_crop.py --images ~/plantvillage/val --limit 500 --field 3
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from image_pipeline import decode_upload
+from leaf_crop import LeafCropper
+
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "sample_images")
+
+
+def load_images(root, limit, class_names):
+    """[(raw bytes, label or None)] for the images under root"""
+    images = []
+    for folder, _, files in sorted(os.walk(root)):
+        label = os.path.basename(folder)
+        for name in sorted(files):
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(folder, name), "rb") as f:
+                    images.append((f.read(), label if label in class_names else None))
+                if limit and len(images) >= limit:
+                    return images
+    return images
+
+
+def field_photo(raw, factor, rng):
+    """The image pasted at a random spot on a soil-textured canvas `factor` times its size, as JPEG"""
+    leaf = Image.open(io.BytesIO(raw)).convert("RGB")
+    width, height = leaf.width * factor, leaf.height * factor
+    soil = np.array([115, 85, 58], dtype=np.int16) + rng.integers(-25, 25, (height // 8, width // 8, 1))
+    soil = soil + rng.integers(-12, 12, (height // 8, width // 8, 3))
+    canvas = Image.fromarray(np.clip(soil, 0, 255).astype(np.uint8)).resize((width, height), Image.BILINEAR)
+    canvas.paste(leaf, (int(rng.integers(0, width - leaf.width + 1)), int(rng.integers(0, height - leaf.height + 1))))
+    out = io.BytesIO()
+    canvas.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def classify(server, uploads):
+    """(class names, confidences %) of the served local model for the uploads, in batches"""
+    predictions = [p for start in range(0, len(uploads), 32) for p in server.predict_many_local(uploads[start:start + 32])]
+    return np.array([p.label for p in predictions], dtype=object), np.array([p.confidence for p in predictions])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=SAMPLE_DIR)
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many images (0 = all)")
+    parser.add_argument("--field", type=int, default=0, help="Paste each image onto a canvas this many times larger")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed decodes per image")
+    parser.add_argument("--analysis-edge", type=int, default=128)
+    parser.add_argument("--max-crop-share", type=float, default=0.85)
+    parser.add_argument("--padding", type=float, default=0.08)
+    args = parser.parse_args()
+
+    os.environ["MODEL_BACKGROUND_LOAD"] = "0"
+    os.environ["LEAF_CROP_ENABLED"] = "0"
+    import main as server
+
+    images = load_images(args.images, args.limit, set(server.CLASS_NAMES))
+    if not images:
+        raise SystemExit(f"No images under {args.images}")
+    if args.field > 1:
+        rng = np.random.default_rng(0)
+        images = [(field_photo(raw, args.field, rng), label) for raw, label in images]
+    cropper = LeafCropper(args.analysis_edge, max_crop_share=args.max_crop_share, padding=args.padding)
+    edge = server.DECODE_TARGET_EDGE
+    print(f"{len(images)} images ({sum(label is not None for _, label in images)} labelled),"
+          f" field canvas x{args.field or 1}, decode edge {edge}")
+
+    plain_ms, cropped_ms, find_ms = [], [], []
+    plain, cropped = [], []
+    for raw, _ in images:
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            upload = decode_upload(raw, edge)
+            t1 = time.perf_counter()
+            cropper.find(upload.image)
+            t2 = time.perf_counter()
+            plain_ms.append((t1 - t0) * 1000)
+            find_ms.append((t2 - t1) * 1000)
+            t0 = time.perf_counter()
+            decode_upload(raw, edge, cropper)
+            cropped_ms.append((time.perf_counter() - t0) * 1000)
+        plain.append(decode_upload(raw, edge))
+        cropped.append(decode_upload(raw, edge, cropper))
+
+    def pcts(values):
+        return f"{np.percentile(values, 50):>7.2f} {np.percentile(values, 95):>7.2f}"
+
+    print(f"\n{'stage':<22} {'p50 ms':>7} {'p95 ms':>7}")
+    print(f"{'decode':<22} {pcts(plain_ms)}")
+    print(f"{'find leaf':<22} {pcts(find_ms)}")
+    print(f"{'decode + crop':<22} {pcts(cropped_ms)}")
+
+    boxes = [upload.crop_box for upload in cropped]
+    kept = [(b[2] - b[0]) * (b[3] - b[1]) / (u.image.width * u.image.height)
+            for b, u in zip(boxes, plain) if b is not None]
+    print(f"\nCropped {len(kept)}/{len(images)} images" + (f", mean share of frame kept {np.mean(kept):.2f}" if kept else ""))
+
+    llm = lambda upload: upload.llm_payload(server.LLM_IMAGE_MAX_EDGE, server.LLM_IMAGE_QUALITY, server.LLM_IMAGE_FORMAT)[2]
+    plain_bytes, cropped_bytes = sum(map(llm, plain)), sum(map(llm, cropped))
+    print(f"LLM image bytes: {plain_bytes / len(images) / 1024:.1f} KiB -> {cropped_bytes / len(images) / 1024:.1f} KiB"
+          f" per image ({(1 - cropped_bytes / plain_bytes) * 100:.1f}% smaller)")
+
+    if not server.MODEL_LOADED:
+        print("\nNo local model loaded - accuracy and confidence skipped")
+        return
+    labels = np.array([label for _, label in images], dtype=object)
+    labelled = np.array([label is not None for label in labels])
+    print(f"\n{'input':<12} {'accuracy':>9} {'confidence':>11}")
+    for name, uploads in (("full frame", plain), ("leaf crop", cropped)):
+        predicted, confidence = classify(server, uploads)
+        accuracy = f"{np.mean(predicted[labelled] == labels[labelled]) * 100:.2f}%" if labelled.any() else "-"
+        print(f"{name:<12} {accuracy:>9} {np.mean(confidence):>10.1f}%")
+
+
+if __name__ == "__main__":
+    main()
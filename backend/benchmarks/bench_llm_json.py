@@ -0,0 +1,169 @@
+"""
+Fuzz and timing harness for the LLM JSON extractor.
+
+The fuzz pass wraps a known-good diagnosis in random prose, markdown fences,
+<thinking> blocks and stray brackets/quotes, and checks that
+extract_json_object still finds it, never raises, and gives up cleanly on
+truncated output. The timing pass grows a set of pathological responses
+(deep nesting, unmatched braces, many small decoy objects, many spans
+that fail to parse, brace-heavy strings) and reports microseconds per KB. The per-KB figure should stay flat
+as the size grows. The old five-method cascade is timed alongside until it
+takes longer than --legacy-limit seconds. Run from the backend/ folder:
+
+    python benchmarks/bench_llm_json.py --fuzz 5000 --sizes 1,10,100,1000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_json import extract_json_object
+
+REQUIRED = ("disease", "crop")
+DIAGNOSIS = {
+    "disease": "Early Blight",
+    "crop": "Tomato",
+    "confidence": 88,
+    "severity": "medium",
+    "symptoms": ["Concentric rings {target spots}", "Yellow halo \"chlorosis\""],
+    "treatment": "Remove infected leaves; apply copper fungicide",
+    "affected_area": "10-20%",
+    "additional_notes": {"weather": "humid", "note": "braces } in [strings] ]"},
+    "recovery_plan": [{"day": 1, "action": "Prune"}, {"day": 7, "action": "Spray"}],
+}
+NOISE = ["{", "}", "[", "]", "\"", "\\", "```", "```json\n", "<thinking>", "</thinking>", "\n", "The leaf ", "{\"x\": 1}"]
+
+
+def legacy_extract(response_text):
+    """The pre-llm_json cascade, kept here only for comparison"""
+    if "<thinking>" in response_text and "</thinking>" in response_text:
+        response_text = re.sub(r'<thinking>.*?</thinking>', '', response_text, flags=re.DOTALL).strip()
+    try:
+        result = json.loads(response_text)
+        if 'disease' in result and 'crop' in result:
+            return result
+    except json.JSONDecodeError:
+        pass
+    for marker in ("```json", "```"):
+        if marker in response_text:
+            try:
+                result = json.loads(response_text.split(marker)[1].split("```")[0].strip())
+                if 'disease' in result and 'crop' in result:
+                    return result
+            except (IndexError, json.JSONDecodeError):
+                pass
+    json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
+    for match in re.findall(json_pattern, response_text, re.DOTALL):
+        try:
+            result = json.loads(match)
+            if 'disease' in result and 'crop' in result:
+                return result
+        except json.JSONDecodeError:
+            continue
+    brace_start, brace_end = response_text.find('{'), response_text.rfind('}')
+    if brace_start != -1 and brace_end > brace_start:
+        try:
+            result = json.loads(response_text[brace_start:brace_end + 1])
+            if 'disease' in result and 'crop' in result:
+                return result
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def random_noise(rng, length):
+    return "".join(rng.choice(NOISE) for _ in range(length))
+
+
+def fuzz(iterations, seed):
+    rng = random.Random(seed)
+    body = json.dumps(DIAGNOSIS, indent=rng.choice([None, 2]))
+    found = failures = 0
+    for _ in range(iterations):
+        before = random_noise(rng, rng.randint(0, 20))
+        # Unclosed openers before the object are fine; an open string or
+        # <thinking> straight in front of it legitimately hides it.
+        before = before.replace('"', "").replace("<thinking>", "")
+        after = random_noise(rng, rng.randint(0, 20))
+        wrapped = rng.choice(["{}", "```json\n{}\n```", "Here you go:\n```\n{}\n```\nThanks", "<thinking>{{x}}</thinking>{}"])
+        text = before + wrapped.replace("{}", body, 1) + after
+        truncate = rng.random() < 0.2
+        if truncate:
+            text = text[:rng.randint(0, len(before) + len(body) - 1)]
+        try:
+            result = extract_json_object(text, REQUIRED)
+        except Exception as e:  # the extractor must never raise
+            failures += 1
+            print(f"raised {e!r} on {text[:120]!r}")
+            continue
+        if truncate:
+            continue
+        if result == DIAGNOSIS:
+            found += 1
+        else:
+            failures += 1
+            if failures <= 5:
+                print(f"missed object in {text[:200]!r}")
+    return found, failures
+
+
+def pathological_cases(size):
+    valid = json.dumps(DIAGNOSIS)
+    return {
+        "prose + object": "lorem ipsum " * (size // 12) + valid,
+        "deep nesting": "{\"a\":" * (size // 5) + "1" + "}" * (size // 5) + valid,
+        "unmatched braces": "{ " * (size // 2) + valid,
+        "decoy objects": "{\"k\": 1} " * (size // 9) + valid,
+        "failing spans": "{x} " * (size // 4) + valid,
+        "failing in stray": "{ " + "{x} " * (size // 4) + valid,
+        "brace strings": "{\"s\": \"" + "{[" * (size // 2) + "\"} " + valid,
+        "no json": "no json here, just text " * (size // 23),
+    }
+
+
+def time_call(fn, text, repeats):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn(text)
+    return (time.perf_counter() - t0) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=5000, help="Fuzz iterations (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", default="1,10,100,1000", help="Response sizes in KB")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--legacy-limit", type=float, default=2.0, help="Stop timing the cascade past this many seconds")
+    args = parser.parse_args()
+
+    if args.fuzz:
+        found, failures = fuzz(args.fuzz, args.seed)
+        print(f"fuzz: {args.fuzz} cases, {found} recovered, {failures} failures")
+
+    print(f"\n{'case':>18} {'KB':>6} {'new ms':>9} {'new us/KB':>10} {'legacy ms':>10} {'found':>6}")
+    legacy_skip = set()
+    for kb in (int(s) for s in args.sizes.split(",")):
+        for name, text in pathological_cases(kb * 1024).items():
+            seconds = time_call(lambda t: extract_json_object(t, REQUIRED), text, args.repeats)
+            found = extract_json_object(text, REQUIRED) is not None
+            legacy = "skipped"
+            if name not in legacy_skip:
+                try:
+                    legacy_seconds = time_call(legacy_extract, text, 1)
+                    legacy = f"{legacy_seconds * 1000:.1f}"
+                except RecursionError:
+                    legacy_seconds, legacy = 0, "raised"
+                if legacy_seconds > args.legacy_limit:
+                    legacy_skip.add(name)
+            size_kb = len(text) / 1024
+            print(f"{name:>18} {size_kb:>6.0f} {seconds * 1000:>9.2f} {seconds * 1e6 / size_kb:>10.1f} {legacy:>10} {str(found):>6}")
+
+
+if __name__ == "__main__":
+    main()
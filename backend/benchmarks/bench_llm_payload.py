@@ -0,0 +1,100 @@
+"""
+LLM image payload size, end-to-end latency and diagnosis agreement.
+
+For every sample image, compares sending the original upload with several
+downscale/recompress settings. Offline it reports bytes on the wire (after
+base64) and shaping CPU time. With --live (needs GROQ_API_KEY) it also sends
+each variant to Groq, times the round trip and checks whether the disease and
+crop match the diagnosis for the original image. Run from the backend/ folder:
+
+    python benchmarks/bench_llm_payload.py --upscale 4000 \\
+        --variants 1024:85:JPEG,768:80:JPEG,512:75:WEBP --live
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_pipeline import decode_upload
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def load_samples(upscale):
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+            continue
+        with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+            raw = f.read()
+        if upscale:
+            img = Image.open(io.BytesIO(raw)).convert('RGB')
+            scale = upscale / max(img.size)
+            img = img.resize((int(img.width * scale), int(img.height * scale)))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=92)
+            raw = out.getvalue()
+        samples.append((name, raw))
+    return samples
+
+
+def build_variants(raw, specs):
+    """[(label, data_url, encoded_bytes, shaping_ms)] with the original first"""
+    import base64
+    variants = [("original", f"data:image/jpeg;base64,{base64.b64encode(raw).decode('utf-8')}", len(raw), 0.0)]
+    for spec in specs:
+        max_edge, quality, fmt = spec.split(":")
+        t0 = time.perf_counter()
+        upload = decode_upload(raw, int(max_edge))
+        image_base64, mime, size = upload.llm_payload(int(max_edge), int(quality), fmt.upper())
+        elapsed = (time.perf_counter() - t0) * 1000
+        variants.append((spec, f"data:{mime};base64,{image_base64}", size, elapsed))
+    return variants
+
+
+def diagnose(server, image_url):
+    t0 = time.perf_counter()
+    completion = server.LLM_GATEWAY.chat(
+        **server.build_diagnosis_request(server.build_diagnosis_prompt(None, 0), image_url)
+    )
+    result = server.parse_diagnosis_response(completion.choices[0].message.content)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", default="1024:85:JPEG,768:80:JPEG,512:75:WEBP", help="max_edge:quality:format,...")
+    parser.add_argument("--upscale", type=int, default=0, help="Re-encode samples with this long edge (0 = as is)")
+    parser.add_argument("--live", action="store_true", help="Also call Groq and compare diagnoses")
+    args = parser.parse_args()
+
+    server = None
+    if args.live:
+        import main as server
+        if not server.AI_READY:
+            print("GROQ_API_KEY not configured - cannot run --live")
+            sys.exit(1)
+
+    print(f"{'image':>24} {'variant':>16} {'wire KB':>9} {'shape ms':>9} {'llm s':>7} {'agrees':>7}")
+    for name, raw in load_samples(args.upscale):
+        reference = None
+        for label, url, size, shape_ms in build_variants(raw, args.variants.split(",")):
+            wire_kb = (len(url) - url.index(",") - 1) / 1024
+            llm_s, agrees = "-", "-"
+            if server is not None:
+                result, elapsed = diagnose(server, url)
+                llm_s = f"{elapsed:.2f}"
+                key = (str(result.get("disease", "")).lower(), str(result.get("crop", "")).lower())
+                if reference is None:
+                    reference = key
+                agrees = "yes" if key == reference else "no"
+            print(f"{name[-24:]:>24} {label:>16} {wire_kb:>9.1f} {shape_ms:>9.1f} {llm_s:>7} {agrees:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Latency of the offline diagnosis path (mode=local).
+
+Reports p50/p99 for three stages:
+
+- "lookup": DiseaseKnowledgeBase.diagnose over every class, i.e. the cost
+  the table adds on top of the forward pass.
+- "in-process": main.diagnose_local on each sample image (decode already
+  done, local model + lookup). Needs the local model.
+- "http": POST /diagnose?mode=local against a running server, with --url.
+
+Run from the backend/ folder:
+
+    python benchmarks/bench_local_diagnosis.py --repeats 200
+    python benchmarks/bench_local_diagnosis.py --url http://localhost:8000 --repeats 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import DiseaseKnowledgeBase
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def load_samples():
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                samples.append((name, f.read()))
+    return samples
+
+
+def timed(fn, items, repeats):
+    """Per-call latencies in ms over repeats passes of items"""
+    latencies = []
+    for _ in range(repeats):
+        for item in items:
+            t0 = time.perf_counter()
+            fn(item)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    return np.array(latencies)
+
+
+def report(label, latencies):
+    if len(latencies) == 0:
+        print(f"{label:>12} {'-':>8} {'-':>9} {'-':>9} {'-':>9}")
+        return
+    print(f"{label:>12} {len(latencies):>8} {np.percentile(latencies, 50):>9.3f} "
+          f"{np.percentile(latencies, 99):>9.3f} {latencies.max():>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--url", default=None, help="Also time /diagnose?mode=local on a running server")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    knowledge = DiseaseKnowledgeBase()
+    print(f"loaded {len(knowledge)} classes in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    print(f"\n{'stage':>12} {'calls':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    classes = list(knowledge.entries)
+    report("lookup", timed(lambda name: knowledge.diagnose(name, 91.5), classes, args.repeats))
+
+    # Load the model before serving so the in-process stage measures a warm model
+    os.environ.setdefault("MODEL_BACKGROUND_LOAD", "0")
+    os.environ.setdefault("LOCAL_BATCH_MAX_WAIT_MS", "0")
+    import main as server
+
+    samples = load_samples()
+    if server.MODEL_LOADED:
+        uploads = [server.as_upload(data) for _, data in samples]
+        server.diagnose_local(uploads[0])  # warm-up
+        report("in-process", timed(server.diagnose_local, uploads, max(1, args.repeats // 10)))
+    else:
+        print(f"{'in-process':>12} skipped: local model not loaded ({server.MODEL_STATE})")
+
+    if args.url:
+        import requests
+
+        base_url = args.url.rstrip("/")
+
+        def post(sample):
+            name, data = sample
+            r = requests.post(f"{base_url}/diagnose", params={"mode": "local"}, files={"file": (name, data)}, timeout=60)
+            r.raise_for_status()
+
+        report("http", timed(post, samples, max(1, args.repeats // 10)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Lookup latency of the near-duplicate (perceptual hash) index vs. index size.
+
+Fills MultiIndexHashTable with random 64-bit hashes and times queries that
+either hit a stored hash with a few flipped bits or miss entirely. Run from
+the backend/ folder:
+
+    python benchmarks/bench_phash.py --sizes 1000,10000,100000,1000000
+
+Random hashes spread evenly over the buckets; real dHashes cluster, so treat
+the numbers as a lower bound and re-check with --distance at your threshold.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phash_index import MultiIndexHashTable
+
+
+def flip_bits(h, n, rng):
+    for bit in rng.sample(range(64), n):
+        h ^= 1 << bit
+    return h
+
+
+def time_queries(index, queries, max_distance):
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.nearest(q, max_distance)
+        latencies.append(time.perf_counter() - t0)
+    return np.array(latencies) * 1e6  # microseconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--distance", type=int, default=6, help="Max Hamming distance for a match")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"max_distance={args.distance}, {args.queries} queries per size\n")
+    print(f"{'entries':>10} {'build s':>8} {'hit p50':>9} {'hit p99':>9} {'miss p50':>9} {'miss p99':>9} (us)")
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        index = MultiIndexHashTable(max_entries=size)
+        stored = [rng.getrandbits(64) for _ in range(size)]
+        t0 = time.perf_counter()
+        for i, h in enumerate(stored):
+            index.add(h, i)
+        build = time.perf_counter() - t0
+
+        near = [flip_bits(rng.choice(stored), rng.randint(0, args.distance), rng) for _ in range(args.queries)]
+        far = [rng.getrandbits(64) for _ in range(args.queries)]
+        hit = time_queries(index, near, args.distance)
+        miss = time_queries(index, far, args.distance)
+
+        print(f"{size:>10} {build:>8.2f} {np.percentile(hit, 50):>9.1f} {np.percentile(hit, 99):>9.1f} "
+              f"{np.percentile(miss, 50):>9.1f} {np.percentile(miss, 99):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
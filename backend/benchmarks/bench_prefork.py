@@ -0,0 +1,174 @@
+"""
+Memory and throughput of serve.py with 1, 4 and 16 pre-forked workers.
+
+For each worker count it starts serve.py as a subprocess, waits until
+/health has answered from every worker, then keeps --concurrency clients
+busy for --seconds (closed loop, one keep-alive connection each) and
+reports requests/s and latency. Memory is read from /proc after the load,
+for the parent and every worker (pids from /health):
+
+- total PSS: what the whole server really uses; shared pages are split
+  between the processes that map them.
+- total RSS: what you would get by adding up `ps` output; shared pages are
+  counted once per process.
+- worker RSS / private: one worker's resident memory, and the part of it
+  that is its own (what each extra worker costs).
+
+The workload is /diagnose?mode=local (local model + knowledge table, no
+Groq) when the model is available, otherwise the CPU-bound local crop
+recommender on /api/planner/recommend_satellite. Groq, admission control
+and the job queue are left off. Run from the backend/ folder:
+
+    python benchmarks/bench_prefork.py
+    python benchmarks/bench_prefork.py --workers 1 4 16 --model-sharing worker --seconds 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from procmem import process_memory
+
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "sample_images")
+FIELD = {"coords": [11.0168, 76.9558, 11.0268, 76.9658], "soil_type": "Red Loam",
+         "temperature": 28, "humidity": 65, "rainfall": 120}
+
+
+def sample_image():
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                return name, f.read()
+    raise SystemExit(f"No sample image in {SAMPLE_DIR}")
+
+
+def start_server(workers, port, sharing, timeout):
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "",
+        "ADMISSION_ENABLED": "0",
+        "JOBS_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+         "--model-sharing", sharing, "--memory-report-seconds", "0"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    seen, health = {}, None
+    deadline = time.monotonic() + timeout
+    while len(seen) < workers and time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"serve.py exited with {proc.returncode}")
+        try:
+            # A fresh connection each time, so the probes land on different workers
+            health = requests.get(f"http://127.0.0.1:{port}/health", timeout=2).json()
+            seen[health["process"]["worker"]] = health["process"]["pid"]
+        except requests.RequestException:
+            time.sleep(0.1)
+    if len(seen) < workers:
+        stop_server(proc)
+        raise SystemExit(f"only {len(seen)}/{workers} workers answered within {timeout:.0f} s")
+    return proc, list(seen.values()), health
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def load(port, endpoint, concurrency, seconds):
+    """Closed-loop load; returns (latencies ms, errors, wall seconds)"""
+    if endpoint == "diagnose":
+        name, image = sample_image()
+        url = f"http://127.0.0.1:{port}/diagnose?mode=local"
+        send = lambda session: session.post(url, files={"file": (name, image, "image/jpeg")}, timeout=60)
+    else:
+        url = f"http://127.0.0.1:{port}/api/planner/recommend_satellite"
+        send = lambda session: session.post(url, json=FIELD, timeout=60)
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client():
+        session = requests.Session()
+        mine, failed = [], 0
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                ok = send(session).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                mine.append((time.perf_counter() - t0) * 1000)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies), errors[0], time.perf_counter() - start
+
+
+def megabytes(value):
+    return value / 2 ** 20 if value is not None else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--model-sharing", choices=["auto", "fork", "worker"], default="auto")
+    parser.add_argument("--endpoint", choices=["auto", "diagnose", "recommend"], default="auto")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for all workers to come up")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} clients, {args.seconds:.0f} s per run")
+    print(f"\n{'workers':>7} {'endpoint':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}"
+          f" {'PSS total':>10} {'RSS total':>10} {'worker RSS':>11} {'private':>8}")
+    for workers in args.workers:
+        proc, pids, health = start_server(workers, args.port, args.model_sharing, args.timeout)
+        try:
+            endpoint = args.endpoint
+            if endpoint == "auto":
+                endpoint = "diagnose" if health["local_model_ready"] else "recommend"
+            load(args.port, endpoint, min(args.concurrency, 4), 1.0)  # warm-up
+            latencies, errors, wall = load(args.port, endpoint, args.concurrency, args.seconds)
+            parent, children = process_memory(proc.pid), [process_memory(pid) for pid in pids]
+        finally:
+            stop_server(proc)
+
+        everyone = [m for m in (parent, *children) if m is not None]
+        total_pss = sum(m["pss"] or 0 for m in everyone)
+        total_rss = sum(m["rss"] for m in everyone)
+        worker_rss = np.mean([m["rss"] for m in children if m]) if any(children) else None
+        worker_private = np.mean([m["private"] for m in children if m]) if any(children) else None
+        p50, p99 = (np.percentile(latencies, q) for q in (50, 99)) if len(latencies) else (float("nan"),) * 2
+        print(f"{workers:>7} {endpoint:>9} {len(latencies) / wall:>8.1f} {p50:>8.1f} {p99:>8.1f} {errors:>6}"
+              f" {megabytes(total_pss):>8.1f}MB {megabytes(total_rss):>8.1f}MB"
+              f" {megabytes(worker_rss):>9.1f}MB {megabytes(worker_private):>6.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Latency of crop recommendation cache hits.
+
+Fills an LRUTTLCache with synthetic recommendations for --fields
+neighbouring fields, then times three stages:
+
+- "quantize": FieldQuantizer.quantize (geohash + climate bins -> key).
+- "memory hit": quantize + get for a key held in memory.
+- "disk hit": the same after the memory layer has been cleared, so each
+  lookup reads SQLite once and promotes the entry back into memory.
+
+With --url it also POSTs the same fields to
+/api/planner/recommend_satellite twice. The first pass fills the server's
+cache (its misses are real Groq calls), the second is served from it. Start
+that server with ADMISSION_ENABLED=0 so the misses are not rate limited.
+Run from the backend/ folder:
+
+    python benchmarks/bench_recommendation_cache.py --fields 2000
+    python benchmarks/bench_recommendation_cache.py --url http://localhost:8000 --fields 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUTTLCache
+from field_keys import FieldQuantizer
+
+SAMPLE_RESULT = {
+    "status": "success",
+    "soil_data": {"ph": 6.8, "n": 120, "p": 45, "k": 35, "type": "Red Loam"},
+    "recommendations": [
+        {"crop": crop, "suitability": 90 - 5 * i, "reason": "Suited to the soil, temperature and rainfall. " * 3}
+        for i, crop in enumerate(("Rice", "Sugarcane", "Banana"))
+    ],
+}
+
+
+def synthetic_fields(count, per_site=20, seed=0):
+    """Fields clustered around count/per_site sites in a ~20 km square.
+
+    Fields at a site are up to ~1 km apart and share soil and, give or take
+    a little noise, climate, like neighbouring plots in SmartPlanner.
+    """
+    rng = random.Random(seed)
+    sites = [
+        (11.0 + rng.uniform(-0.1, 0.1), 76.95 + rng.uniform(-0.1, 0.1),
+         rng.choice(("Red Loam", "Black Cotton", "Alluvial")),
+         rng.uniform(24, 34), rng.uniform(50, 85), rng.uniform(60, 200))
+        for _ in range(max(1, count // per_site))
+    ]
+    fields = []
+    for _ in range(count):
+        lat, lon, soil, temperature, humidity, rainfall = rng.choice(sites)
+        lat, lon = lat + rng.uniform(-0.005, 0.005), lon + rng.uniform(-0.005, 0.005)
+        fields.append({
+            "coords": [lat, lon, lat + 0.01, lon + 0.01],
+            "soil_type": soil,
+            "temperature": round(temperature + rng.uniform(-0.5, 0.5), 1),
+            "humidity": round(humidity + rng.uniform(-1, 1)),
+            "rainfall": round(rainfall + rng.uniform(-5, 5)),
+        })
+    return fields
+
+
+def percentiles(latencies):
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), max(latencies)
+
+
+def report(label, latencies):
+    p50, p99, worst = percentiles(latencies)
+    print(f"{label:>12} {len(latencies):>8} {p50:>9.4f} {p99:>9.4f} {worst:>9.4f}")
+
+
+def timed(fn, fields):
+    latencies = []
+    for field in fields:
+        t0 = time.perf_counter()
+        fn(field)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=2000)
+    parser.add_argument("--url", default=None, help="Also time the endpoint on a running server")
+    args = parser.parse_args()
+    fields = synthetic_fields(args.fields)
+    quantizer = FieldQuantizer()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = LRUTTLCache(max_entries=len(fields), db_path=os.path.join(tmp, "recommendations.db"))
+        keys = {quantizer.quantize(field)[0] for field in fields}
+        for key in keys:
+            cache.set(key, SAMPLE_RESULT)
+        print(f"{len(fields)} fields -> {len(keys)} keys ({len(fields) / len(keys):.1f} fields per key)")
+
+        print(f"\n{'stage':>12} {'calls':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        report("quantize", timed(quantizer.quantize, fields))
+        report("memory hit", timed(lambda f: cache.get(quantizer.quantize(f)[0]), fields))
+        cache._entries.clear()
+        report("disk hit", timed(lambda f: cache.get(quantizer.quantize(f)[0]), fields))
+
+    if args.url:
+        import requests
+        url = args.url.rstrip("/") + "/api/planner/recommend_satellite"
+        for label in ("http 1st", "http 2nd"):
+            sources = []
+
+            def call(field):
+                sources.append(requests.post(url, json=field, timeout=60).json().get("meta", {}).get("source"))
+
+            latencies = timed(call, fields)
+            report(label, latencies)
+            print(f"{'':>12} sources: " + ", ".join(f"{s}={sources.count(s)}" for s in sorted(set(map(str, sources)))))
+
+
+if __name__ == "__main__":
+    main()
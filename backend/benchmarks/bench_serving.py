@@ -0,0 +1,87 @@
+"""
+Side-by-side latency/throughput benchmark: Flask (main.py) vs ASGI (asgi.py).
+
+Start both servers with the caches off so every request does the full
+local + Groq path (point GROQ_BASE_URL at benchmarks/mock_groq.py to
+benchmark offline):
+
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 python main.py
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 uvicorn asgi:app --port 8001
+
+then, from the backend/ folder:
+
+    python benchmarks/bench_serving.py --target flask=http://localhost:8000 \\
+        --target asgi=http://localhost:8001 --concurrency 1,16,64,256
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def load_samples():
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                samples.append((name, f.read()))
+    return samples
+
+
+def run_level(base_url, samples, concurrency, total):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def one(i):
+        name, data = samples[i % len(samples)]
+        t0 = time.perf_counter()
+        try:
+            r = session.post(f"{base_url}/diagnose", files={"file": (name, data)}, timeout=120)
+            ok = r.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - t0, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    errors = sum(1 for r in results if not r[1])
+    return {
+        "rps": total / elapsed,
+        "p50": np.percentile(latencies, 50),
+        "p95": np.percentile(latencies, 95),
+        "p99": np.percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True, help="name=base_url (repeatable)")
+    parser.add_argument("--concurrency", default="1,16,64,256")
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    args = parser.parse_args()
+
+    samples = load_samples()
+    targets = [t.split("=", 1) for t in args.target]
+
+    print(f"{'server':>8} {'conc':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        total = concurrency * args.requests_per_client
+        for name, url in targets:
+            r = run_level(url.rstrip("/"), samples, concurrency, total)
+            print(f"{name:>8} {concurrency:>6} {r['rps']:>9.1f} {r['p50']:>9.0f} {r['p95']:>9.0f} "
+                  f"{r['p99']:>9.0f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Server boot timing: time-to-first-byte on /health and time-to-ready.
+
+Starts main.py as a subprocess and polls until /health answers (the port is
+bound) and until /health/ready returns 200 (local model loaded and warm).
+Compares background loading with the old load-before-serving behaviour.
+Run from the backend/ folder:
+
+    python benchmarks/bench_startup.py --runs 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def boot_once(background, port, timeout):
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "FLASK_DEBUG": "0",
+        "MODEL_BACKGROUND_LOAD": "1" if background else "0",
+    }
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    first_byte = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if first_byte is None:
+                    requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+                    first_byte = time.perf_counter() - start
+                r = requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=1)
+                if r.status_code == 200:
+                    ready = time.perf_counter() - start
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return first_byte, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"{'mode':>12} {'run':>4} {'first byte s':>13} {'ready s':>9}")
+    for background, label in ((False, "blocking"), (True, "background")):
+        for run in range(args.runs):
+            first_byte, ready = boot_once(background, args.port, args.timeout)
+            fmt = lambda v: f"{v:.2f}" if v is not None else "timeout"
+            print(f"{label:>12} {run + 1:>4} {fmt(first_byte):>13} {fmt(ready):>9}")
+
+
+if __name__ == "__main__":
+    main()
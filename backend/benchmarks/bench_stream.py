@@ -0,0 +1,93 @@
+"""
+Time to first useful byte: /diagnose vs /diagnose/stream.
+
+For each sample image, times the blocking endpoint (the first useful byte
+arrives with the whole response) against the SSE endpoint. For the stream it
+records when the local result lands, when the LLM's disease field lands, and
+when the final result lands. Start the server with the caches off so every
+request reaches Groq:
+
+    DIAGNOSIS_CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0 python main.py
+
+then, from the backend/ folder:
+
+    python benchmarks/bench_stream.py --url http://localhost:8000 --repeats 3
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import requests
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_images")
+
+
+def load_samples():
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                samples.append((name, f.read()))
+    return samples
+
+
+def time_blocking(base_url, name, data):
+    t0 = time.perf_counter()
+    r = requests.post(f"{base_url}/diagnose", files={"file": (name, data)}, timeout=120)
+    r.raise_for_status()
+    return (time.perf_counter() - t0) * 1000
+
+
+def time_stream(base_url, name, data):
+    """ms until the local event, the first LLM field and the final result"""
+    marks = {}
+    t0 = time.perf_counter()
+    with requests.post(f"{base_url}/diagnose/stream", files={"file": (name, data)}, stream=True, timeout=120) as r:
+        r.raise_for_status()
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                now = (time.perf_counter() - t0) * 1000
+                marks.setdefault("first_event", now)
+                if event == "local":
+                    marks.setdefault("local", now)
+                elif event == "field" and json.loads(line[len("data: "):])["field"] == "disease":
+                    marks.setdefault("disease", now)
+                elif event in ("result", "error"):
+                    marks["result"] = now
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+
+    rows = {"blocking total": [], "stream first event": [], "stream local": [], "stream disease field": [], "stream result": []}
+    for _ in range(args.repeats):
+        for name, data in load_samples():
+            rows["blocking total"].append(time_blocking(base_url, name, data))
+            marks = time_stream(base_url, name, data)
+            rows["stream first event"].append(marks.get("first_event", np.nan))
+            rows["stream local"].append(marks.get("local", np.nan))
+            rows["stream disease field"].append(marks.get("disease", np.nan))
+            rows["stream result"].append(marks.get("result", np.nan))
+
+    print(f"{'milestone':>22} {'p50 ms':>9} {'p95 ms':>9}")
+    for label, values in rows.items():
+        values = np.array(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            print(f"{label:>22} {'-':>9} {'-':>9}")
+            continue
+        print(f"{label:>22} {np.percentile(values, 50):>9.0f} {np.percentile(values, 95):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
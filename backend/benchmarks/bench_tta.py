@@ -0,0 +1,155 @@
+"""
+Cost and payoff of test-time augmentation (TTA) for the local classifier.
+
+Two tables:
+
+1. Latency per view count: predict_disease_local on every image with TTA
+   forced to 1, 2, ... --max-views views (schedule "0:V"). Reports p50/p95
+   and the extra milliseconds over a single view.
+2. LLM-skip rate: for each --thresholds value (LOCAL_FAST_PATH_CONFIDENCE),
+   the share of images the fast path would answer without Groq, with TTA
+   off and with the adaptive --schedule. Also the mean views per image and,
+   when the images are labelled, the accuracy of the skipped ones (a skip
+   that is wrong is worse than an LLM call).
+
+Images come from --images (searched recursively; a file's parent folder
+name is its label when it is a PlantVillage class name, as in the dataset's
+own layout), else sample_images/. Run from the backend/ folder:
+
+    python benchmarks/bench_tta.py --images ~/plantvillage/val --limit 500
+    python benchmarks/bench_tta.py --schedule 90:1,70:4,0:8 --thresholds 70,80,90
+
+Uses the real network.h5 when TensorFlow and the model are available,
+otherwise pass --synthetic to use a stand-in model (a fixed random
+projection of pooled pixels, plus a per-call and per-image cost). Its
+confidences vary from view to view like a real model's but mean nothing,
+so with it only the latency table is worth reading.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from tta import VIEW_ORDER, TestTimeAugmentation
+
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "sample_images")
+
+
+class SyntheticModel:
+    """Stand-in engine: softmax of a fixed projection of 8x8-pooled pixels"""
+    name = "synthetic"
+
+    def __init__(self, classes, call_overhead_ms=20, per_image_ms=2, seed=0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.normal(0, 1, (8 * 8 * 3, classes)).astype(np.float32)
+        self.call_overhead_ms = call_overhead_ms
+        self.per_image_ms = per_image_ms
+
+    def predict(self, batch):
+        time.sleep((self.call_overhead_ms + self.per_image_ms * len(batch)) / 1000.0)
+        n, h, w, c = batch.shape
+        pooled = batch[:, :h // 8 * 8, :w // 8 * 8].reshape(n, 8, h // 8, 8, w // 8, c).mean(axis=(2, 4))
+        features = pooled.reshape(n, -1)
+        logits = (features - features.mean(axis=1, keepdims=True)) @ self.weights * 4
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def load_images(root, limit, class_names):
+    """[(raw bytes, label or None)] for the images under root"""
+    images = []
+    for folder, _, files in sorted(os.walk(root)):
+        label = os.path.basename(folder)
+        for name in sorted(files):
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(folder, name), "rb") as f:
+                    images.append((f.read(), label if label in class_names else None))
+                if limit and len(images) >= limit:
+                    return images
+    return images
+
+
+def run(server, uploads, tta):
+    """[(class, confidence %, ms)] for every upload with the given TTA (None = off)"""
+    server.LOCAL_TTA = tta
+    results = []
+    for upload in uploads:
+        start = time.perf_counter()
+        predicted_class, confidence = server.predict_disease_local(upload)
+        results.append((predicted_class, confidence, (time.perf_counter() - start) * 1000))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=SAMPLE_DIR)
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many images (0 = all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the images for the latency table")
+    parser.add_argument("--max-views", type=int, default=8)
+    parser.add_argument("--schedule", default="90:1,70:4,0:8")
+    parser.add_argument("--thresholds", default="70,80,90", help="Comma separated fast-path confidences (%%)")
+    parser.add_argument("--synthetic", action="store_true", help="Use a stand-in model instead of network.h5")
+    args = parser.parse_args()
+
+    os.environ["LOCAL_TTA_ENABLED"] = "0"
+    os.environ["MODEL_BACKGROUND_LOAD"] = "0"
+    import main as server
+
+    if args.synthetic or not server.MODEL_LOADED:
+        if not args.synthetic:
+            print("network.h5 not loaded - falling back to --synthetic")
+        server.install_local_engine(SyntheticModel(len(server.CLASS_NAMES)))
+    label = server.DISEASE_MODEL.name
+
+    images = load_images(args.images, args.limit, set(server.CLASS_NAMES))
+    if not images:
+        raise SystemExit(f"No images under {args.images}")
+    # Decode once up front so only the model inputs and inference are timed
+    uploads = [server.as_upload(raw) for raw, _ in images]
+    labels = [truth for _, truth in images]
+    print(f"Model: {label} | {len(images)} images ({sum(t is not None for t in labels)} labelled)"
+          f" | batcher window {server.LOCAL_BATCH_MAX_WAIT_MS:g} ms")
+    run(server, uploads[:1], None)  # start the batcher, warm up
+
+    print(f"\n{'views':>5} {'p50 ms':>8} {'p95 ms':>8} {'extra p50':>10}")
+    baseline = None
+    for views in range(1, min(args.max_views, len(VIEW_ORDER)) + 1):
+        tta = TestTimeAugmentation(f"0:{views}", crop_resize=server.LOCAL_TTA_CROP_RESIZE) if views > 1 else None
+        latencies = [ms for _ in range(args.repeat) for _, _, ms in run(server, uploads, tta)]
+        p50, p95 = np.percentile(latencies, 50), np.percentile(latencies, 95)
+        baseline = p50 if baseline is None else baseline
+        print(f"{views:>5} {p50:>8.1f} {p95:>8.1f} {p50 - baseline:>+10.1f}")
+
+    single = run(server, uploads, None)
+    tta = TestTimeAugmentation(args.schedule, crop_resize=server.LOCAL_TTA_CROP_RESIZE)
+    adaptive = run(server, uploads, tta)
+    stats = tta.stats()
+    mean_views = sum(v * n for v, n in stats["views_used"].items()) / max(1, stats["requests"])
+    print(f"\nTTA schedule {stats['schedule']}: {mean_views:.2f} views/image, views used {stats['views_used']},"
+          f" top class changed on {stats['class_changed']}, mean confidence gain"
+          f" {stats['mean_confidence_gain']} points, mean extra"
+          f" {np.mean([a[2] for a in adaptive]) - np.mean([s[2] for s in single]):+.1f} ms")
+
+    def skips(results, threshold):
+        skipped = [i for i, (_, confidence, _) in enumerate(results) if confidence >= threshold]
+        judged = [i for i in skipped if labels[i] is not None]
+        accuracy = np.mean([results[i][0] == labels[i] for i in judged]) * 100 if judged else None
+        return len(skipped) / len(results) * 100, accuracy
+
+    def pct(value):
+        return f"{value:.1f}%" if value is not None else "-"
+
+    print(f"\n{'threshold':>9} {'skip (1 view)':>14} {'skip (TTA)':>11} {'acc (1 view)':>13} {'acc (TTA)':>10}")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        (skip_single, acc_single), (skip_tta, acc_tta) = skips(single, threshold), skips(adaptive, threshold)
+        print(f"{threshold:>8g}% {pct(skip_single):>14} {pct(skip_tta):>11} {pct(acc_single):>13} {pct(acc_tta):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+End-to-end load test of the API with Groq replaced by mock_groq.py.
+
+Open loop: requests go out on a schedule (--rps, Poisson arrivals unless
+--constant) however slowly the server answers, and each latency is measured
+from the moment the request was due. A server that falls behind shows it in
+the percentiles instead of quietly slowing the load down (coordinated
+omission).
+
+Scenarios, mixed by weight with --mix name:weight,...:
+
+- diagnose: POST /diagnose, one image from sample_images (hybrid mode)
+- diagnose_local: POST /diagnose?mode=local
+- stream: POST /diagnose/stream, read up to the result event (also
+  reports time to the first event)
+- batch: POST /diagnose/batch with --batch-size images
+- recommend: POST /api/planner/recommend_satellite
+- recommend_narrative: the same with "narrative": true
+
+By default the mock runs in this process and the server is started as a
+subprocess pointed at it (--server flask | asgi | prefork; "none" tests
+--url as it is). Caches and admission control are off so every request
+takes the full path; --env KEY=VALUE overrides any server setting.
+
+The report has, per scenario: requests sent, error rate by status,
+throughput, and p50/p95/p99/max latency of the successful requests. --save
+writes it as JSON; --baseline compares against a saved run and exits 1 when
+p95 or p99 grew by more than --max-regression (and --min-delta-ms) or the
+error rate by more than --max-error-increase, which makes this the
+performance regression gate. Run from the backend/ folder:
+
+    python benchmarks/loadtest.py --rps 20 --duration 30
+    python benchmarks/loadtest.py --server asgi --mix diagnose:4,recommend:1 --error-rate 0.02
+    python benchmarks/loadtest.py --save perf-baseline.json
+    python benchmarks/loadtest.py --baseline perf-baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "sample_images")
+sys.path.insert(0, BENCH_DIR)
+
+import mock_groq
+
+SCENARIOS = ("diagnose", "diagnose_local", "stream", "batch", "recommend", "recommend_narrative")
+SOILS = ("Red Loam", "Black Cotton", "Alluvial", "Laterite", "Sandy", "Clay", "Loam")
+# Every request takes the full path unless --env says otherwise
+SERVER_ENV = {
+    "DIAGNOSIS_CACHE_ENABLED": "0",
+    "NEAR_DUPLICATE_ENABLED": "0",
+    "RECOMMENDATION_CACHE_ENABLED": "0",
+    "ADMISSION_ENABLED": "0",
+    "JOBS_ENABLED": "0",
+    "FLASK_DEBUG": "0",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def load_samples():
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+                samples.append((name, f.read()))
+    if not samples:
+        raise SystemExit(f"No sample images in {SAMPLE_DIR}")
+    return samples
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition(":")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def random_field(rng):
+    lat, lon = rng.uniform(8, 28), rng.uniform(70, 88)
+    return {"coords": [lat, lon, lat + 0.01, lon + 0.01], "soil_type": rng.choice(SOILS),
+            "temperature": round(rng.uniform(18, 34), 1), "humidity": round(rng.uniform(40, 90)),
+            "rainfall": round(rng.uniform(40, 250))}
+
+
+class LoadTest:
+    """Sends the scenario mix on an open-loop schedule and keeps every outcome"""
+
+    def __init__(self, base_url, samples, batch_size=4, timeout=60.0, seed=0):
+        self.base_url = base_url.rstrip("/")
+        self.samples = samples
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.results = []  # (scenario, status, latency ms, first event ms or None)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def sample(self):
+        return self.samples[self.rng.randrange(len(self.samples))]
+
+    def send(self, scenario, due):
+        """One request; status is the HTTP code, "timeout" or "connection" """
+        first_event = None
+        try:
+            if scenario in ("diagnose", "diagnose_local"):
+                params = {"mode": "local"} if scenario == "diagnose_local" else None
+                response = self.session.post(f"{self.base_url}/diagnose", params=params,
+                                             files={"file": self.sample()}, timeout=self.timeout)
+                status = response.status_code
+            elif scenario == "batch":
+                files = [("files", self.sample()) for _ in range(self.batch_size)]
+                response = self.session.post(f"{self.base_url}/diagnose/batch", files=files, timeout=self.timeout)
+                status = response.status_code
+            elif scenario == "stream":
+                with self.session.post(f"{self.base_url}/diagnose/stream", files={"file": self.sample()},
+                                       stream=True, timeout=self.timeout) as response:
+                    status, seen_result = response.status_code, False
+                    for line in response.iter_lines():
+                        if line.startswith(b"event:"):
+                            if first_event is None:
+                                first_event = (time.perf_counter() - due) * 1000
+                            seen_result = seen_result or line == b"event: result"
+                            if line == b"event: error":
+                                status = "stream_error"
+                    if status == 200 and not seen_result:
+                        status = "no_result"
+            else:
+                field = random_field(self.rng)
+                if scenario == "recommend_narrative":
+                    field["narrative"] = True
+                response = self.session.post(f"{self.base_url}/api/planner/recommend_satellite",
+                                             json=field, timeout=self.timeout)
+                status = response.status_code
+        except requests.Timeout:
+            status = "timeout"
+        except requests.RequestException:
+            status = "connection"
+        latency = (time.perf_counter() - due) * 1000
+        with self._lock:
+            self.results.append((scenario, status, latency, first_event))
+
+    def run(self, mix, rps, duration, max_in_flight=512, constant=False):
+        """Open-loop schedule; returns the achieved send rate"""
+        names, weights = list(mix), list(mix.values())
+        schedule_rng = random.Random(self.rng.random())
+        sent = 0
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            start = time.perf_counter()
+            due = start
+            while True:
+                due += 1.0 / rps if constant else schedule_rng.expovariate(rps)
+                if due - start >= duration:
+                    break
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # Timed from `due`, so time spent waiting for a free client counts too
+                pool.submit(self.send, schedule_rng.choices(names, weights)[0], due)
+                sent += 1
+        return sent / duration
+
+
+def summarize(results, duration):
+    """{scenario: stats} plus an "all" row"""
+    groups = {}
+    for row in results:
+        groups.setdefault(row[0], []).append(row)
+    groups["all"] = list(results)
+    summary = {}
+    for name, rows in groups.items():
+        ok = np.array([latency for _, status, latency, _ in rows if status == 200])
+        errors = {}
+        for _, status, _, _ in rows:
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        first_events = [first for _, status, _, first in rows if status == 200 and first is not None]
+        percentile = lambda values, q: round(float(np.percentile(values, q)), 1) if len(values) else None
+        summary[name] = {
+            "sent": len(rows),
+            "ok": len(ok),
+            "error_rate": round(1 - len(ok) / len(rows), 4),
+            "errors": errors,
+            "throughput": round(len(ok) / duration, 2),
+            "p50_ms": percentile(ok, 50),
+            "p95_ms": percentile(ok, 95),
+            "p99_ms": percentile(ok, 99),
+            "max_ms": round(float(ok.max()), 1) if len(ok) else None,
+            "first_event_p50_ms": percentile(first_events, 50),
+        }
+    return summary
+
+
+def print_summary(summary):
+    fmt = lambda v: f"{v:.0f}" if v is not None else "-"
+    print(f"\n{'scenario':>20} {'sent':>6} {'ok':>6} {'err %':>6} {'ok/s':>7} {'p50 ms':>8} {'p95 ms':>8}"
+          f" {'p99 ms':>8} {'max ms':>8}  errors")
+    for name, s in summary.items():
+        errors = " ".join(f"{status}={count}" for status, count in sorted(s["errors"].items()))
+        print(f"{name:>20} {s['sent']:>6} {s['ok']:>6} {100 * s['error_rate']:>6.1f} {s['throughput']:>7.1f}"
+              f" {fmt(s['p50_ms']):>8} {fmt(s['p95_ms']):>8} {fmt(s['p99_ms']):>8} {fmt(s['max_ms']):>8}  {errors}")
+        if s["first_event_p50_ms"] is not None:
+            print(f"{'':>20} first event p50 {s['first_event_p50_ms']:.0f} ms")
+
+
+def compare(summary, baseline, max_regression, max_error_increase, min_delta_ms=10.0):
+    """Regression messages against a saved summary (empty when within tolerance).
+
+    A percentile regresses when it grew by more than max_regression and by
+    more than min_delta_ms, so jitter on millisecond paths is not a failure.
+    """
+    failures = []
+    for name, s in summary.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if (s[metric] is not None and base[metric] and s[metric] > base[metric] * (1 + max_regression)
+                    and s[metric] - base[metric] > min_delta_ms):
+                failures.append(f"{name} {metric}: {base[metric]:.0f} -> {s[metric]:.0f} ms "
+                                f"(+{100 * (s[metric] / base[metric] - 1):.0f}%, limit {100 * max_regression:.0f}%)")
+        if s["error_rate"] > base["error_rate"] + max_error_increase:
+            failures.append(f"{name} error rate: {100 * base['error_rate']:.1f}% -> {100 * s['error_rate']:.1f}%")
+    return failures
+
+
+def start_server(kind, port, groq_env, workers, extra_env, timeout):
+    env = {**os.environ, **SERVER_ENV, "PORT": str(port), **groq_env, **extra_env}
+    command = {
+        "flask": [sys.executable, "main.py"],
+        "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"],
+        "prefork": [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)],
+    }[kind]
+    proc = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{kind} server exited with {proc.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"{kind} server was not ready within {timeout:.0f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["flask", "asgi", "prefork", "none"], default="flask")
+    parser.add_argument("--url", default=None, help="Server to test with --server none")
+    parser.add_argument("--port", type=int, default=8767, help="Port for the server started here")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for --server prefork")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Server setting (repeatable)")
+    parser.add_argument("--mix", type=parse_mix, default="diagnose:4,stream:1,batch:1,recommend:3,recommend_narrative:1")
+    parser.add_argument("--rps", type=float, default=10.0, help="Offered load, requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--constant", action="store_true", help="Evenly spaced arrivals instead of Poisson")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--no-mock", action="store_true", help="Do not start the mock (use the server's own Groq)")
+    parser.add_argument("--save", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare with results saved by --save")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95/p99 growth vs the baseline")
+    parser.add_argument("--max-error-increase", type=float, default=0.01, help="Allowed error-rate growth")
+    parser.add_argument("--min-delta-ms", type=float, default=10.0,
+                        help="Latency growth below this many ms never counts as a regression")
+    mock_groq.add_arguments(parser)
+    args = parser.parse_args()
+    if args.server == "none" and not args.url:
+        parser.error("--server none needs --url")
+
+    mock = server = proc = None
+    groq_env = {}
+    if not args.no_mock:
+        mock = mock_groq.mock_from_args(args)
+        server, groq_url = mock_groq.start_in_thread(mock)
+        groq_env = {"GROQ_API_KEY": "mock-key", "GROQ_BASE_URL": groq_url}
+    if args.server != "none":
+        extra_env = dict(item.split("=", 1) for item in args.env)
+        proc = start_server(args.server, args.port, groq_env, args.workers, extra_env, args.startup_timeout)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+
+    try:
+        test = LoadTest(base_url, load_samples(), args.batch_size, args.timeout, args.seed)
+        print(f"{args.server} server at {base_url}, {args.rps:g} req/s offered for {args.duration:g} s, mix "
+              + ", ".join(f"{name}:{weight:g}" for name, weight in args.mix.items()))
+        achieved = test.run(args.mix, args.rps, args.duration, args.max_in_flight, args.constant)
+        summary = summarize(test.results, args.duration)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if server is not None:
+            server.shutdown()
+
+    print(f"sent {achieved:.1f} req/s")
+    print_summary(summary)
+    if mock is not None:
+        served = mock.stats()["served"]
+        print("\nmock Groq: " + "; ".join(
+            f"{kind} " + " ".join(f"{outcome}={count}" for outcome, count in outcomes.items())
+            for kind, outcomes in served.items()))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"config": {key: value for key, value in vars(args).items() if key != "latency"},
+                       "summary": summary}, f, indent=2)
+        print(f"\nsaved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["summary"]
+        failures = compare(summary, baseline, args.max_regression, args.max_error_increase, args.min_delta_ms)
+        if failures:
+            print("\nREGRESSION vs " + args.baseline)
+            for failure in failures:
+                print("  " + failure)
+            sys.exit(1)
+        print(f"\nwithin tolerance of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
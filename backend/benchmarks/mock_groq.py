@@ -0,0 +1,392 @@
+"""
+Recorded-replay stand-in for the Groq chat completions API.
+
+Point the server at it with GROQ_BASE_URL=http://127.0.0.1:18080 (any
+GROQ_API_KEY) and every Groq call is answered from a recordings file
+instead of the network, with a latency and error mix you choose. Used by
+benchmarks/loadtest.py; also handy on its own for bench_serving.py and
+friends.
+
+Replay: each request is classified as diagnosis (it has an image),
+recommendation, narrative or other, and keyed by a hash of its model,
+prompt text and image. An exact key match replays that recording;
+otherwise a random recording of the same kind is used. stream=True
+requests get the content back as chat.completion.chunk events.
+
+Record: with --record --upstream https://api.groq.com requests are
+forwarded (with the caller's Authorization header), answered with the real
+completion and appended to the recordings file along with the observed
+latency. The bundled groq_recordings.json holds hand-written completions
+in the recorded format; record against the real API to replace them.
+
+Latency (--latency): "recorded" (each recording's latency_ms), "fixed:MS",
+"uniform:LO:HI", "normal:MEAN:SD" or "lognormal:MEDIAN:SIGMA", scaled by
+--latency-scale. Streams send the first chunk after --ttft-fraction of it
+and spread the rest over the remainder. Errors: --error-rate answers 500,
+--rate-limit-rate 429 with Retry-After, --timeout-rate holds the request
+for --hang-seconds before a 504. GET /stats returns what was served.
+
+    python benchmarks/mock_groq.py --port 18080 --latency lognormal:900:0.5 --error-rate 0.01
+    python benchmarks/mock_groq.py --record --upstream https://api.groq.com
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "groq_recordings.json")
+KINDS = ("diagnosis", "recommendation", "narrative", "other")
+STREAM_CHUNK_CHARS = 16
+
+
+def request_kind(body):
+    """diagnosis | recommendation | narrative | other, from the prompt shape"""
+    texts, has_image = message_parts(body)
+    if has_image:
+        return "diagnosis"
+    text = "\n".join(texts)
+    if '"reasons"' in text:
+        return "narrative"
+    if '"recommendations"' in text:
+        return "recommendation"
+    return "other"
+
+
+def message_parts(body):
+    """(text parts, whether any part is an image) of a chat completions body"""
+    texts, has_image = [], False
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                has_image = True
+                texts.append("image:" + hashlib.sha256(part["image_url"]["url"].encode()).hexdigest())
+    return texts, has_image
+
+
+def request_key(body):
+    texts, _ = message_parts(body)
+    return hashlib.sha256(json.dumps([body.get("model"), texts]).encode()).hexdigest()[:20]
+
+
+def parse_latency(spec):
+    """Latency spec -> fn(recorded_ms) returning milliseconds"""
+    name, *params = spec.split(":")
+    try:
+        values = [float(p) for p in params]
+        if name == "recorded" and not values:
+            return lambda recorded: recorded
+        if name == "fixed" and len(values) == 1:
+            return lambda recorded: values[0]
+        if name == "uniform" and len(values) == 2:
+            return lambda recorded: random.uniform(*values)
+        if name == "normal" and len(values) == 2:
+            return lambda recorded: max(0.0, random.gauss(*values))
+        if name == "lognormal" and len(values) == 2:
+            return lambda recorded: random.lognormvariate(math.log(values[0]), values[1])
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(
+        f"bad latency spec {spec!r}: use recorded, fixed:MS, uniform:LO:HI, normal:MEAN:SD or lognormal:MEDIAN:SIGMA"
+    )
+
+
+class Recordings:
+    """Recorded completions, by key and by kind"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)["completions"]
+        self._index()
+
+    def _index(self):
+        self.by_key = {entry["key"]: entry for entry in self.entries if entry.get("key")}
+        self.by_kind = {kind: [e for e in self.entries if e["kind"] == kind] for kind in KINDS}
+
+    def find(self, key, kind):
+        """(recording, "exact" | "kind"), or (None, None)"""
+        if key in self.by_key:
+            return self.by_key[key], "exact"
+        candidates = self.by_kind.get(kind)
+        if candidates:
+            return random.choice(candidates), "kind"
+        return None, None
+
+    def add(self, entry):
+        with self._lock:
+            self.entries = [e for e in self.entries if e.get("key") != entry["key"]] + [entry]
+            self._index()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "completions": self.entries}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class MockGroq:
+    """Replay/record policy and counters shared by the request handlers"""
+
+    def __init__(self, recordings, latency="recorded", latency_scale=1.0, ttft_fraction=0.3, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, timeout_rate=0.0, hang_seconds=60.0, upstream=None):
+        self.recordings = recordings
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.latency_scale = latency_scale
+        self.ttft_fraction = ttft_fraction
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, kind, outcome):
+        with self._lock:
+            self.counts.setdefault(kind, {}).setdefault(outcome, 0)
+            self.counts[kind][outcome] += 1
+
+    def fault(self):
+        """None, or the injected failure for this request"""
+        roll = random.random()
+        for outcome, rate in (("timeout", self.timeout_rate), ("rate_limited", self.rate_limit_rate),
+                              ("error", self.error_rate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return None
+
+    def latency_ms(self, recording):
+        return self.latency(recording.get("latency_ms", 0.0)) * self.latency_scale
+
+    def stats(self):
+        with self._lock:
+            counts = json.loads(json.dumps(self.counts))
+        return {"recordings": {kind: len(entries) for kind, entries in self.recordings.by_kind.items()},
+                "mode": "record" if self.upstream else "replay", "served": counts}
+
+
+def completion_body(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": max(1, len(content) // 4), "total_tokens": 0},
+    }
+
+
+def chunk_body(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None  # MockGroq, set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.mock.stats())
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"mock_groq only serves chat completions, not {self.path}"}})
+            return
+        kind, key = request_kind(body), request_key(body)
+
+        if self.mock.upstream:
+            recording = self.record(body, kind, key)
+            if recording is None:
+                return
+            outcome, delay_ms = "recorded", 0.0
+        else:
+            fault = self.mock.fault()
+            if fault is not None:
+                self.mock.count(kind, fault)
+                self.send_fault(fault)
+                return
+            recording, outcome = self.mock.recordings.find(key, kind)
+            if recording is None:
+                self.mock.count(kind, "no_recording")
+                self.send_json(500, {"error": {"message": f"no recording for {kind} requests"}})
+                return
+            delay_ms = self.mock.latency_ms(recording)
+
+        self.mock.count(kind, outcome)
+        model = body.get("model", recording.get("model", "mock"))
+        if body.get("stream"):
+            self.stream(model, recording["content"], delay_ms)
+        else:
+            time.sleep(delay_ms / 1000)
+            self.send_json(200, completion_body(model, recording["content"]))
+
+    def send_fault(self, fault):
+        if fault == "timeout":
+            time.sleep(self.mock.hang_seconds)
+            self.send_json(504, {"error": {"message": "mock upstream timeout"}})
+        elif fault == "rate_limited":
+            self.send_json(429, {"error": {"message": "mock rate limit", "type": "rate_limit_exceeded"}},
+                           headers=[("Retry-After", f"{self.mock.retry_after:g}")])
+        else:
+            self.send_json(500, {"error": {"message": "mock internal error"}})
+
+    def stream(self, model, content, delay_ms):
+        """Chunked text/event-stream, first chunk after ttft_fraction of delay_ms"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+        time.sleep(delay_ms * self.mock.ttft_fraction / 1000)
+        gap = delay_ms * (1 - self.mock.ttft_fraction) / 1000 / len(pieces)
+        self.write_event(chunk_body(completion_id, model, {"role": "assistant", "content": ""}))
+        for piece in pieces:
+            self.write_event(chunk_body(completion_id, model, {"content": piece}))
+            time.sleep(gap)
+        self.write_event(chunk_body(completion_id, model, {}, "stop"))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_event(self, body):
+        self.write_chunk(f"data: {json.dumps(body)}\n\n".encode())
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def record(self, body, kind, key):
+        """Forward to the real API and store the completion; None if the upstream failed"""
+        import httpx
+
+        upstream_body = {**body, "stream": False}
+        start = time.perf_counter()
+        try:
+            response = httpx.post(
+                f"{self.mock.upstream}/openai/v1/chat/completions", json=upstream_body, timeout=120,
+                headers={"Authorization": self.headers.get("Authorization", "")}
+            )
+        except httpx.HTTPError as e:
+            self.mock.count(kind, "upstream_error")
+            self.send_json(502, {"error": {"message": f"upstream unreachable: {e}"}})
+            return None
+        latency_ms = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            self.mock.count(kind, f"upstream_{response.status_code}")
+            self.send_json(response.status_code, response.json())
+            return None
+        recording = {
+            "kind": kind,
+            "key": key,
+            "model": body.get("model"),
+            "latency_ms": round(latency_ms, 1),
+            "content": response.json()["choices"][0]["message"]["content"],
+        }
+        self.mock.recordings.add(recording)
+        return recording
+
+
+def make_server(mock, host="127.0.0.1", port=18080):
+    """ThreadingHTTPServer serving mock; call serve_forever() (or run it on a thread)"""
+    handler = type("MockGroqHandler", (Handler,), {"mock": mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(mock, host="127.0.0.1", port=0):
+    """Start a mock on a daemon thread; returns (server, base_url)"""
+    server = make_server(mock, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-groq", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    """Mock settings shared with loadtest.py"""
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--latency", type=parse_latency, default="recorded",
+                        help="recorded | fixed:MS | uniform:LO:HI | normal:MEAN:SD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--ttft-fraction", type=float, default=0.3, help="Share of the latency before the first chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429s, seconds")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Share held for --hang-seconds, then 504")
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+
+
+def mock_from_args(args, upstream=None):
+    return MockGroq(
+        Recordings(args.recordings),
+        latency=args.latency,
+        latency_scale=args.latency_scale,
+        ttft_fraction=args.ttft_fraction,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        upstream=upstream,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--record", action="store_true", help="Forward to --upstream and save the completions")
+    parser.add_argument("--upstream", default="https://api.groq.com")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_args(args, upstream=args.upstream if args.record else None)
+    server = make_server(mock, args.host, args.port)
+    counts = ", ".join(f"{kind}={len(entries)}" for kind, entries in mock.recordings.by_kind.items())
+    print(f"mock Groq ({'record' if args.record else 'replay'}) on http://{args.host}:{args.port}"
+          f" with {counts} from {args.recordings}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(mock.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Small LRU + TTL result cache with an optional SQLite backing store.
+
+The in-memory layer is an OrderedDict kept in recency order. When a db_path
+is given every entry is also written to SQLite so cached results survive a
+server restart; memory misses fall through to disk and are promoted back.
+Values must be JSON serialisable. A process forked from the one that
+created the cache (a pre-forked worker) opens its own SQLite connection.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl_seconds"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400, db_path=None, name="cache"):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.name = name
+        self._entries = OrderedDict()  # key -> (stored_at, json_text)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self._db = None
+        self._db_pid = None
+        self._inherited_dbs = []
+        self._db_path = db_path
+        if db_path:
+            self._open_db()
+            self._prune_disk()
+
+    def _open_db(self):
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stored_at REAL, value TEXT)"
+        )
+        self._db.commit()
+        self._db_pid = os.getpid()
+
+    def _disk(self):
+        """This process's SQLite connection, or None (call with the lock held)"""
+        if self._db is not None and self._db_pid != os.getpid():
+            # A connection must not be used across fork(), not even to close
+            # it, so the inherited one is kept referenced and never touched
+            self._inherited_dbs.append(self._db)
+            self._open_db()
+        return self._db
+
+    def _expired(self, stored_at, now):
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def get(self, key):
+        """Return a fresh copy of the cached value, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[0], now):
+                    del self._entries[key]
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+
+            db = self._disk()
+            if entry is None and db is not None:
+                row = db.execute(
+                    "SELECT stored_at, value FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    entry = (row[0], row[1])
+                    self._insert(key, entry)
+                    self.disk_hits += 1
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Decode outside the lock; callers get their own copy to mutate
+        return json.loads(entry[1])
+
+    def set(self, key, value):
+        entry = (time.time(), json.dumps(value))
+        with self._lock:
+            self._insert(key, entry)
+            db = self._disk()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries (key, stored_at, value) VALUES (?, ?, ?)",
+                    (key, entry[0], entry[1])
+                )
+                db.commit()
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self):
+        """Drop expired rows from the SQLite store"""
+        if self._db is None or self.ttl <= 0:
+            return
+        with self._lock:
+            db = self._disk()
+            db.execute("DELETE FROM entries WHERE stored_at < ?", (time.time() - self.ttl,))
+            db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            db = self._disk()
+            if db is not None:
+                db.execute("DELETE FROM entries")
+                db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,168 @@
+"""
+Fit the temperature that calibrates the local model's confidence.
+
+Runs the served engine over a labelled folder (one sub-folder per class,
+named as in CLASS_NAMES, as in the PlantVillage layout), with the same
+preprocessing the server uses. It then fits the temperature T that
+minimises the negative log-likelihood of the true classes and reports the
+expected calibration error (ECE) before and after. ECE is the gap between
+confidence and accuracy, averaged over confidence bins.
+The result is written to calibration.json, which main.py loads on start
+(LOCAL_CALIBRATION_PATH). Fit on images the model was not trained on.
+
+    python calibrate_model.py --images ~/plantvillage/val
+    python calibrate_model.py --images ~/plantvillage/val --tta-schedule 90:1,70:4,0:8
+    python calibrate_model.py --images ~/plantvillage/test --check   # ECE of the current file only
+    python calibrate_model.py --images ~/plantvillage/val --manifest models/plantvillage-v2
+
+With --manifest, the model, class list, input size and normalization come
+from a model registry folder (MODEL_REGISTRY_DIR) and the result is written
+next to its manifest, where the registry loads it from.
+
+With LOCAL_TTA_ENABLED=1 in production, pass the same --tta-schedule:
+averaged views are calibrated differently from single ones. Likewise run
+it with the server's LEAF_CROP_* settings in the environment.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from calibration import Calibration, expected_calibration_error, fit_temperature, negative_log_likelihood, summarize
+from image_pipeline import InvalidImageError, decode_upload
+from inference_engine import load_engine
+from model_registry import ModelManifest
+from tta import TestTimeAugmentation
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def labelled_images(image_dir, class_names):
+    """Yield (path, class index) for images in class-named sub-folders"""
+    index = {name: i for i, name in enumerate(class_names)}
+    for root, _, files in sorted(os.walk(image_dir)):
+        label = index.get(os.path.basename(root))
+        if label is None:
+            continue
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name), label
+
+
+def model_probabilities(engine, paths, manifest, decode_edge, batch_size, tta=None, cropper=None):
+    """(N, C) softmax output for the images, preprocessed as the server does"""
+    buffer = np.empty((batch_size, *manifest.input_size, 3), dtype=np.float32)
+    input_size = manifest.input_size[::-1]  # PIL order
+    predict_many = lambda items: np.concatenate([
+        engine.predict(manifest.normalize_into(items[i:i + batch_size], buffer)).copy()
+        for i in range(0, len(items), batch_size)
+    ])
+    rows = []
+    for start in range(0, len(paths), batch_size):
+        uploads = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                uploads.append(decode_upload(f.read(), decode_edge, cropper))
+        inputs = [upload.model_input(input_size) for upload in uploads]
+        firsts = predict_many(inputs)
+        if tta is not None:
+            zoomed = [lambda upload=upload: upload.model_input(tta.zoomed_size(input_size)) for upload in uploads]
+            firsts = tta.refine_many(list(firsts), inputs, zoomed, predict_many)
+        rows.extend(firsts)
+    return np.array(rows, dtype=np.float64)
+
+
+def report(name, probabilities, labels, bins):
+    top, top_p, _, _ = summarize(probabilities, 1)
+    correct = top[:, 0] == labels
+    ece, table = expected_calibration_error(top_p[:, 0], correct, bins)
+    print(f"\n{name}: accuracy {correct.mean() * 100:.2f}%, mean confidence {top_p[:, 0].mean() * 100:.2f}%,"
+          f" NLL {negative_log_likelihood(probabilities, labels):.4f}, ECE {ece * 100:.2f}%")
+    print(f"{'bin':>11} {'images':>7} {'confidence':>11} {'accuracy':>9}")
+    for low, high, count, confidence, accuracy in table:
+        print(f"{low * 100:>4.0f}-{high * 100:>3.0f}% {count:>8} {confidence * 100:>10.1f}% {accuracy * 100:>8.1f}%")
+    return ece
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Folder with one sub-folder of images per class")
+    parser.add_argument("--model", default="network.h5")
+    parser.add_argument("--manifest", default=None, help="Model registry folder to calibrate instead of --model")
+    parser.add_argument("--engine", default=os.getenv("LOCAL_ENGINE", "auto"), choices=["auto", "tflite", "keras"])
+    parser.add_argument("--int8", action="store_true", default=os.getenv("LOCAL_ENGINE_INT8", "0") == "1")
+    parser.add_argument("--output", default=None, help="Calibration file (default: LOCAL_CALIBRATION_PATH, or the"
+                        " manifest's calibration file with --manifest)")
+    parser.add_argument("--tta-schedule", default=None, help="Calibrate the TTA-averaged output (LOCAL_TTA_SCHEDULE)")
+    parser.add_argument("--tta-crop-resize", type=int, default=int(os.getenv("LOCAL_TTA_CROP_RESIZE", "256")))
+    parser.add_argument("--decode-edge", type=int, default=int(os.getenv("DECODE_TARGET_EDGE", "512")))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many images (0 = all)")
+    parser.add_argument("--bins", type=int, default=15)
+    parser.add_argument("--check", action="store_true", help="Only report the ECE of the existing --output file")
+    args = parser.parse_args()
+
+    # Class names and preprocessing come from the server itself
+    os.environ["PREFORK_PARENT"] = "1"  # skips the model load and job workers on import
+    import main as server
+
+    if args.manifest:
+        manifest = ModelManifest.read(args.manifest)
+    else:
+        manifest = ModelManifest("default", args.model, server.CLASS_NAMES, input_size=server.MODEL_INPUT_SIZE,
+                                 calibration_path=server.LOCAL_CALIBRATION_PATH)
+    args.output = args.output or manifest.calibration_path
+
+    samples = list(labelled_images(args.images, manifest.class_names))
+    if args.limit:
+        rng = np.random.default_rng(0)
+        samples = [samples[i] for i in sorted(rng.choice(len(samples), min(args.limit, len(samples)), replace=False))]
+    if not samples:
+        print(f"No labelled images under {args.images} (expected sub-folders named after the classes)")
+        sys.exit(1)
+    if not os.path.exists(manifest.model_path):
+        print(f"Model file not found at {manifest.model_path}")
+        sys.exit(1)
+
+    engine = load_engine(manifest.model_path, preference=args.engine, int8=args.int8)
+    tta = TestTimeAugmentation(args.tta_schedule, crop_resize=args.tta_crop_resize) if args.tta_schedule else None
+    start = time.perf_counter()
+    paths, labels = [path for path, _ in samples], np.array([label for _, label in samples])
+    try:
+        probabilities = model_probabilities(
+            engine, paths, manifest, args.decode_edge, args.batch_size, tta, server.LEAF_CROPPER
+        )
+    except InvalidImageError as e:
+        print(f"Unreadable image: {e}")
+        sys.exit(1)
+    print(f"{len(labels)} images, {len(set(labels.tolist()))} classes, engine {engine.name},"
+          f" TTA {args.tta_schedule or 'off'} ({time.perf_counter() - start:.1f} s)")
+
+    if args.check:
+        current = Calibration.load(args.output)
+        print(f"Temperature in {args.output}: {current.temperature:.4f}")
+        report("Uncalibrated", probabilities, labels, args.bins)
+        report("Calibrated", current.apply(probabilities), labels, args.bins)
+        return
+
+    temperature = fit_temperature(probabilities, labels)
+    calibration = Calibration(temperature)
+    before = report("Uncalibrated (T = 1)", probabilities, labels, args.bins)
+    after = report(f"Calibrated (T = {temperature:.4f})", calibration.apply(probabilities), labels, args.bins)
+    calibration.save(
+        args.output,
+        images=len(labels),
+        engine=engine.name,
+        model=manifest.name,
+        version=manifest.version,
+        tta_schedule=args.tta_schedule,
+        ece_before=round(before, 5),
+        ece_after=round(after, 5)
+    )
+    print(f"\n✅ Wrote {args.output} (a registry model is reloaded on the next poll; otherwise restart the server)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Calibrated confidence for the local disease classifier.
+
+A softmax score is not a probability of being right: a network trained
+with cross-entropy is usually overconfident. Temperature scaling fixes most
+of that with one number T, fitted offline on a labelled folder
+(calibrate_model.py): probabilities become softmax(log(p) / T). T > 1
+softens the scores and T < 1 sharpens them. The top class never changes.
+
+Each prediction then carries the top-k classes with calibrated
+probabilities, the normalised entropy of the whole distribution (0 = all
+mass on one class, 1 = uniform) and the margin between the first two
+classes. One vectorised pass computes all of them for a whole batch of rows.
+RoutingPolicy decides from them whether the local answer is good enough to
+skip the LLM.
+"""
+import json
+import os
+
+import numpy as np
+
+EPSILON = 1e-12
+
+
+def temperature_scale(probabilities, temperature):
+    """Re-normalised softmax(log(p) / T) of (N, C) probabilities"""
+    logits = np.log(np.clip(np.asarray(probabilities, dtype=np.float64), EPSILON, None)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def summarize(probabilities, k):
+    """Top-k indices and probabilities, normalised entropy and top-1/top-2 margin for (N, C) rows"""
+    n, classes = probabilities.shape
+    k = min(k, classes)
+    top = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    top_p = np.take_along_axis(probabilities, top, axis=1)
+    order = np.argsort(-top_p, axis=1)
+    top, top_p = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_p, order, axis=1)
+    entropy = -(probabilities * np.log(np.clip(probabilities, EPSILON, None))).sum(axis=1) / np.log(classes)
+    if k > 1:
+        margin = top_p[:, 0] - top_p[:, 1]
+    else:
+        margin = top_p[:, 0] - np.partition(probabilities, classes - 2, axis=1)[:, classes - 2]
+    return top, top_p, entropy, margin
+
+
+def negative_log_likelihood(probabilities, labels):
+    return float(-np.mean(np.log(np.clip(probabilities[np.arange(len(labels)), labels], EPSILON, None))))
+
+
+def fit_temperature(probabilities, labels, low=0.05, high=20.0, iterations=60):
+    """Temperature minimising the NLL of labels (golden-section search on log T)"""
+    probabilities, labels = np.asarray(probabilities), np.asarray(labels)
+    loss = lambda log_t: negative_log_likelihood(temperature_scale(probabilities, np.exp(log_t)), labels)
+    a, b = np.log(low), np.log(high)
+    ratio = (np.sqrt(5) - 1) / 2
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    loss_c, loss_d = loss(c), loss(d)
+    for _ in range(iterations):
+        if loss_c < loss_d:
+            b, d, loss_d = d, c, loss_c
+            c = b - ratio * (b - a)
+            loss_c = loss(c)
+        else:
+            a, c, loss_c = c, d, loss_d
+            d = a + ratio * (b - a)
+            loss_d = loss(d)
+    return float(np.exp((a + b) / 2))
+
+
+def expected_calibration_error(confidences, correct, bins=15):
+    """ECE: |accuracy - mean confidence| per confidence bin, weighted by the bin's share.
+
+    Returns (ece, [(bin low, bin high, count, mean confidence, accuracy)]).
+    Confidences are in [0, 1].
+    """
+    confidences, correct = np.asarray(confidences, dtype=np.float64), np.asarray(correct, dtype=np.float64)
+    edges = np.linspace(0, 1, bins + 1)
+    index = np.clip(np.digitize(confidences, edges[1:-1], right=True), 0, bins - 1)
+    ece, table = 0.0, []
+    for b in range(bins):
+        mask = index == b
+        count = int(mask.sum())
+        if not count:
+            continue
+        confidence, accuracy = float(confidences[mask].mean()), float(correct[mask].mean())
+        ece += count / len(confidences) * abs(accuracy - confidence)
+        table.append((float(edges[b]), float(edges[b + 1]), count, confidence, accuracy))
+    return ece, table
+
+
+class LocalPrediction(tuple):
+    """(class name, calibrated confidence %) plus the rest of the distribution.
+
+    Unpacks like the (class, confidence) pair callers have always used.
+    top_k is [(class, %)], entropy is in [0, 1], margin is in % points;
+    model is the id of the model version that made it.
+    """
+
+    def __new__(cls, label, confidence, top_k=(), entropy=None, margin=None, raw_confidence=None, model=None):
+        self = super().__new__(cls, (label, confidence))
+        self.top_k = list(top_k)
+        self.entropy = entropy
+        self.margin = margin
+        self.raw_confidence = raw_confidence
+        self.model = model
+        return self
+
+    def timed(self, ms):
+        """(class, confidence, ms) triple, as timed_local_prediction returns, keeping the details"""
+        timed = tuple.__new__(LocalPrediction, (self[0], self[1], ms))
+        timed.__dict__.update(self.__dict__)
+        return timed
+
+    @property
+    def label(self):
+        return self[0]
+
+    @property
+    def confidence(self):
+        return self[1]
+
+    def details(self):
+        """JSON-ready top-k, entropy and margin (and the model version, when known)"""
+        details = {
+            "top_k": [{"class": label, "confidence": round(p, 2)} for label, p in self.top_k],
+            "entropy": None if self.entropy is None else round(self.entropy, 4),
+            "margin": None if self.margin is None else round(self.margin, 2),
+        }
+        if self.model is not None:
+            details["model"] = self.model
+        return details
+
+
+class Calibration:
+    """Temperature scaling plus top-k summaries for model output rows"""
+
+    def __init__(self, temperature=1.0, top_k=3, source=None):
+        self.temperature = float(temperature)
+        self.top_k = top_k
+        self.source = source  # what the temperature was fitted on, from the calibration file
+
+    @classmethod
+    def load(cls, path, top_k=3):
+        """Calibration from a file written by calibrate_model.py; T = 1 when there is none"""
+        if not path or not os.path.exists(path):
+            return cls(1.0, top_k)
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["temperature"], top_k, source=data)
+
+    def save(self, path, **fitted):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"temperature": self.temperature, **fitted}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def apply(self, probabilities):
+        probabilities = np.atleast_2d(np.asarray(probabilities, dtype=np.float64))
+        return probabilities if self.temperature == 1.0 else temperature_scale(probabilities, self.temperature)
+
+    def predictions(self, rows, class_names, model=None):
+        """One LocalPrediction per row of model output, all computed together"""
+        if not len(rows):
+            return []
+        raw = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+        top, top_p, entropy, margin = summarize(self.apply(raw), self.top_k)
+        raw_top = raw[np.arange(len(raw)), top[:, 0]]
+        return [
+            LocalPrediction(
+                class_names[top[i, 0]], float(top_p[i, 0]) * 100,
+                top_k=[(class_names[c], float(p) * 100) for c, p in zip(top[i], top_p[i])],
+                entropy=float(entropy[i]),
+                margin=float(margin[i]) * 100,
+                raw_confidence=float(raw_top[i]) * 100,
+                model=model
+            )
+            for i in range(len(raw))
+        ]
+
+    def stats(self):
+        fitted = {k: v for k, v in (self.source or {}).items() if k != "temperature"}
+        return {"temperature": self.temperature, "top_k": self.top_k, "fitted": bool(self.source), **fitted}
+
+
+class RoutingPolicy:
+    """When the local answer alone is good enough to skip the LLM.
+
+    All set conditions must hold: calibrated confidence >= min_confidence (%),
+    margin >= min_margin (% points) and entropy <= max_entropy. A
+    min_confidence of 0 turns the local-only path off; min_margin 0 and
+    max_entropy 1 leave those checks out.
+    """
+
+    def __init__(self, min_confidence=0.0, min_margin=0.0, max_entropy=1.0):
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.max_entropy = max_entropy
+
+    def reason(self, prediction):
+        """None when the LLM can be skipped, else why it is needed"""
+        if self.min_confidence <= 0:
+            return "disabled"
+        if prediction is None or prediction[0] is None:
+            return "no_prediction"
+        if prediction[1] < self.min_confidence:
+            return "low_confidence"
+        margin, entropy = getattr(prediction, "margin", None), getattr(prediction, "entropy", None)
+        if self.min_margin > 0 and margin is not None and margin < self.min_margin:
+            return "low_margin"
+        if self.max_entropy < 1 and entropy is not None and entropy > self.max_entropy:
+            return "high_entropy"
+        return None
+
+    def skip_llm(self, prediction):
+        return self.reason(prediction) is None
+
+    def stats(self):
+        return {"min_confidence": self.min_confidence, "min_margin": self.min_margin, "max_entropy": self.max_entropy}
@@ -0,0 +1,276 @@
+"""
+In-process crop recommendations grounded in AgroLens soil predictions.
+
+Three parts, all loaded once when the server starts:
+
+- SentinelFeatureStore: the preprocessed AgroLens table
+  ({config}_norm.csv), one row of normalised Sentinel-2 features per
+  LUCAS point. A lookup returns the features of the nearest point, if it
+  is within max_distance_km of the field.
+- NutrientPredictors: the models trained by
+  agrolens/nutrients_predictor (XGBoost .json or random forest .joblib,
+  one per target). They predict pH, N, P and K from those features.
+- CropScorer: crop_requirements.json, with ideal pH, temperature, rainfall
+  and humidity ranges, preferred soils and N/P/K demand for each crop. It
+  ranks crops with the suitability model below.
+
+When there is no Sentinel point near the field, or the models are not
+available, the soil values come from typical figures for the requested soil
+type. soil_data.source says which was used.
+
+Each factor scores 1 inside a crop's range and falls linearly to 0 one
+tolerance outside it. Suitability is the weighted geometric mean of the
+factors, so a single deal-breaker (pH far off, far too little rain) sinks a
+crop however well the rest fits.
+"""
+import csv
+import json
+import logging
+import math
+import os
+
+import numpy as np
+
+REQUIREMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crop_requirements.json")
+TARGETS = ("pH_H2O", "N", "P", "K")
+SOIL_UNITS = {"n": "g/kg", "p": "mg/kg", "k": "mg/kg"}
+
+# Tolerance outside a crop's range before a factor scores 0, and its weight
+FACTORS = {
+    "ph": (1.0, 0.25),
+    "temperature": (6.0, 0.25),
+    "rainfall": (80.0, 0.2),
+    "humidity": (20.0, 0.1),
+    "soil": (None, 0.1),
+    "nutrients": (None, 0.1),
+}
+FACTOR_FLOOR = 0.02
+NUTRIENT_SHORTFALL = {"high": 0.6, "medium": 0.85, "low": 1.0}
+
+log = logging.getLogger(__name__)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from one point to arrays of points"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(a))
+
+
+class SentinelFeatureStore:
+    """Normalised Sentinel-2 features of the AgroLens points, by location"""
+
+    def __init__(self, csv_path, feature_columns, max_distance_km=10.0):
+        self.path = csv_path
+        self.feature_columns = list(feature_columns)
+        self.max_distance_km = float(max_distance_km)
+        lats, lons, rows = [], [], []
+        with open(csv_path, newline="") as f:
+            for record in csv.DictReader(f):
+                try:
+                    row = [float(record[column]) for column in self.feature_columns]
+                    lat, lon = float(record["TH_LAT"]), float(record["TH_LONG"])
+                except (KeyError, ValueError):
+                    continue
+                lats.append(lat)
+                lons.append(lon)
+                rows.append(row)
+        self.lats = np.array(lats)
+        self.lons = np.array(lons)
+        self.features = np.array(rows, dtype=np.float32).reshape(len(rows), len(self.feature_columns))
+
+    def __len__(self):
+        return len(self.features)
+
+    def nearest(self, lat, lon):
+        """(feature row, distance km) of the closest point, or (None, distance) beyond max_distance_km"""
+        if not len(self):
+            return None, None
+        # Cheap bounding-box prefilter before the exact distance
+        margin = self.max_distance_km / 111.0
+        lon_margin = margin / max(math.cos(math.radians(lat)), 0.01)
+        candidates = np.flatnonzero(
+            (np.abs(self.lats - lat) <= margin) & (np.abs(self.lons - lon) <= lon_margin)
+        )
+        if not len(candidates):
+            return None, None
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance_km:
+            return None, float(distances[best])
+        return self.features[candidates[best]], float(distances[best])
+
+    def stats(self):
+        return {"path": self.path, "points": len(self), "features": len(self.feature_columns),
+                "max_distance_km": self.max_distance_km}
+
+
+class NutrientPredictors:
+    """One trained AgroLens model per soil target, loaded once"""
+
+    def __init__(self, model_dir, config="Model_A", variant="xgboost", targets=TARGETS):
+        self.config = config
+        self.variant = variant
+        self.models = {}
+        for target in targets:
+            base = os.path.join(model_dir, config, variant, f"{config}_{variant}_{target}")
+            self.models[target] = self._load(base)
+
+    def _load(self, base):
+        if self.variant == "xgboost":
+            import xgboost as xgb
+            booster = xgb.Booster()
+            booster.load_model(f"{base}.json")
+            return booster
+        if self.variant == "rf":
+            import joblib
+            return joblib.load(f"{base}.joblib")
+        raise ValueError(f"Unsupported AgroLens model variant: {self.variant} (use xgboost or rf)")
+
+    @property
+    def name(self):
+        return f"agrolens:{self.config}/{self.variant}"
+
+    def predict(self, features):
+        """{target: value} for one feature row"""
+        row = np.asarray(features, dtype=np.float32).reshape(1, -1)
+        if self.variant == "xgboost":
+            # inplace_predict skips building a DMatrix for a single row
+            return {target: float(model.inplace_predict(row)[0]) for target, model in self.models.items()}
+        return {target: float(model.predict(row)[0]) for target, model in self.models.items()}
+
+
+def range_score(value, low, high, tolerance):
+    if low <= value <= high:
+        return 1.0
+    gap = low - value if value < low else value - high
+    return max(0.0, 1.0 - gap / tolerance)
+
+
+def nutrient_level(value, thresholds):
+    low, high = thresholds
+    return "low" if value < low else ("medium" if value <= high else "high")
+
+
+class CropScorer:
+    """Rules-based crop suitability from crop_requirements.json"""
+
+    def __init__(self, path=REQUIREMENTS_PATH):
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+        self.soil_types = table["soil_types"]
+        self.nutrient_levels = table["nutrient_levels"]
+        self.crops = table["crops"]
+
+    def soil_profile(self, soil_type):
+        """(matched soil type, typical pH/N/P/K) for a free-text soil type"""
+        name = " ".join(str(soil_type).split()).lower()
+        if name in self.soil_types:
+            return name, self.soil_types[name]
+        # "Red Sandy Loam" -> the longest known type it mentions
+        for known in sorted(self.soil_types, key=len, reverse=True):
+            if all(word in name.split() for word in known.split()):
+                return known, self.soil_types[known]
+        return None, self.soil_types["loam"]
+
+    def score(self, crop, field, soil, soil_match):
+        """(suitability 0-100, reason)"""
+        need = self.crops[crop]
+        scores = {
+            "ph": range_score(soil["ph"], *need["ph"], FACTORS["ph"][0]),
+            "temperature": range_score(field["temperature"], *need["temperature"], FACTORS["temperature"][0]),
+            "rainfall": range_score(field["rainfall"], *need["rainfall"], FACTORS["rainfall"][0]),
+            "humidity": range_score(field["humidity"], *need["humidity"], FACTORS["humidity"][0]),
+            "soil": 1.0 if soil_match in need["soils"] else (0.85 if soil_match is None else 0.6),
+        }
+        short = [
+            nutrient for nutrient in ("n", "p", "k")
+            if nutrient_level(soil[nutrient], self.nutrient_levels[nutrient]) == "low"
+        ]
+        scores["nutrients"] = min((NUTRIENT_SHORTFALL[need["demand"][n]] for n in short), default=1.0)
+
+        log_score = sum(FACTORS[name][1] * math.log(max(value, FACTOR_FLOOR)) for name, value in scores.items())
+        suitability = round(100 * math.exp(log_score))
+        return suitability, self.reason(crop, field, soil, soil_match, scores, short)
+
+    def reason(self, crop, field, soil, soil_match, scores, short):
+        need = self.crops[crop]
+        values = {"ph": soil["ph"], "temperature": field["temperature"],
+                  "rainfall": field["rainfall"], "humidity": field["humidity"]}
+        labels = {"ph": ("soil pH", ""), "temperature": ("temperature", "°C"),
+                  "rainfall": ("rainfall", " mm/month"), "humidity": ("humidity", "%")}
+        fits, concerns = [], []
+        for name, (label, unit) in labels.items():
+            low, high = need[name]
+            text = f"{label} {values[name]:g}{unit}"
+            if scores[name] == 1.0:
+                fits.append(f"{text} is within its {low:g}-{high:g}{unit} range")
+            else:
+                side = "below" if values[name] < low else "above"
+                concerns.append(f"{text} is {side} its {low:g}-{high:g}{unit} range")
+        if soil_match in need["soils"]:
+            fits.append(f"it does well on {soil_match} soil")
+        demanding = [n.upper() for n in short if need["demand"][n] != "low"]
+        if demanding:
+            concerns.append(f"the soil is low in {', '.join(demanding)}, so plan to fertilise")
+        sentence = (fits[:2] and "Suitable because " + " and ".join(fits[:2]) + ".") or ""
+        if concerns:
+            sentence += (" " if sentence else "") + "Watch out: " + "; ".join(concerns[:2]) + "."
+        return f"{sentence} {need['note']}".strip()
+
+    def rank(self, field, soil, soil_match, top_k=3):
+        ranked = []
+        for crop in self.crops:
+            suitability, reason = self.score(crop, field, soil, soil_match)
+            ranked.append({"crop": crop, "suitability": suitability, "reason": reason})
+        ranked.sort(key=lambda entry: -entry["suitability"])
+        return ranked[:top_k]
+
+
+class LocalCropRecommender:
+    """Soil estimate (AgroLens or soil-type defaults) + CropScorer ranking"""
+
+    def __init__(self, scorer, features=None, predictors=None, top_k=3):
+        self.scorer = scorer
+        self.features = features
+        self.predictors = predictors
+        self.top_k = top_k
+        self.predicted = 0
+        self.defaulted = 0
+
+    def soil_estimate(self, field, lat, lon):
+        soil_match, typical = self.scorer.soil_profile(field["soil_type"])
+        soil = {"ph": typical["ph"], "n": typical["n"], "p": typical["p"], "k": typical["k"]}
+        source, details = "soil_type_defaults", {}
+        if self.features is not None and self.predictors is not None:
+            row, distance = self.features.nearest(lat, lon)
+            if row is not None:
+                predicted = self.predictors.predict(row)
+                soil = {"ph": predicted["pH_H2O"], "n": predicted["N"], "p": predicted["P"], "k": predicted["K"]}
+                source, details = self.predictors.name, {"sentinel_point_km": round(distance, 2)}
+        if source == "soil_type_defaults":
+            self.defaulted += 1
+        else:
+            self.predicted += 1
+        soil = {name: round(value, 2) for name, value in soil.items()}
+        return soil, soil_match, source, details
+
+    def recommend(self, field, lat, lon):
+        """Result in the LLM recommendation schema (status, soil_data, recommendations)"""
+        climate = {name: float(field[name]) for name in ("temperature", "humidity", "rainfall")}
+        soil, soil_match, source, details = self.soil_estimate(field, lat, lon)
+        return {
+            "status": "success",
+            "soil_data": {**soil, "type": field["soil_type"], "source": source, "units": SOIL_UNITS, **details},
+            "recommendations": self.scorer.rank(climate, soil, soil_match, self.top_k),
+        }
+
+    def stats(self):
+        return {
+            "crops": len(self.scorer.crops),
+            "soil_model": self.predictors.name if self.predictors else None,
+            "sentinel_features": self.features.stats() if self.features else None,
+            "predicted": self.predicted,
+            "soil_type_defaults": self.defaulted,
+        }
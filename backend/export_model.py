@@ -0,0 +1,120 @@
+"""
+Convert network.h5 into a TFLite artifact for the lightweight runtime.
+
+The converted model is cached next to the .h5 (network.tflite, or
+network.int8.tflite when quantized) and main.py picks it up on start.
+
+    python export_model.py                 # float32 -> network.tflite
+    python export_model.py --int8          # int8 weights, calibrated on sample_images
+    python export_model.py --check         # accuracy parity vs. the Keras model
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from inference_engine import KerasEngine, TFLiteEngine, is_fresh, load_keras_model, tflite_path_for
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_images")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_images(image_dir, input_size=(224, 224)):
+    """Yield (path, float32 model input) for every image under image_dir"""
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                img = Image.open(path).convert('RGB').resize(input_size)
+                yield path, np.asarray(img, dtype=np.float32) / 255.0
+
+
+def convert_to_tflite(model_path, out_path, int8=False, calibration_dir=SAMPLE_DIR):
+    """Convert a Keras .h5 model to TFLite, optionally with int8 quantization"""
+    import tensorflow as tf
+
+    model = load_keras_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if int8:
+        samples = [arr for _, arr in load_images(calibration_dir, tuple(model.input_shape[1:3]))]
+        if not samples:
+            raise ValueError(f"No calibration images found in {calibration_dir}")
+
+        def representative_dataset():
+            # Flips stretch a small calibration folder a little further
+            for arr in samples:
+                for view in (arr, arr[:, ::-1], arr[::-1, :]):
+                    yield [np.expand_dims(view, 0).astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+
+    tflite_model = converter.convert()
+
+    # Write atomically so a server starting mid-export never reads half a file
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, out_path)
+    print(f"✅ Wrote {out_path} ({len(tflite_model) / 1e6:.1f} MB)")
+    return out_path
+
+
+def check_parity(model_path, tflite_path, image_dir):
+    """Compare Keras and TFLite predictions; returns top-1 agreement in [0, 1]"""
+    keras_engine = KerasEngine(model_path)
+    lite_engine = TFLiteEngine(tflite_path)
+
+    images = list(load_images(image_dir, tuple(keras_engine.input_shape[:2])))
+    if not images:
+        raise ValueError(f"No images found in {image_dir}")
+    batch = np.stack([arr for _, arr in images])
+
+    reference = keras_engine.predict(batch)
+    converted = lite_engine.predict(batch)
+
+    agreement = float(np.mean(reference.argmax(axis=1) == converted.argmax(axis=1)))
+    max_abs = float(np.max(np.abs(reference - converted)))
+    mean_abs = float(np.mean(np.abs(reference - converted)))
+
+    print(f"Images checked:        {len(images)}")
+    print(f"Top-1 agreement:       {agreement * 100:.2f}%")
+    print(f"Max |prob difference|: {max_abs:.5f}")
+    print(f"Mean |prob difference|:{mean_abs:.6f}")
+    return agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="network.h5")
+    parser.add_argument("--int8", action="store_true", help="Quantize using the calibration images")
+    parser.add_argument("--calibration-dir", default=SAMPLE_DIR)
+    parser.add_argument("--force", action="store_true", help="Reconvert even if the cached artifact is fresh")
+    parser.add_argument("--check", action="store_true", help="Run the accuracy parity check after export")
+    parser.add_argument("--images", default=SAMPLE_DIR, help="Image folder for the parity check")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Model file not found at {args.model}")
+        sys.exit(1)
+
+    out_path = tflite_path_for(args.model, args.int8)
+    if args.force or not is_fresh(out_path, args.model):
+        convert_to_tflite(args.model, out_path, int8=args.int8, calibration_dir=args.calibration_dir)
+    else:
+        print(f"{out_path} is up to date (use --force to reconvert)")
+
+    if args.check:
+        agreement = check_parity(args.model, out_path, args.images)
+        if agreement < args.min_agreement:
+            print(f"❌ Agreement below {args.min_agreement * 100:.0f}%")
+            sys.exit(1)
+        print("✅ Parity check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Cache keys for crop recommendations.
+
+SmartPlanner sends nearly identical field conditions for neighbouring
+fields, so recommendations are cached under a quantized version of the
+request:
+
+- the geohash cell that contains the centre of the field's bbox
+- the soil type, lower-cased with whitespace collapsed
+- temperature, humidity and rainfall, each rounded to a bin
+
+FieldQuantizer.quantize also returns a representative field (the cell's
+bounds and the bin values). The LLM is asked about that field, so every
+request that maps to a key gets the answer that key stands for. The
+cells() and bins() helpers enumerate a region for cache warming.
+"""
+import math
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+KEY_VERSION = "v1"
+
+
+def geohash_encode(lat, lon, precision=5):
+    """Standard base-32 geohash of a point"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, bits, value, even = [], 0, 0, True
+    while len(code) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            code.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(code)
+
+
+def geohash_bounds(code):
+    """(lat_min, lon_min, lat_max, lon_max) of a geohash cell"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in code:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def bbox_center(coords):
+    """Centre of a [lat1, lon1, lat2, lon2] bbox (or a [lat, lon] point)"""
+    values = [float(v) for v in coords]
+    if len(values) == 2:
+        lat, lon = values
+    elif len(values) == 4:
+        lat, lon = (values[0] + values[2]) / 2, (values[1] + values[3]) / 2
+    else:
+        raise ValueError(f"coords must have 2 or 4 numbers, got {len(values)}")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"coords out of range: {lat}, {lon}")
+    return lat, lon
+
+
+def bin_value(value, step):
+    """value rounded to the nearest multiple of step (halves round up)"""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"not a finite number: {value}")
+    return round(math.floor(value / step + 0.5) * step, 6)
+
+
+def normalize_soil(soil_type):
+    return " ".join(str(soil_type).split()).lower()
+
+
+class FieldQuantizer:
+    """Maps field conditions to a cache key and the representative field for that key"""
+
+    def __init__(self, geohash_precision=5, temperature_step=2.0, humidity_step=5.0, rainfall_step=20.0):
+        self.precision = int(geohash_precision)
+        self.steps = {"temperature": float(temperature_step), "humidity": float(humidity_step),
+                      "rainfall": float(rainfall_step)}
+
+    def quantize(self, field):
+        """(key, representative field); raises ValueError for a field that cannot be keyed"""
+        try:
+            cell = geohash_encode(*bbox_center(field["coords"]), precision=self.precision)
+            climate = {name: bin_value(field[name], step) for name, step in self.steps.items()}
+        except (TypeError, KeyError) as e:
+            raise ValueError(f"cannot quantize field: {e}") from e
+        soil = normalize_soil(field["soil_type"])
+        key = "|".join([KEY_VERSION, cell, soil] + [f"{name[0]}{climate[name]:g}" for name in self.steps])
+        lat_min, lon_min, lat_max, lon_max = geohash_bounds(cell)
+        representative = {
+            "coords": [round(lat_min, 4), round(lon_min, 4), round(lat_max, 4), round(lon_max, 4)],
+            "soil_type": " ".join(str(field["soil_type"]).split()),
+            **{name: int(value) if float(value).is_integer() else value for name, value in climate.items()},
+        }
+        return key, representative
+
+    def cells(self, lat_min, lon_min, lat_max, lon_max):
+        """Geohash cells covering a bbox, in row order"""
+        south, west, north, east = geohash_bounds(geohash_encode(lat_min, lon_min, self.precision))
+        lat_step, lon_step = north - south, east - west
+        found = []
+        lat = (south + north) / 2
+        while lat - lat_step / 2 <= lat_max:
+            lon = (west + east) / 2
+            while lon - lon_step / 2 <= lon_max:
+                found.append(geohash_encode(lat, lon, self.precision))
+                lon += lon_step
+            lat += lat_step
+        return list(dict.fromkeys(found))
+
+    def bins(self, name, low, high):
+        """Every bin value of `name` between low and high"""
+        step = self.steps[name]
+        value, last = bin_value(low, step), bin_value(high, step)
+        values = []
+        while value <= last:
+            values.append(value)
+            value = round(value + step, 6)
+        return values
@@ -0,0 +1,121 @@
+"""
+Single-decode image pipeline for /diagnose.
+
+An upload is validated and decoded exactly once into a DecodedUpload, which
+every later stage shares: the cache keys, the local model input and the
+payload sent to the LLM. Large JPEGs are decoded at a reduced DCT scale
+(PIL draft mode) since nothing downstream needs the full phone resolution.
+With a LeafCropper (leaf_crop.py) the decoded image is cut down to the
+leaf right away, so every stage works on the crop. The model input stays
+uint8 until the batcher scales it straight into a preallocated float32
+batch buffer. The image sent to the LLM is downscaled
+to a max edge and re-encoded, which also strips EXIF (including GPS tags).
+"""
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+
+LLM_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+class InvalidImageError(ValueError):
+    """The upload could not be decoded as an image"""
+
+
+class DecodedUpload:
+    """One decoded upload plus lazily derived, cached views of it"""
+
+    def __init__(self, raw, image, original_size, source_format=None, has_metadata=False, crop_box=None):
+        self.raw = raw
+        self.image = image  # RGB, possibly reduced by draft mode and cropped to the leaf
+        self.original_size = original_size
+        self.source_format = source_format
+        self.has_metadata = has_metadata
+        self.crop_box = crop_box  # leaf box in the decoded image, None when uncropped
+        self._model_inputs = {}
+        self._base64 = None
+        self._llm_payloads = {}
+
+    def model_input(self, size):
+        """(H, W, 3) uint8 array resized for the local model"""
+        arr = self._model_inputs.get(size)
+        if arr is None:
+            resized = self.image.resize(size, reducing_gap=3.0)
+            arr = np.asarray(resized, dtype=np.uint8)
+            self._model_inputs[size] = arr
+        return arr
+
+    def base64(self):
+        """Base64 of the original upload bytes for the LLM"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.raw).decode('utf-8')
+        return self._base64
+
+
+    def llm_payload(self, max_edge=1024, quality=85, fmt="JPEG"):
+        """(base64 string, mime type, encoded byte count) for the LLM request"""
+        key = (max_edge, quality, fmt)
+        payload = self._llm_payloads.get(key)
+        if payload is None:
+            data, mime = shape_for_llm(self.image, max_edge, quality, fmt)
+            # A small, metadata-free, uncropped upload can beat its own re-encode
+            if (
+                self.crop_box is None
+                and len(self.raw) <= len(data)
+                and max(self.original_size) <= max_edge
+                and not self.has_metadata
+                and self.source_format in LLM_MIME_TYPES
+            ):
+                data, mime = self.raw, LLM_MIME_TYPES[self.source_format]
+            payload = (base64.b64encode(data).decode('utf-8'), mime, len(data))
+            self._llm_payloads[key] = payload
+        return payload
+
+
+def shape_for_llm(img, max_edge=1024, quality=85, fmt="JPEG"):
+    """Downscale to max_edge and re-encode without metadata; returns (bytes, mime)"""
+    if max_edge and max(img.size) > max_edge:
+        scale = max_edge / max(img.size)
+        new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+    out = io.BytesIO()
+    # No exif= argument, so nothing from the original metadata is written
+    img.save(out, format=fmt, quality=quality)
+    return out.getvalue(), LLM_MIME_TYPES.get(fmt.upper(), "image/jpeg")
+
+
+def decode_upload(raw, target_edge=512, cropper=None):
+    """Validate and decode an upload once.
+
+    JPEGs are decoded at the smallest DCT scale that keeps both sides at
+    least target_edge pixels, then cropped to the leaf when a cropper is
+    given. Raises InvalidImageError for anything PIL cannot fully decode.
+    """
+    try:
+        img = Image.open(io.BytesIO(raw))
+        original_size = img.size
+        source_format = img.format
+        has_metadata = bool(img.getexif()) or 'exif' in img.info
+        if img.format == 'JPEG' and target_edge:
+            img.draft('RGB', (target_edge, target_edge))
+        img = img.convert('RGB')  # forces the full decode, so truncated files fail here
+    except Exception as e:
+        raise InvalidImageError(str(e)) from e
+    crop_box = None
+    if cropper is not None:
+        img, crop_box = cropper.crop(img)
+    return DecodedUpload(raw, img, original_size, source_format, has_metadata, crop_box)
+
+
+def scale_into(items, out):
+    """Scale uint8 model inputs to [0, 1] float32 inside a preallocated buffer.
+
+    Returns the view of `out` holding the batch; no new arrays are allocated.
+    """
+    batch = out[:len(items)]
+    for i, item in enumerate(items):
+        np.multiply(item, np.float32(1.0 / 255.0), out=batch[i])
+    return batch
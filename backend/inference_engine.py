@@ -0,0 +1,140 @@
+"""
+Runtimes for the local disease classifier.
+
+The Keras path needs the full TensorFlow import plus the DepthwiseConv2D
+patch for network.h5. When a converted network.tflite sits next to the .h5
+the lightweight TFLite interpreter is used instead (tflite_runtime if it is
+installed, otherwise tf.lite). Both engines expose the same predict(batch)
+call returning an (N, num_classes) float array.
+"""
+import importlib.util
+import logging
+import os
+import threading
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def tensorflow_available():
+    return importlib.util.find_spec("tensorflow") is not None
+
+
+def load_keras_model(model_path):
+    """Load network.h5 with the DepthwiseConv2D compatibility patch"""
+    import tensorflow as tf
+    from tensorflow.keras.layers import DepthwiseConv2D
+
+    # Patch for DepthwiseConv2D to handle version incompatibilities
+    class FixedDepthwiseConv2D(DepthwiseConv2D):
+        def __init__(self, **kwargs):
+            if 'groups' in kwargs:
+                kwargs.pop('groups')
+            super().__init__(**kwargs)
+
+    return tf.keras.models.load_model(
+        model_path,
+        custom_objects={'DepthwiseConv2D': FixedDepthwiseConv2D},
+        compile=False
+    )
+
+
+def tflite_path_for(model_path, int8=False):
+    """Where the converted artifact for a .h5 model is cached"""
+    base, _ = os.path.splitext(model_path)
+    return base + (".int8.tflite" if int8 else ".tflite")
+
+
+def is_fresh(artifact_path, source_path):
+    """True if the converted artifact exists and is newer than its source"""
+    return (
+        os.path.exists(artifact_path)
+        and (not os.path.exists(source_path) or os.path.getmtime(artifact_path) >= os.path.getmtime(source_path))
+    )
+
+
+def _tflite_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+
+
+class KerasEngine:
+    name = "keras"
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = load_keras_model(model_path)
+        self.input_shape = tuple(self.model.input_shape[1:])
+        self.num_classes = self.model.output_shape[-1]
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteEngine:
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        Interpreter = _tflite_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self._input['shape'][1:])
+        self.num_classes = int(self._output['shape'][-1])
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter holds mutable tensor buffers; one call at a time
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+
+            if self._input['dtype'] != np.float32:
+                scale, zero_point = self._input['quantization']
+                batch = np.round(batch / scale + zero_point).astype(self._input['dtype'])
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output['index'])
+
+        if self._output['dtype'] != np.float32:
+            scale, zero_point = self._output['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return np.array(output, dtype=np.float32)
+
+
+def load_engine(model_path, preference="auto", int8=False, num_threads=None):
+    """Load the best available engine for model_path.
+
+    preference: "auto" (TFLite if a fresh converted artifact exists, else
+    Keras), "tflite" (convert on first start if needed) or "keras".
+    """
+    if preference in ("auto", "tflite"):
+        tflite_path = tflite_path_for(model_path, int8)
+        if not is_fresh(tflite_path, model_path) and preference == "tflite":
+            from export_model import convert_to_tflite
+            log.info("Converting %s -> %s (one-time)...", model_path, tflite_path)
+            convert_to_tflite(model_path, tflite_path, int8=int8)
+        if is_fresh(tflite_path, model_path):
+            try:
+                return TFLiteEngine(tflite_path, num_threads=num_threads)
+            except ImportError:
+                if preference == "tflite":
+                    raise
+                log.warning("⚠️ No TFLite interpreter available, falling back to Keras")
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(model_path)
+    return KerasEngine(model_path)
@@ -0,0 +1,465 @@
+"""
+Durable job queue for diagnoses, backed by SQLite.
+
+POST /jobs/diagnose stores the upload as a queued row and returns straight
+away; a pool of worker threads claims rows oldest first, runs the handler and
+writes the result back for GET /jobs/<id> to poll. Because the upload lives
+in the database until it has been processed, queued work survives a server
+restart: on start, jobs left "running" by a process that no longer exists are
+put back in the queue (or failed, once they have used up max_attempts).
+A job whose handler raises one of the `retryable` exceptions (a transient
+outage upstream) is requeued the same way, to run again after an
+exponential backoff.
+
+A job can name a webhook URL; its final state is POSTed there as JSON, with
+a few retries, and deliveries still pending at shutdown are retried on the
+next start. Webhook hosts must resolve to public addresses (or be on an
+allowlist), checked when the job is submitted and again for every delivery,
+which goes to the checked address and does not follow redirects.
+
+Claims are a conditional UPDATE (status = 'queued'), so several processes
+may share one database file. Nothing touches the file (or starts a thread)
+until start(), so constructing the queue is free of side effects.
+"""
+import ipaddress
+import json
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+FINAL_STATES = ("succeeded", "failed")
+
+log = logging.getLogger(__name__)
+
+
+class JobQueueFullError(RuntimeError):
+    """The queue is at max_depth; retry_after is a hint in seconds"""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Job queue is full ({depth} jobs waiting)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class WebhookNotAllowed(ValueError):
+    """A webhook URL the server must not POST to"""
+
+
+def webhook_address(url, allowed_hosts=()):
+    """The IP address to deliver a webhook for `url` to, once it is checked.
+
+    The URL must be http(s). A host in allowed_hosts is trusted as is;
+    otherwise (or with no allowlist) every address the host resolves to must
+    be global, so loopback, private, link-local (169.254.169.254) and other
+    reserved ranges are refused. Raises WebhookNotAllowed.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname or len(url) > 2048:
+        raise WebhookNotAllowed("webhook_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if allowed_hosts and host not in allowed_hosts:
+        raise WebhookNotAllowed(f"webhook_url host {host} is not allowed")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError):
+        raise WebhookNotAllowed(f"webhook_url host {host} does not resolve") from None
+    addresses = []
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        addresses.append(address)
+    if not allowed_hosts and not all(address.is_global for address in addresses):
+        raise WebhookNotAllowed(f"webhook_url host {host} is not a public address")
+    return addresses[0]
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """SQLite-backed queue with a worker pool and webhook notifications"""
+
+    def __init__(
+        self,
+        db_path,
+        handler,
+        workers=4,
+        max_depth=500,
+        max_attempts=3,
+        retention_seconds=86400,
+        webhook_timeout_seconds=10.0,
+        webhook_attempts=3,
+        webhook_allowed_hosts=(),
+        retryable=(),
+        retry_backoff_seconds=15.0,
+        poll_seconds=1.0,
+        name="jobs",
+    ):
+        # handler(payload bytes, params dict) -> JSON-serialisable result
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_depth = max(1, int(max_depth))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retention = float(retention_seconds)
+        self.webhook_timeout = webhook_timeout_seconds
+        self.webhook_attempts = max(1, int(webhook_attempts))
+        self.webhook_allowed_hosts = frozenset(host.lower() for host in webhook_allowed_hosts)
+        # Exceptions that requeue a job instead of failing it, and the first delay
+        self.retryable = tuple(retryable)
+        self.retry_backoff = float(retry_backoff_seconds)
+        self.poll_seconds = poll_seconds
+        self.name = name
+
+        self._db_path = db_path
+        self._db = None
+        self._inherited_dbs = []
+        self._lock = threading.Lock()
+
+        self._wakeup = threading.Semaphore(0)
+        self._threads = []
+        self._started_pid = None
+        self._webhooks = None
+        self._last_prune = 0.0
+
+        # Counters for this process (read by /health and the benchmark)
+        self.submitted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.retried = 0
+        self.webhooks_delivered = 0
+        self.webhooks_failed = 0
+        self._avg_run_seconds = None
+
+    def _connect(self):
+        directory = os.path.dirname(self._db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT UNIQUE NOT NULL,"
+            " status TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " payload BLOB,"
+            " webhook_url TEXT,"
+            " webhook_status TEXT,"
+            " owner_pid INTEGER,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " run_after REAL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " result TEXT,"
+            " error TEXT)"
+        )
+        if "run_after" not in {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+            # A database from before retries had a backoff
+            self._db.execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq)")
+        self._db.commit()
+
+    # --- producer side ---
+
+    def submit(self, payload, params=None, webhook_url=None):
+        """Store a job and return its id; raises JobQueueFullError at max_depth"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            depth = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                self.rejected += 1
+                raise JobQueueFullError(depth, self.retry_after())
+            self._db.execute(
+                "INSERT INTO jobs (id, status, params, payload, webhook_url, webhook_status, created_at)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(params or {}), payload, webhook_url,
+                 "pending" if webhook_url else None, time.time())
+            )
+            self._db.commit()
+            self.submitted += 1
+        self._wakeup.release()
+        return job_id
+
+    def retry_after(self):
+        """Seconds until a worker is likely to free a queue slot"""
+        avg = self._avg_run_seconds or 5.0
+        return max(1, math.ceil(avg / self.workers))
+
+    def get(self, job_id):
+        """Public view of a job (no payload), or None"""
+        self.start()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT seq, id, status, params, webhook_url, webhook_status, attempts,"
+                " created_at, started_at, finished_at, result, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row[2] == "queued":
+                position = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND seq < ?", (row[0],)
+                ).fetchone()[0]
+        _, job_id, status, params, webhook_url, webhook_status, attempts, created, started, finished, result, error = row
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "params": json.loads(params),
+            "attempts": attempts,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+        }
+        if position is not None:
+            job["queue_position"] = position
+        if webhook_url:
+            job["webhook"] = {"url": webhook_url, "status": webhook_status}
+        return job
+
+    # --- worker side ---
+
+    def start(self):
+        """Recover interrupted jobs and start the workers (once per process)"""
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            # Threads inherited through fork() do not exist in this process,
+            # and the inherited SQLite connection must not be used (or closed)
+            if self._db is not None:
+                self._inherited_dbs.append(self._db)
+            self._connect()
+            self._threads = []
+            self._wakeup = threading.Semaphore(0)
+            self._webhooks = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"{self.name}-webhook")
+            self._recover()
+        self._prune()
+        for job_id in self._pending_webhooks():
+            self._webhooks.submit(self._deliver, job_id)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _recover(self):
+        """Requeue jobs whose worker process is gone (called with the lock held)"""
+        rows = self._db.execute(
+            "SELECT id, owner_pid, attempts FROM jobs WHERE status = 'running'"
+        ).fetchall()
+        for job_id, pid, attempts in rows:
+            if pid is not None and pid != os.getpid() and pid_alive(pid):
+                continue
+            if attempts >= self.max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, payload = NULL, error = ? WHERE id = ?",
+                    (time.time(), f"Abandoned after {attempts} interrupted attempts", job_id)
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'queued', owner_pid = NULL WHERE id = ?", (job_id,)
+                )
+            self.recovered += 1
+        self._db.commit()
+        if rows:
+            log.info("♻️  %s: recovered %d interrupted job(s)", self.name, self.recovered)
+
+    def _claim(self):
+        """Mark the oldest runnable queued job as ours; returns (id, payload, params, attempt) or None"""
+        with self._lock:
+            while True:
+                row = self._db.execute(
+                    "SELECT id, payload, params, attempts FROM jobs WHERE status = 'queued'"
+                    " AND (run_after IS NULL OR run_after <= ?) ORDER BY seq LIMIT 1",
+                    (time.time(),)
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = self._db.execute(
+                    "UPDATE jobs SET status = 'running', owner_pid = ?, started_at = ?, attempts = attempts + 1"
+                    " WHERE id = ? AND status = 'queued'",
+                    (os.getpid(), time.time(), row[0])
+                ).rowcount
+                self._db.commit()
+                if claimed:
+                    return row[0], row[1], json.loads(row[2]), row[3] + 1
+                # Another process took it first; try the next one
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                # Woken by submit(), or poll for jobs added by other processes
+                self._wakeup.acquire(timeout=self.poll_seconds)
+                self._prune()
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, payload, params, attempt):
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = json.dumps(self.handler(payload, params))
+        except self.retryable as e:
+            if attempt < self.max_attempts:
+                self._requeue(job_id, attempt, str(e) or type(e).__name__)
+                return
+            log.warning("%s: job failed after %d attempts: %s", self.name, attempt, e, extra={"job_id": job_id})
+            error = str(e) or type(e).__name__
+        except Exception as e:
+            log.warning("%s: job failed: %s", self.name, e, extra={"job_id": job_id})
+            error = str(e) or type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, payload = NULL WHERE id = ?",
+                ("failed" if error else "succeeded", time.time(), result, error, job_id)
+            )
+            self._db.commit()
+            self.processed += 1
+            if error:
+                self.failed += 1
+            # Moving average of run time, for the Retry-After hint
+            if self._avg_run_seconds is None:
+                self._avg_run_seconds = elapsed
+            else:
+                self._avg_run_seconds = 0.9 * self._avg_run_seconds + 0.1 * elapsed
+            has_webhook = self._db.execute(
+                "SELECT webhook_url IS NOT NULL FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()[0]
+        if has_webhook:
+            self._webhooks.submit(self._deliver, job_id)
+
+    def _requeue(self, job_id, attempt, error):
+        """Put a job that hit a transient error back in the queue, after a backoff"""
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        log.warning("%s: job will be retried in %.1fs: %s", self.name, delay, error, extra={"job_id": job_id})
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', owner_pid = NULL, run_after = ?, error = ? WHERE id = ?",
+                (time.time() + delay, error, job_id)
+            )
+            self._db.commit()
+            self.retried += 1
+
+    # --- webhooks ---
+
+    def _pending_webhooks(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE webhook_status = 'pending' AND status IN (?, ?)", FINAL_STATES
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _deliver(self, job_id):
+        """POST the finished job to its webhook, retrying with backoff"""
+        job = self.get(job_id)
+        if job is None or "webhook" not in job:
+            return
+        url = job["webhook"]["url"]
+        del job["webhook"]
+        status = "failed"
+        for attempt in range(self.webhook_attempts):
+            try:
+                response = self._post_webhook(url, job)
+                if response.status_code < 300:
+                    status = "delivered"
+                    break
+                log.warning("%s: webhook got HTTP %d", self.name, response.status_code, extra={"job_id": job_id})
+            except (httpx.HTTPError, WebhookNotAllowed) as e:
+                log.warning("%s: webhook failed: %s", self.name, e, extra={"job_id": job_id})
+            if attempt + 1 < self.webhook_attempts:
+                time.sleep(2 ** attempt)
+        with self._lock:
+            self._db.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+            self._db.commit()
+            if status == "delivered":
+                self.webhooks_delivered += 1
+            else:
+                self.webhooks_failed += 1
+
+    def _post_webhook(self, url, job):
+        """POST job to url at the address checked now (not one re-resolved by
+        httpx, which DNS rebinding could change), without following redirects"""
+        address = webhook_address(url, self.webhook_allowed_hosts)
+        parts = urllib.parse.urlsplit(url)
+        netloc = f"[{address}]" if address.version == 6 else str(address)
+        if parts.port:
+            netloc += f":{parts.port}"
+        host = parts.hostname + (f":{parts.port}" if parts.port else "")
+        with httpx.Client(timeout=self.webhook_timeout, follow_redirects=False) as client:
+            return client.post(
+                parts._replace(netloc=netloc).geturl(),
+                json=job,
+                headers={"Host": host},
+                extensions={"sni_hostname": parts.hostname},
+            )
+
+    # --- housekeeping ---
+
+    def _prune(self):
+        """Drop finished jobs older than the retention period (at most once a minute)"""
+        now = time.time()
+        if self.retention <= 0 or now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? AND webhook_status IS NOT 'pending'",
+                (*FINAL_STATES, now - self.retention)
+            )
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            started = self._started_pid == os.getpid()
+            counts = dict(
+                self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            ) if started else {}
+        return {
+            "db_path": self._db_path,
+            "started": started,
+            "workers": self.workers,
+            "max_depth": self.max_depth,
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "succeeded": counts.get("succeeded", 0),
+            "failed": counts.get("failed", 0),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "processing_failures": self.failed,
+            "recovered": self.recovered,
+            "retried": self.retried,
+            "webhooks_delivered": self.webhooks_delivered,
+            "webhooks_failed": self.webhooks_failed,
+            "avg_run_ms": round(self._avg_run_seconds * 1000, 1) if self._avg_run_seconds else None,
+        }
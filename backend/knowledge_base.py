@@ -0,0 +1,78 @@
+"""
+Offline diagnosis from the local model's class alone.
+
+disease_knowledge.json holds one precomputed entry per PlantVillage class:
+crop, disease, typical severity, symptoms, treatment, tips/cautions and a
+3-point recovery plan. The file is read once when the server starts. A
+lookup copies the entry into the same schema the LLM returns, so a
+local-only diagnosis costs a dict copy on top of the forward pass.
+"""
+import json
+import os
+
+KNOWLEDGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "disease_knowledge.json")
+ENTRY_KEYS = ("crop", "disease", "severity", "symptoms", "treatment", "additional_notes", "recovery_plan")
+OFFLINE_AFFECTED_AREA = "Not estimated (offline diagnosis)"
+
+
+class DiseaseKnowledgeBase:
+    """Class name -> diagnosis table, loaded once and kept in memory"""
+
+    def __init__(self, path=KNOWLEDGE_PATH):
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.entries = json.load(f)
+        for class_name, entry in self.entries.items():
+            missing = [key for key in ENTRY_KEYS if key not in entry]
+            if missing:
+                raise ValueError(f"{path}: entry '{class_name}' is missing {', '.join(missing)}")
+
+    def __contains__(self, class_name):
+        return class_name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def missing_classes(self, class_names):
+        """Classes the model can predict that have no entry in the table"""
+        return [name for name in class_names if name not in self.entries]
+
+    def diagnose(self, predicted_class, confidence):
+        """Diagnosis in the LLM response schema for a local model prediction"""
+        entry = self.entries.get(predicted_class)
+        if entry is None:
+            return class_summary(predicted_class, confidence)
+        # Copy the lists so callers can mutate the result without touching the table
+        return {
+            "disease": entry["disease"],
+            "crop": entry["crop"],
+            "confidence": round(confidence, 1),
+            "severity": entry["severity"],
+            "symptoms": list(entry["symptoms"]),
+            "treatment": entry["treatment"],
+            "affected_area": OFFLINE_AFFECTED_AREA,
+            "additional_notes": entry["additional_notes"],
+            "recovery_plan": [dict(step) for step in entry["recovery_plan"]]
+        }
+
+    def stats(self):
+        return {"path": self.path, "classes": len(self.entries)}
+
+
+def class_summary(predicted_class, confidence):
+    """Bare diagnosis for a class the table does not cover, from its name alone"""
+    crop, _, disease = predicted_class.partition('___')
+    crop = crop.replace('_', ' ').strip()
+    disease = disease.replace('_', ' ').strip()
+    healthy = disease.lower() == 'healthy'
+    return {
+        "disease": "Healthy" if healthy else disease,
+        "crop": crop,
+        "confidence": round(confidence, 1),
+        "severity": "none" if healthy else "unknown",
+        "symptoms": [],
+        "treatment": "No treatment needed." if healthy else "Detailed treatment advice is being prepared. Please retry shortly for the full diagnosis.",
+        "affected_area": "N/A",
+        "additional_notes": f"Identified by the on-device model ({predicted_class}).",
+        "recovery_plan": []
+    }
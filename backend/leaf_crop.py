@@ -0,0 +1,172 @@
+"""
+Crop-to-leaf preprocessing for uploads.
+
+Farmers' photos are mostly soil, hands and sky, and squashing the whole
+frame to 224x224 leaves few pixels for the leaf. LeafCropper finds the leaf
+on a small thumbnail (LEAF_ANALYSIS_EDGE pixels on the long side). It marks
+plant pixels and labels the connected regions. Their bounding box, padded
+and squared, is cut out of the decoded image.
+Every later stage then sees the crop: the cache keys, the local model input
+and the image sent to the LLM, which also gets smaller.
+
+A pixel counts as plant when either of two tests passes:
+- excess green (2g - r - b on chromaticity) is above a threshold;
+- its HSV hue is in the yellow-green band, with enough saturation and
+  brightness. This keeps chlorotic and yellowing tissue.
+Brown lesions usually fail both tests. They sit inside the leaf, so the
+leaf's bounding box still covers them.
+
+All of it is vectorised numpy: no OpenCV or SciPy needed. Connected
+components are labelled by min-label propagation along horizontal and
+vertical runs, with pointer jumping, on a thumbnail of ~10k pixels. When no leaf is found, or the leaf already fills
+most of the frame, the image is left as it is.
+"""
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+ANALYSIS_EDGE = 128
+
+
+def plant_mask(rgb, hsv, exg_threshold=0.08, hue_range=(50, 160), min_saturation=0.2, min_value=0.15):
+    """Boolean (H, W) mask of plant pixels from uint8 RGB and PIL HSV arrays (hue in degrees)"""
+    r, g, b = (rgb[..., i].astype(np.int16) for i in range(3))
+    # 2g - r - b > t * (r + g + b) on chromaticity, without dividing
+    excess_green = (2 * g - r - b) * 100 > round(exg_threshold * 100) * (r + g + b)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    low, high = (round(degrees * 255 / 360) for degrees in hue_range)
+    leafy = (
+        (hue >= low) & (hue <= high)
+        & (saturation >= round(min_saturation * 255)) & (value >= round(min_value * 255))
+    )
+    return excess_green | leafy
+
+
+def dilate(mask):
+    """3x3 binary dilation, closing one-pixel gaps (leaf veins, lesion edges)"""
+    padded = np.pad(mask, 1)
+    out = padded[1:-1, 1:-1].copy()
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            out |= padded[dy:dy + mask.shape[0], dx:dx + mask.shape[1]]
+    return out
+
+
+def _runs(mask):
+    """(positions, run starts, run lengths) of the horizontal runs of mask pixels, in flat order"""
+    positions = np.flatnonzero(mask)
+    breaks = np.ones(positions.size, dtype=bool)
+    breaks[1:] = (np.diff(positions) != 1) | (positions[1:] % mask.shape[1] == 0)
+    starts = np.flatnonzero(breaks)
+    return positions, starts, np.diff(np.append(starts, positions.size))
+
+
+def label_components(mask):
+    """4-connected component labels of mask: each pixel's label is the smallest flat index in its component.
+
+    Background pixels get mask.size. Each sweep gives every horizontal run,
+    then every vertical run, the smallest label in it, then lets labels
+    jump to the label of the pixel they name. A few sweeps are enough for
+    leaf-like shapes.
+    """
+    h, w = mask.shape
+    background = h * w
+    labels = np.where(mask, np.arange(h * w).reshape(h, w), background).ravel()
+    if not mask.any():
+        return labels.reshape(h, w)
+    row_runs = _runs(mask)
+    col_positions, col_starts, col_lengths = _runs(mask.T)
+    # Column-major position -> row-major flat index
+    col_positions = (col_positions % h) * w + col_positions // h
+    foreground = row_runs[0]
+    while True:
+        previous = labels.copy()
+        for positions, starts, lengths in (row_runs, (col_positions, col_starts, col_lengths)):
+            labels[positions] = np.repeat(np.minimum.reduceat(labels[positions], starts), lengths)
+        while True:
+            jumped = labels[labels[foreground]]
+            if np.array_equal(jumped, labels[foreground]):
+                break
+            labels[foreground] = jumped
+        if np.array_equal(labels, previous):
+            return labels.reshape(h, w)
+
+
+def leaf_box(mask, min_component_share=0.2):
+    """(left, top, right, bottom) around the largest component and any at least min_component_share its size"""
+    labels = label_components(mask)
+    sizes = np.bincount(labels[mask])
+    keep = np.flatnonzero(sizes >= sizes.max() * min_component_share)
+    rows, cols = np.nonzero(np.isin(labels, keep))
+    return cols.min(), rows.min(), cols.max() + 1, rows.max() + 1
+
+
+def square_box(box, size, padding):
+    """Pad box by `padding` of its size, grow it to a square, shift it inside an image of `size`"""
+    left, top, right, bottom = box
+    width, height = size
+    side = max(right - left, bottom - top) * (1 + 2 * padding)
+    box_w, box_h = min(side, width), min(side, height)
+    x0 = min(max(0.0, (left + right - box_w) / 2), width - box_w)
+    y0 = min(max(0.0, (top + bottom - box_h) / 2), height - box_h)
+    return round(x0), round(y0), round(x0 + box_w), round(y0 + box_h)
+
+
+class LeafCropper:
+    """Finds and crops the leaf region of decoded images, with counters"""
+
+    def __init__(self, analysis_edge=ANALYSIS_EDGE, min_plant_share=0.02, max_crop_share=0.85, padding=0.08,
+                 min_component_share=0.2):
+        self.analysis_edge = analysis_edge
+        self.min_plant_share = min_plant_share  # less plant than this: no leaf found
+        self.max_crop_share = max_crop_share  # a box keeping more of the frame than this is not worth cropping
+        self.padding = padding
+        self.min_component_share = min_component_share
+        self._lock = threading.Lock()
+        self.outcomes = {"cropped": 0, "full_frame": 0, "no_leaf": 0}
+        self.kept_area = 0.0  # summed share of the frame kept by crops
+        self.seconds = 0.0
+
+    def find(self, image):
+        """(outcome, box): "cropped" with the leaf box in image coordinates, else "no_leaf" or "full_frame" and None"""
+        scale = self.analysis_edge / max(image.size)
+        thumb = image
+        if scale < 1:
+            thumb = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX
+            )
+        mask = plant_mask(np.asarray(thumb), np.asarray(thumb.convert("HSV")))
+        if mask.mean() < self.min_plant_share:
+            return "no_leaf", None
+        box = square_box(leaf_box(dilate(mask), self.min_component_share), thumb.size, self.padding)
+        if (box[2] - box[0]) * (box[3] - box[1]) > self.max_crop_share * thumb.width * thumb.height:
+            return "full_frame", None
+        sx, sy = image.width / thumb.width, image.height / thumb.height
+        return "cropped", (round(box[0] * sx), round(box[1] * sy), round(box[2] * sx), round(box[3] * sy))
+
+    def crop(self, image):
+        """(image, box): the leaf crop and its box, or the image itself and None"""
+        start = time.perf_counter()
+        outcome, box = self.find(image)
+        if box is not None:
+            share = (box[2] - box[0]) * (box[3] - box[1]) / (image.width * image.height)
+            image = image.crop(box)
+        with self._lock:
+            self.outcomes[outcome] += 1
+            if box is not None:
+                self.kept_area += share
+            self.seconds += time.perf_counter() - start
+        return image, box
+
+    def stats(self):
+        with self._lock:
+            images = sum(self.outcomes.values())
+            cropped = self.outcomes["cropped"]
+            return {
+                "images": images,
+                **self.outcomes,
+                "mean_area_kept": round(self.kept_area / cropped, 3) if cropped else None,
+                "avg_ms": round(self.seconds / images * 1000, 3) if images else None,
+            }
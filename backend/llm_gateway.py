@@ -0,0 +1,335 @@
+"""
+Managed access to the Groq API.
+
+Every call goes through one LLMGateway per process instead of a bare Groq
+client:
+
+- One pooled httpx client (plus an async twin for asgi.py), with keep-alive
+  connections sized to the number of workers that can call Groq at once.
+- A per-attempt timeout and an overall deadline per call.
+- Jittered exponential retries for transient failures (408/409/429, 5xx,
+  connection errors and timeouts), honouring Retry-After.
+- A circuit breaker. After repeated failures, calls fail fast with
+  LLMUnavailableError until a cool-down probe succeeds. Callers turn that
+  error into a local-only diagnosis.
+
+stats() reports pool utilisation, retry counts and the breaker state for
+/health.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+from groq import APIConnectionError, APIStatusError, AsyncGroq, Groq
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+log = logging.getLogger(__name__)
+
+
+class LLMUnavailableError(RuntimeError):
+    """Groq gave no answer: breaker open, retries or deadline exhausted"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    closed -> open after failure_threshold failures in a row. Once
+    cooldown_seconds have passed, a single probe call is let through
+    (half_open); its success closes the breaker, its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now (claims the probe when half open)"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def is_open(self):
+        return self.state == "open"
+
+    def abandon_probe(self):
+        """The probe call ended without telling us anything about Groq"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class LLMGateway:
+    """Pooled Groq client with deadlines, retries and a circuit breaker"""
+
+    def __init__(
+        self,
+        api_key,
+        base_url=None,
+        pool_size=16,
+        async_pool_size=100,
+        timeout_seconds=30.0,
+        deadline_seconds=45.0,
+        max_retries=3,
+        backoff_base_ms=250.0,
+        backoff_max_ms=4000.0,
+        breaker=None,
+        name="groq",
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout_seconds = timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.breaker = breaker or CircuitBreaker()
+        self.name = name
+
+        # The SDK's own retries are off; retrying is done here, within the deadline
+        self.client = Groq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            timeout=timeout_seconds,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=timeout_seconds,
+            ),
+        )
+        self._async_client = None
+        self._pools = {
+            "sync": {"size": pool_size, "in_flight": 0, "peak_in_flight": 0},
+            "async": {"size": async_pool_size, "in_flight": 0, "peak_in_flight": 0},
+        }
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "retries_exhausted": 0,
+            "deadline_exceeded": 0,
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def async_client(self):
+        """AsyncGroq on its own pool, created on first use"""
+        if self._async_client is None:
+            size = self._pools["async"]["size"]
+            self._async_client = AsyncGroq(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=self.timeout_seconds,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                    timeout=self.timeout_seconds,
+                ),
+            )
+        return self._async_client
+
+    def chat(self, deadline_seconds=None, **request):
+        """chat.completions.create with deadline, retries and the breaker.
+
+        With stream=True the returned iterator holds its connection until it
+        is exhausted or closed.
+        """
+        deadline = self._begin_call(deadline_seconds)
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            self._acquire("sync")
+            try:
+                response = self.client.chat.completions.create(timeout=timeout, **request)
+            except Exception as e:
+                self._release("sync")
+                time.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            if request.get("stream"):
+                tracked = self._tracked_stream(response)
+                # Enter the try block now: a stream that is closed or dropped
+                # before its first read still releases its slot
+                next(tracked)
+                return tracked
+            self._release("sync")
+            return response
+
+    async def achat(self, deadline_seconds=None, **request):
+        """Async twin of chat(), on the AsyncGroq pool"""
+        deadline = self._begin_call(deadline_seconds)
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            self._acquire("async")
+            try:
+                response = await self.async_client.chat.completions.create(timeout=timeout, **request)
+            except Exception as e:
+                self._release("async")
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            if request.get("stream"):
+                tracked = self._tracked_async_stream(response)
+                await anext(tracked)
+                return tracked
+            self._release("async")
+            return response
+
+    def _tracked_stream(self, stream):
+        """Yields once (consumed by chat) before the chunks, then releases the slot however it ends"""
+        try:
+            yield
+            yield from stream
+        finally:
+            stream.close()
+            self._release("sync")
+
+    async def _tracked_async_stream(self, stream):
+        try:
+            yield
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
+            self._release("async")
+
+    def _begin_call(self, deadline_seconds):
+        with self._lock:
+            self._counters["calls"] += 1
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailableError(f"{self.name}: circuit breaker open")
+        return time.monotonic() + (deadline_seconds or self.deadline_seconds)
+
+    def _attempt_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count("deadline_exceeded")
+            raise LLMUnavailableError(f"{self.name}: deadline exceeded")
+        self._count("attempts")
+        return min(self.timeout_seconds, remaining)
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Seconds to wait before retrying, or raise if this error is final"""
+        if not is_retryable(error):
+            if isinstance(error, APIStatusError):
+                # Groq answered, so it is up; the request itself was bad
+                self.breaker.record_success()
+            else:
+                self.breaker.abandon_probe()
+            raise error
+
+        self._count("failures")
+        self.breaker.record_failure()
+        if attempt >= self.max_retries:
+            self._count("retries_exhausted")
+            raise LLMUnavailableError(f"{self.name}: gave up after {attempt + 1} attempts: {error}") from error
+        if self.breaker.is_open():
+            self._count("short_circuited")
+            raise LLMUnavailableError(f"{self.name}: circuit breaker opened: {error}") from error
+
+        # Full jitter: uniform over [0, min(max, base * 2^attempt)]
+        cap_ms = min(self.backoff_max_ms, self.backoff_base_ms * (2 ** attempt))
+        delay = random.uniform(0, cap_ms) / 1000
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            self._count("deadline_exceeded")
+            raise LLMUnavailableError(f"{self.name}: no time left to retry: {error}") from error
+
+        self._count("retries")
+        log.warning(
+            "⚠️  %s attempt %d failed (%s); retrying in %.2fs", self.name, attempt + 1, error, delay,
+            extra={"gateway": self.name, "attempt": attempt + 1}
+        )
+        return delay
+
+    def _acquire(self, pool):
+        with self._lock:
+            stats = self._pools[pool]
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+
+    def _release(self, pool):
+        with self._lock:
+            self._pools[pool]["in_flight"] -= 1
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            pools = {
+                name: {**pool, "utilization": round(pool["in_flight"] / pool["size"], 3)}
+                for name, pool in self._pools.items()
+            }
+            return {
+                "name": self.name,
+                "base_url": str(self.client.base_url),
+                "pools": pools,
+                **self._counters,
+                "breaker": self.breaker.stats(),
+            }
+
+
+def is_retryable(error):
+    """Transient failures worth another attempt"""
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return isinstance(error, (APIConnectionError, httpx.TransportError))
+
+
+def retry_after_seconds(error):
+    """Retry-After header of a 429/503 in seconds, if the server sent one"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,220 @@
+"""
+Single-pass JSON extraction from LLM responses.
+
+LLM replies wrap the JSON we asked for in prose, markdown fences or
+<thinking> blocks. Instead of trying several parse strategies in turn, the
+text is scanned once with a small bracket-balancing state machine that
+tracks string literals and escapes. Every balanced top-level {...} span is
+handed to json.loads, and the first object holding the required keys wins.
+
+The scanner only visits brackets, quotes and backslashes. Each top-level
+span is sliced out and decoded on its own, so a parse error (which counts
+the lines up to its position) only scans that span, never the text before
+it. Looking inside spans that fail to parse is capped at one more pass over
+the text, so the work stays linear in the response length whatever the
+model returns.
+"""
+import json
+import re
+
+THINKING_OPEN = "<thinking>"
+THINKING_CLOSE = "</thinking>"
+# The only characters the scanner has to look at
+STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+_decoder = json.JSONDecoder()
+
+
+def strip_thinking(text):
+    """Remove every closed <thinking>...</thinking> block"""
+    if THINKING_OPEN not in text:
+        return text
+    parts = []
+    pos = 0
+    while True:
+        start = text.find(THINKING_OPEN, pos)
+        if start == -1:
+            break
+        end = text.find(THINKING_CLOSE, start)
+        if end == -1:
+            break
+        parts.append(text[pos:start])
+        pos = end + len(THINKING_CLOSE)
+    parts.append(text[pos:])
+    return "".join(parts).strip()
+
+
+def iter_object_spans(text):
+    """Yield a (start, end, children) node for every candidate {...} span.
+
+    Candidates are the balanced top-level objects, in text order; children
+    are the object nodes nested inside each one. If the text ends with
+    brackets still open (a stray '{' in prose), the objects that closed
+    inside them are yielded too, so a stray brace cannot hide the answer.
+    """
+    stack = []  # (position, kind, children) for each open bracket
+    in_string = False
+    skip = -1  # position of a character escaped by a backslash
+    for match in STRUCTURAL.finditer(text):
+        i = match.start()
+        ch = text[i]
+        if not stack:
+            if ch == "{":
+                stack.append((i, ch, []))
+            continue
+        if in_string:
+            if i == skip:
+                continue
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{" or ch == "[":
+            stack.append((i, ch, []))
+        elif ch == "}" or ch == "]":
+            start, kind, children = stack.pop()
+            if kind == "{":
+                node = (start, i + 1, children)
+                if stack:
+                    stack[-1][2].append(node)
+                else:
+                    yield node
+            elif stack:
+                stack[-1][2].extend(children)
+
+    for _, _, children in stack:
+        yield from children
+
+
+def extract_json_object(text, required_keys=()):
+    """First JSON object in text that contains all required_keys, or None"""
+    text = strip_thinking(text)
+    # Characters the decoder may spend on spans nested in ones that failed
+    budget = len(text)
+    for node in iter_object_spans(text):
+        offset = node[0]
+        span = text[offset:node[1]]
+        pending = [node]
+        while pending:
+            start, end, children = pending.pop()
+            try:
+                result, _ = _decoder.raw_decode(span, start - offset)
+            except json.JSONDecodeError as e:
+                # The error's line count scanned the span up to e.pos
+                spent = e.pos
+            except RecursionError:
+                spent = end - offset
+            else:
+                if isinstance(result, dict) and all(k in result for k in required_keys):
+                    return result
+                continue
+            if start != offset:
+                budget -= spent
+            if budget <= 0:
+                break
+            # Stray brackets around the real object: look inside
+            pending.extend(reversed(children))
+    return None
+
+
+class ProgressiveObjectParser:
+    """Incremental parser for a JSON object that arrives in chunks.
+
+    feed() returns the top-level (key, value) members of the first object
+    that each chunk completed, so a streamed LLM reply can be shown field by
+    field. The scan resumes where the last chunk stopped, so the whole stream
+    is scanned once. <thinking> blocks before the object are skipped. The
+    final answer should still come from extract_json_object(parser.text).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        members = []
+        i = self._pos
+        n = len(text)
+        while i < n and not self.done:
+            if self._depth == 0:
+                brace = text.find("{", i)
+                thinking = text.find(THINKING_OPEN, i)
+                if thinking != -1 and (brace == -1 or thinking < brace):
+                    close = text.find(THINKING_CLOSE, thinking)
+                    if close == -1:
+                        i = thinking  # wait for the rest of the block
+                        break
+                    i = close + len(THINKING_CLOSE)
+                    continue
+                if brace == -1:
+                    # Keep enough of the tail to spot a tag split across chunks
+                    i = max(i, n - len(THINKING_OPEN) + 1)
+                    break
+                self._depth = 1
+                self._member_start = brace + 1
+                i = brace + 1
+                continue
+
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_member(text, i, members)
+                    self.done = True
+            elif ch == "," and self._depth == 1:
+                self._complete_member(text, i, members)
+                self._member_start = i + 1
+            i += 1
+        self._pos = i
+        return members
+
+    def _complete_member(self, text, end, members):
+        member = text[self._member_start:end].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            return
+        for key, value in parsed.items():
+            self.fields[key] = value
+            members.append((key, value))
+
+
+def flatten_notes(notes):
+    """additional_notes as a string, even when the model returned an object"""
+    if isinstance(notes, dict):
+        return " ".join([f"{k}: {v}" for k, v in notes.items()])
+    return notes
+
+
+def normalize_diagnosis(result):
+    """Coerce a diagnosis object into the shape the frontend expects"""
+    # Ensure additional_notes is a string (prevents frontend crash if it's an object)
+    if 'additional_notes' in result:
+        result['additional_notes'] = flatten_notes(result['additional_notes'])
+
+    result.setdefault('symptoms', [])
+    result.setdefault('additional_notes', '')
+    result.setdefault('recovery_plan', [])
+    return result
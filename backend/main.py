@@ -1,50 +1,349 @@
-import io
 import os
-import base64
-import traceback
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import itertools
 import json
-import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from PIL import Image
-from groq import Groq
 from dotenv import load_dotenv
+from admission import AdmissionController, AdmissionRejected, Ticket, client_identity
+from batching import MicroBatcher
+from cache import LRUTTLCache
+from calibration import Calibration, LocalPrediction, RoutingPolicy
+from crop_recommender import CropScorer, LocalCropRecommender, NutrientPredictors, SentinelFeatureStore
+from field_keys import FieldQuantizer, bbox_center
+from phash_index import MultiIndexHashTable, dhash
+from inference_engine import load_engine, tensorflow_available, tflite_path_for
+from image_pipeline import DecodedUpload, InvalidImageError, decode_upload
+from job_queue import JobQueue, JobQueueFullError, WebhookNotAllowed, webhook_address
+from llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailableError
+from llm_json import ProgressiveObjectParser, extract_json_object, flatten_notes, normalize_diagnosis
+from knowledge_base import KNOWLEDGE_PATH, DiseaseKnowledgeBase
+from leaf_crop import LeafCropper
+from metrics import Registry
+from model_registry import ROUTES_NAME, ABRouter, ModelManifest, ModelRegistry, parse_routes, read_routes
+from procmem import in_megabytes, process_memory
+from structured_logging import configure_logging
+from tta import TestTimeAugmentation
 
 # Optional: suppress tensorflow warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
-# Import TensorFlow
-try:
-    import tensorflow as tf
-    from tensorflow.keras.layers import DepthwiseConv2D
-    TF_AVAILABLE = True
-except ImportError:
-    TF_AVAILABLE = False
-    print("⚠️ TensorFlow not installed. Using LLM-only mode.")
-
 # Load environment variables from .env file
 load_dotenv()
 
+# --- LOGGING ---
+# LOG_LEVEL (default INFO; DEBUG adds per-request lines and raw LLM
+# responses), LOG_FORMAT=text|json, LOG_ENABLED=0 turns logging off.
+configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "text"),
+    enabled=os.getenv("LOG_ENABLED", "1") == "1"
+)
+log = logging.getLogger("crop_api")
+
+# TensorFlow is only imported if the Keras engine ends up being used
+TF_AVAILABLE = tensorflow_available()
+if not TF_AVAILABLE:
+    log.warning("⚠️ TensorFlow not installed. Local model needs a converted network.tflite.")
+
 # --- FLASK APP SETUP ---
-print("Starting Crop Disease Detection Server (Hybrid Local+LLM Mode)...")
+log.info("Starting Crop Disease Detection Server (Hybrid Local+LLM Mode)...")
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# --- METRICS ---
+# GET /metrics serves these in Prometheus text format. Caches, batcher,
+# gateway and job queue are read from their stats() at scrape time (see
+# collect_component_metrics). METRICS_ENABLED=0 drops /metrics and the
+# per-request bookkeeping.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS = Registry()
+HTTP_REQUESTS = METRICS.counter(
+    "http_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status"))
+HTTP_LATENCY = METRICS.histogram(
+    "http_request_duration_seconds", "Time until the response starts (a streamed body is not included)", ("endpoint",))
+HTTP_IN_FLIGHT = METRICS.gauge(
+    "http_requests_in_flight", "Requests currently being handled")
+DIAGNOSIS_STAGE_LATENCY = METRICS.histogram(
+    "diagnosis_stage_duration_seconds",
+    "Diagnosis latency per stage: decode, cache_lookup, encode, local_inference, llm, llm_first_token, parse, knowledge_lookup, total",
+    ("stage",))
+DIAGNOSES = METRICS.counter(
+    "diagnoses_total", "Finished diagnoses by answer source (llm, local, cache, near_duplicate) and fallback reason",
+    ("source", "fallback"))
+LLM_JSON_PARSES = METRICS.counter(
+    "llm_json_parse_total", "LLM JSON extraction by response kind and where the object was found (bare, fenced, embedded, not_found)",
+    ("response", "outcome"))
+
 # Initialize Groq client
 # You'll need to set your GROQ_API_KEY in environment variables
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
-    print("⚠️  WARNING: GROQ_API_KEY not found in environment variables!")
-    print("Please set it using: set GROQ_API_KEY=your_api_key_here")
+    log.warning("⚠️  GROQ_API_KEY not found in environment variables! Set it with: set GROQ_API_KEY=your_api_key_here")
 
 AI_READY = False
-groq_client = None
+LLM_GATEWAY = None
+
+# --- DIAGNOSIS CACHE ---
+# Keyed by a hash of the decoded pixels; set DIAGNOSIS_CACHE_DB to a file
+# path to keep cached diagnoses across restarts.
+DIAGNOSIS_CACHE_ENABLED = os.getenv("DIAGNOSIS_CACHE_ENABLED", "1") == "1"
+DIAGNOSIS_CACHE = LRUTTLCache(
+    max_entries=int(os.getenv("DIAGNOSIS_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("DIAGNOSIS_CACHE_TTL", "86400")),
+    db_path=os.getenv("DIAGNOSIS_CACHE_DB") or None,
+    name="diagnosis"
+) if DIAGNOSIS_CACHE_ENABLED else None
+
+# --- RECOMMENDATION CACHE ---
+# Crop recommendations are keyed by the geohash cell of the field (precision
+# RECOMMENDATION_GEOHASH_PRECISION; 5 is about 5 x 5 km), the soil type and
+# the climate values rounded to RECOMMENDATION_*_STEP bins (see
+# field_keys.py). Set RECOMMENDATION_CACHE_DB to a file path to keep them
+# across restarts; warm_recommendations.py fills that file for a region.
+RECOMMENDATION_CACHE_ENABLED = os.getenv("RECOMMENDATION_CACHE_ENABLED", "1") == "1"
+RECOMMENDATION_QUANTIZER = FieldQuantizer(
+    geohash_precision=int(os.getenv("RECOMMENDATION_GEOHASH_PRECISION", "5")),
+    temperature_step=float(os.getenv("RECOMMENDATION_TEMPERATURE_STEP", "2")),
+    humidity_step=float(os.getenv("RECOMMENDATION_HUMIDITY_STEP", "5")),
+    rainfall_step=float(os.getenv("RECOMMENDATION_RAINFALL_STEP", "20"))
+)
+RECOMMENDATION_CACHE = LRUTTLCache(
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "4096")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL", "604800")),
+    db_path=os.getenv("RECOMMENDATION_CACHE_DB") or None,
+    name="recommendation"
+) if RECOMMENDATION_CACHE_ENABLED else None
+
+# --- LOCAL CROP RECOMMENDER ---
+# With RECOMMENDATION_ENGINE=local crops are ranked in process
+# (see crop_recommender.py). Soil pH/N/P/K come from the AgroLens models
+# for the nearest preprocessed Sentinel-2 point within
+# AGROLENS_MAX_DISTANCE_KM. Failing that, typical values for the requested
+# soil type are used. Both are scored against crop_requirements.json. Groq
+# only rewrites the reasons, and only when a request asks for it
+# ("narrative": true). Set AGROLENS_MODEL_DIR (the training MODEL_PATH) and
+# AGROLENS_DATASET_PATH (the training DATASET_PATH) to load the
+# AGROLENS_MODEL_CONFIG / AGROLENS_MODEL_VARIANT models and their
+# {config}_norm.csv features at start. Without them every field of a soil
+# type gets the same answer, so the default stays RECOMMENDATION_ENGINE=llm:
+# Groq produces the whole recommendation (cached as above).
+# The local engine reports N in g/kg and P/K in mg/kg (soil_data.units).
+RECOMMENDATION_ENGINE = os.getenv("RECOMMENDATION_ENGINE", "llm")
+AGROLENS_MODEL_DIR = os.getenv("AGROLENS_MODEL_DIR") or None
+AGROLENS_DATASET_PATH = os.getenv("AGROLENS_DATASET_PATH") or None
+AGROLENS_MODEL_CONFIG = os.getenv("AGROLENS_MODEL_CONFIG", "Model_A")
+AGROLENS_MODEL_VARIANT = os.getenv("AGROLENS_MODEL_VARIANT", "xgboost")
+AGROLENS_OPTIONAL_FEATURES = os.getenv("AGROLENS_OPTIONAL_FEATURES", "1") == "1"
+AGROLENS_MAX_DISTANCE_KM = float(os.getenv("AGROLENS_MAX_DISTANCE_KM", "10"))
+
+# Near-duplicate lookup: uploads whose perceptual hash is within
+# NEAR_DUPLICATE_MAX_DISTANCE bits of a previous diagnosis reuse it.
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "1") == "1"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+NEAR_DUPLICATE_INDEX = MultiIndexHashTable(
+    max_entries=int(os.getenv("NEAR_DUPLICATE_INDEX_SIZE", "100000"))
+) if NEAR_DUPLICATE_ENABLED else None
+
+# --- PIPELINING ---
+# PIPELINE_MODE=sequential: local model first, then Groq with the local hint.
+# PIPELINE_MODE=speculative: the Groq request starts without waiting for the
+# local model (it only carries the hint if the local model answers within
+# PIPELINE_HINT_WAIT_MS) and the two race each other.
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential")
+PIPELINE_HINT_WAIT_MS = float(os.getenv("PIPELINE_HINT_WAIT_MS", "0"))
+# Local-only fast path: when the local model is at least this confident (%)
+# its result is returned straight away; 0 disables the fast path. With
+# LOCAL_FAST_PATH_ENRICH=1 the LLM diagnosis is still fetched in the
+# background and cached so the next upload of the image gets the full report.
+# The confidence is the calibrated one (see LOCAL_CALIBRATION_PATH). The
+# fast path can also require a margin of LOCAL_FAST_PATH_MIN_MARGIN points
+# over the runner-up and a normalised entropy of at most
+# LOCAL_FAST_PATH_MAX_ENTROPY (0 = one class, 1 = uniform).
+LOCAL_FAST_PATH_CONFIDENCE = float(os.getenv("LOCAL_FAST_PATH_CONFIDENCE", "0"))
+LOCAL_FAST_PATH_MIN_MARGIN = float(os.getenv("LOCAL_FAST_PATH_MIN_MARGIN", "0"))
+LOCAL_FAST_PATH_MAX_ENTROPY = float(os.getenv("LOCAL_FAST_PATH_MAX_ENTROPY", "1"))
+LOCAL_ROUTING_POLICY = RoutingPolicy(
+    min_confidence=LOCAL_FAST_PATH_CONFIDENCE,
+    min_margin=LOCAL_FAST_PATH_MIN_MARGIN,
+    max_entropy=LOCAL_FAST_PATH_MAX_ENTROPY
+)
+LOCAL_FAST_PATH_ENRICH = os.getenv("LOCAL_FAST_PATH_ENRICH", "1") == "1"
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+# Hybrid diagnoses answered by the fast path vs. sent to Groq (the LLM-skip rate)
+LOCAL_ROUTING_STATS = {"local": 0, "llm": 0}
+
+# --- TEST-TIME AUGMENTATION ---
+# With LOCAL_TTA_ENABLED=1 an upload the local model is unsure about is
+# classified again from flipped, rotated and cropped views, in one batched
+# forward pass, and the probabilities are averaged (see tta.py).
+# LOCAL_TTA_SCHEDULE maps the first view's calibrated confidence (%), the
+# one the fast-path thresholds use, to a view count:
+# "90:1,70:4,0:8" leaves >= 90% alone, gives 70-90% four views and the
+# rest eight. Crops are cut from a LOCAL_TTA_CROP_RESIZE pixel resize.
+LOCAL_TTA_ENABLED = os.getenv("LOCAL_TTA_ENABLED", "0") == "1"
+LOCAL_TTA_SCHEDULE = os.getenv("LOCAL_TTA_SCHEDULE", "90:1,70:4,0:8")
+LOCAL_TTA_CROP_RESIZE = int(os.getenv("LOCAL_TTA_CROP_RESIZE", "256"))
+LOCAL_TTA = TestTimeAugmentation(
+    LOCAL_TTA_SCHEDULE, crop_resize=LOCAL_TTA_CROP_RESIZE
+) if LOCAL_TTA_ENABLED else None
+
+# --- BATCH DIAGNOSIS ---
+# /diagnose/batch takes up to BATCH_MAX_FILES images per request. All of
+# them go to the local model together, so they fill whole micro-batches.
+# Their Groq calls fan out over BATCH_LLM_CONCURRENCY threads, shared by
+# every batch request so a large batch cannot starve single /diagnose calls.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch")
+
+# --- DIAGNOSIS JOBS ---
+# POST /jobs/diagnose queues the upload in the JOBS_DB SQLite file and
+# returns a job id at once; JOBS_WORKERS threads run the diagnoses. Queued
+# jobs survive a restart. Past JOBS_MAX_DEPTH waiting jobs, submissions get
+# 429 with Retry-After. Finished jobs are kept for JOBS_RETENTION_SECONDS.
+# The database defaults to the user's data directory, not the package.
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOBS_DB = os.getenv("JOBS_DB") or os.path.join(
+    os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"), "crop-api", "jobs.db"
+)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_DEPTH = int(os.getenv("JOBS_MAX_DEPTH", "500"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETENTION_SECONDS = float(os.getenv("JOBS_RETENTION_SECONDS", "86400"))
+JOBS_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOBS_WEBHOOK_TIMEOUT_SECONDS", "10"))
+# A job that finds Groq unavailable (breaker open, retries used up) is
+# requeued after JOBS_RETRY_BACKOFF_SECONDS, doubling per attempt, until it
+# has run JOBS_MAX_ATTEMPTS times.
+JOBS_RETRY_BACKOFF_SECONDS = float(os.getenv("JOBS_RETRY_BACKOFF_SECONDS", "15"))
+# Webhooks may only target public addresses. JOBS_WEBHOOK_ALLOWED_HOSTS
+# ("hooks.example.com,ci.internal") restricts them to those hosts instead.
+JOBS_WEBHOOK_ALLOWED_HOSTS = [h.strip() for h in os.getenv("JOBS_WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+
+# --- GROQ GATEWAY ---
+# All Groq calls share one pooled client (see llm_gateway.py). The pool has
+# LLM_POOL_SIZE keep-alive connections, sized to the pipeline workers by
+# default. Each attempt times out after LLM_TIMEOUT_SECONDS. A call gets up
+# to LLM_MAX_RETRIES jittered retries on 429/5xx/connection errors, all
+# within LLM_DEADLINE_SECONDS. After LLM_BREAKER_THRESHOLD consecutive
+# failures the breaker opens for LLM_BREAKER_COOLDOWN_SECONDS, and
+# diagnoses fall back to the local model. GROQ_BASE_URL points the client at
+# another endpoint (a proxy or a stand-in server).
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(PIPELINE_WORKERS)))
+LLM_ASYNC_POOL_SIZE = int(os.getenv("LLM_ASYNC_POOL_SIZE", "100"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# --- ADMISSION CONTROL ---
+# Groq-bound requests (hybrid diagnoses, batches, job submissions and crop
+# recommendations) pass admission control before doing any work (see
+# admission.py). Each client, keyed by X-API-Key or else IP, gets a token
+# bucket. It refills at ADMISSION_RATE_PER_MINUTE and holds at most
+# ADMISSION_BURST tokens; a batch costs one token per image.
+# ADMISSION_MAX_CONCURRENT requests may hold a Groq slot at once, matching
+# the gateway pool by default. Others wait in a per-client round-robin
+# queue, at most ADMISSION_MAX_QUEUE_PER_CLIENT per client and
+# ADMISSION_MAX_QUEUE in total, for up to ADMISSION_MAX_WAIT_SECONDS.
+# Anything over these limits is answered at once with 429 and Retry-After.
+# Batch fan-out and job workers run on their own fixed pools, so a batch
+# holds a single slot and job submissions only pay tokens. Behind a reverse
+# proxy, set ADMISSION_TRUST_PROXY=1 to key clients by X-Forwarded-For.
+# Offline (?mode=local) requests never touch Groq and skip admission.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "30"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "10"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", str(LLM_POOL_SIZE)))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_CLIENT", "4"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "0") == "1"
+ADMISSION = AdmissionController(
+    rate_per_second=ADMISSION_RATE_PER_MINUTE / 60,
+    burst=ADMISSION_BURST,
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_queue_per_client=ADMISSION_MAX_QUEUE_PER_CLIENT,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS
+) if ADMISSION_ENABLED else None
+
+# --- PRE-FORK SERVING ---
+# serve.py imports this module once in a parent process and forks its
+# workers from it, so code, tables and indexes are shared copy-on-write. It
+# sets PREFORK_PARENT=1: the import then leaves out what cannot cross a fork
+# (the model runtime's threads, the job workers) and each worker calls
+# init_worker() once it has been forked.
+PREFORK_PARENT = os.getenv("PREFORK_PARENT", "0") == "1"
+PREFORK_WORKER = None
 
 # --- LOCAL MODEL SETUP ---
+# The primary model's engine (highest route weight) and whether any local
+# model is loaded; predictions go through MODEL_REGISTRY and MODEL_ROUTER
 DISEASE_MODEL = None
 MODEL_LOADED = False
+# LOCAL_ENGINE: "auto" uses a converted network.tflite when one is cached next
+# to network.h5 (see export_model.py), "tflite" converts on first start,
+# "keras" always loads the .h5 through TensorFlow.
+LOCAL_ENGINE = os.getenv("LOCAL_ENGINE", "auto")
+LOCAL_ENGINE_INT8 = os.getenv("LOCAL_ENGINE_INT8", "0") == "1"
+LOCAL_ENGINE_THREADS = int(os.getenv("LOCAL_ENGINE_THREADS", "0")) or None
+# Load + warm the local model on a background thread so the server binds
+# immediately; set MODEL_BACKGROUND_LOAD=0 to load before serving.
+MODEL_BACKGROUND_LOAD = os.getenv("MODEL_BACKGROUND_LOAD", "1") == "1"
+# loading -> warming -> ready, or unavailable (no model) / failed
+MODEL_STATE = "loading"
+MODEL_LOAD_SECONDS = None
+MODEL_READY_EVENT = threading.Event()
+MODEL_INPUT_SIZE = (224, 224)  # Standard input size for most MobileNet/VGG PV models
+
+# Micro-batching: concurrent requests are grouped into one forward pass.
+# LOCAL_BATCH_MAX_SIZE=1 effectively disables batching.
+LOCAL_BATCH_MAX_SIZE = int(os.getenv("LOCAL_BATCH_MAX_SIZE", "16"))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.getenv("LOCAL_BATCH_MAX_WAIT_MS", "5"))
+# Softmax scores are temperature-scaled with the temperature that
+# calibrate_model.py fitted on a labelled folder (none: used as they are).
+# Each local prediction carries its LOCAL_TOP_K most likely classes.
+LOCAL_CALIBRATION_PATH = os.getenv("LOCAL_CALIBRATION_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "calibration.json"
+)
+LOCAL_TOP_K = int(os.getenv("LOCAL_TOP_K", "3"))
+LOCAL_CALIBRATION = Calibration.load(LOCAL_CALIBRATION_PATH, top_k=LOCAL_TOP_K)
+# Image sent to Groq: downscaled to LLM_IMAGE_MAX_EDGE and re-encoded
+# (which strips EXIF). LLM_IMAGE_SHAPING=0 sends the original upload.
+LLM_IMAGE_SHAPING = os.getenv("LLM_IMAGE_SHAPING", "1") == "1"
+LLM_IMAGE_MAX_EDGE = int(os.getenv("LLM_IMAGE_MAX_EDGE", "1024"))
+LLM_IMAGE_QUALITY = int(os.getenv("LLM_IMAGE_QUALITY", "85"))
+LLM_IMAGE_FORMAT = os.getenv("LLM_IMAGE_FORMAT", "JPEG").upper()
+# JPEG uploads are decoded at the smallest DCT scale keeping this many
+# pixels (never below what the LLM image needs)
+DECODE_TARGET_EDGE = max(
+    int(os.getenv("DECODE_TARGET_EDGE", "512")),
+    LLM_IMAGE_MAX_EDGE if LLM_IMAGE_SHAPING else 0
+)
+LLM_PAYLOAD_STATS = {"requests": 0, "upload_bytes": 0, "sent_bytes": 0}
+LLM_PAYLOAD_LOCK = threading.Lock()  # updated from the pipeline worker threads
+# Crop-to-leaf: with LEAF_CROP_ENABLED=1 each upload is cut down to the
+# detected leaf right after decoding (see leaf_crop.py), so the cache keys,
+# the local model input and the image sent to Groq all use the crop. The
+# leaf is searched on a LEAF_ANALYSIS_EDGE thumbnail; boxes keeping more
+# than LEAF_CROP_MAX_SHARE of the frame are not worth cropping.
+LEAF_CROP_ENABLED = os.getenv("LEAF_CROP_ENABLED", "0") == "1"
+LEAF_CROPPER = LeafCropper(
+    analysis_edge=int(os.getenv("LEAF_ANALYSIS_EDGE", "128")),
+    max_crop_share=float(os.getenv("LEAF_CROP_MAX_SHARE", "0.85")),
+    padding=float(os.getenv("LEAF_CROP_PADDING", "0.08"))
+) if LEAF_CROP_ENABLED else None
 # PlantVillage 38 Classes
 CLASS_NAMES = [
     'Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
@@ -59,99 +358,418 @@ CLASS_NAMES = [
     'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
 ]
 
-# Patch for DepthwiseConv2D to handle version incompatibilities
-class FixedDepthwiseConv2D(DepthwiseConv2D):
-    def __init__(self, **kwargs):
-        if 'groups' in kwargs:
-            kwargs.pop('groups')
-        super().__init__(**kwargs)
+# --- MODEL REGISTRY ---
+# MODEL_REGISTRY_DIR holds one folder per model version, each with a
+# manifest.json giving its weights file, input size, normalization and
+# class list (see model_registry.py). /diagnose traffic is split across
+# versions by weight: a routes.json in the directory ({"id": 90, "id": 10}),
+# else MODEL_ROUTES ("id:90,id:10"), else every version equally. The
+# directory is polled every MODEL_REGISTRY_POLL_SECONDS; new routes and
+# changed model files are loaded, warmed and swapped in without a restart.
+# MODEL_SHADOW_RATE of local predictions also run on one other routed
+# version, to count how often versions agree.
+# Without MODEL_REGISTRY_DIR the network.h5 in the working directory is
+# served as the single model "default", with CLASS_NAMES.
+# MODEL_ADMIN_TOKEN enables the /models/* endpoints that load, unload and
+# re-route models (Authorization: Bearer <token>).
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "")
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+MODEL_SHADOW_RATE = float(os.getenv("MODEL_SHADOW_RATE", "0"))
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv("MODEL_REGISTRY_POLL_SECONDS", "10"))
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+LEGACY_MODEL_ID = "default"
+MODEL_REGISTRY = ModelRegistry(
+    MODEL_REGISTRY_DIR or None,
+    lambda path: load_engine(path, preference=LOCAL_ENGINE, int8=LOCAL_ENGINE_INT8, num_threads=LOCAL_ENGINE_THREADS),
+    max_batch_size=LOCAL_BATCH_MAX_SIZE,
+    max_wait_ms=LOCAL_BATCH_MAX_WAIT_MS,
+    top_k=LOCAL_TOP_K,
+    warm_batch_sizes=(1, LOCAL_BATCH_MAX_SIZE)
+)
+MODEL_ROUTER = ABRouter(shadow_rate=MODEL_SHADOW_RATE)
+LOCAL_MODEL_LATENCY = METRICS.histogram(
+    "local_model_duration_seconds", "Local classification time per model version, batching and TTA included", ("model",))
 
-def initialize_ai_engine():
-    """Initialize both the Local Model and Groq Vision API"""
-    global groq_client, AI_READY, DISEASE_MODEL, MODEL_LOADED
-    
-    # 1. Load Local Model
-    if TF_AVAILABLE:
+# --- OFFLINE DIAGNOSIS ---
+# Every local-only answer (mode=local, the fast path, and the fallback when
+# Groq is unavailable or not configured) is built from this table, loaded
+# once at startup. DISEASE_KNOWLEDGE_PATH swaps in another table.
+DIAGNOSIS_MODES = ("hybrid", "local")
+DISEASE_KNOWLEDGE = DiseaseKnowledgeBase(os.getenv("DISEASE_KNOWLEDGE_PATH") or KNOWLEDGE_PATH)
+_missing_knowledge = DISEASE_KNOWLEDGE.missing_classes(CLASS_NAMES)
+if _missing_knowledge:
+    log.warning("⚠️  No offline diagnosis entry for some classes", extra={"classes": _missing_knowledge})
+
+def load_crop_recommender():
+    """Crop scorer plus, when configured and loadable, the AgroLens soil models"""
+    features = predictors = None
+    if AGROLENS_MODEL_DIR and AGROLENS_DATASET_PATH:
         try:
-            model_path = os.path.join(os.getcwd(), "network.h5")
-            if os.path.exists(model_path):
-                print(f"Loading local model from {model_path}...")
-                DISEASE_MODEL = tf.keras.models.load_model(
-                    model_path, 
-                    custom_objects={'DepthwiseConv2D': FixedDepthwiseConv2D},
-                    compile=False
-                )
-                MODEL_LOADED = True
-                print("✅ LOCAL MODEL LOADED SUCCESSFUL")
+            settings_path = os.path.join(AGROLENS_DATASET_PATH, "Feature_Cols", "model_settings.json")
+            with open(settings_path) as f:
+                settings = json.load(f)[AGROLENS_MODEL_CONFIG]
+            # Same column order as predictor_training.run_model
+            columns = settings["feature_columns"]
+            if AGROLENS_OPTIONAL_FEATURES:
+                columns = columns + settings.get("optional_feature_columns", [])
+            features = SentinelFeatureStore(
+                os.path.join(AGROLENS_DATASET_PATH, f"{AGROLENS_MODEL_CONFIG}_norm.csv"),
+                columns,
+                max_distance_km=AGROLENS_MAX_DISTANCE_KM
+            )
+            predictors = NutrientPredictors(AGROLENS_MODEL_DIR, AGROLENS_MODEL_CONFIG, AGROLENS_MODEL_VARIANT)
+            log.info("✅ AgroLens soil models loaded", extra={"model": predictors.name, "points": len(features)})
+        except Exception as e:
+            log.warning("⚠️ AgroLens soil models unavailable (%s). Using soil-type defaults.", e)
+            features = predictors = None
+    return LocalCropRecommender(CropScorer(), features, predictors)
+
+CROP_RECOMMENDER = load_crop_recommender() if RECOMMENDATION_ENGINE == "local" else None
+
+def legacy_manifest():
+    """network.h5 from the working directory, with the built-in class list"""
+    model_path = os.path.join(os.getcwd(), "network.h5")
+    return ModelManifest(
+        LEGACY_MODEL_ID, model_path, CLASS_NAMES,
+        input_size=MODEL_INPUT_SIZE,
+        name="network.h5",
+        calibration_path=LOCAL_CALIBRATION_PATH,
+        watched_paths=(model_path, tflite_path_for(model_path, LOCAL_ENGINE_INT8), LOCAL_CALIBRATION_PATH)
+    )
+
+def model_routes():
+    """Routes for the registry: its routes.json, else MODEL_ROUTES, else every model equally"""
+    routes = read_routes(os.path.join(MODEL_REGISTRY_DIR, ROUTES_NAME))
+    if routes is None:
+        routes = parse_routes(MODEL_ROUTES) or {model_id: 1 for model_id in MODEL_REGISTRY.discover()}
+    return routes
+
+def refresh_model_globals():
+    """Point DISEASE_MODEL / MODEL_LOADED / MODEL_STATE at what the registry holds now"""
+    global DISEASE_MODEL, MODEL_LOADED, MODEL_STATE
+    models = MODEL_REGISTRY.models()
+    primary = max(models, key=lambda model_id: (MODEL_ROUTER.routes.get(model_id, 0), model_id), default=None)
+    DISEASE_MODEL = models[primary].engine if primary else None
+    MODEL_LOADED = primary is not None
+    if MODEL_LOADED:
+        MODEL_STATE = "ready"
+
+def apply_model_routes(routes):
+    """Load the routed models, switch traffic to them, then unload what nothing routes to.
+
+    A model that fails to load keeps its previous version, if any; when no
+    routed model could be loaded, whatever is loaded keeps serving.
+    """
+    wanted = [model_id for model_id, weight in routes.items() if weight > 0]
+    MODEL_REGISTRY.ensure(wanted)
+    MODEL_ROUTER.set_routes(routes)
+    live = [model_id for model_id in wanted if model_id in MODEL_REGISTRY.models()]
+    if live:
+        MODEL_REGISTRY.retain(live)
+    refresh_model_globals()
+
+def install_local_engine(engine, manifest=None):
+    """Serve an engine that is already loaded (a benchmark's stand-in model) as the only local model"""
+    manifest = manifest or legacy_manifest()
+    MODEL_REGISTRY.install(manifest, engine, LOCAL_CALIBRATION if manifest.model_id == LEGACY_MODEL_ID else None)
+    MODEL_ROUTER.set_routes({manifest.model_id: 100})
+    MODEL_REGISTRY.retain([manifest.model_id])
+    refresh_model_globals()
+
+def load_local_model():
+    """Load the local model(s) and run a warm-up inference before serving them"""
+    global MODEL_STATE, MODEL_LOAD_SECONDS
+    start = time.perf_counter()
+    try:
+        MODEL_STATE = "loading"
+        if MODEL_REGISTRY_DIR:
+            routes = model_routes()
+            log.info("Loading local models", extra={"registry": MODEL_REGISTRY_DIR, "routes": routes})
+            if routes:
+                apply_model_routes(routes)
+            if not MODEL_LOADED:
+                MODEL_STATE = "failed" if routes else "unavailable"
+                log.warning("⚠️ No local model loaded from the registry. Predicting with LLM only.",
+                            extra={"errors": MODEL_REGISTRY.errors})
+        else:
+            manifest = legacy_manifest()
+            model_path = manifest.model_path
+            if os.path.exists(model_path) or os.path.exists(tflite_path_for(model_path, LOCAL_ENGINE_INT8)):
+                log.info("Loading local model", extra={"path": model_path, "engine": LOCAL_ENGINE})
+
+                def warming():
+                    global MODEL_STATE
+                    MODEL_STATE = "warming"
+
+                MODEL_REGISTRY.load(manifest, on_warm_up=warming)
+                MODEL_ROUTER.set_routes({LEGACY_MODEL_ID: 100})
+                refresh_model_globals()
+                log.info("✅ Local model loaded", extra={"engine": DISEASE_MODEL.name})
             else:
-                print("⚠️ network.h5 not found. Predicting with LLM only.")
+                MODEL_STATE = "unavailable"
+                log.warning("⚠️ network.h5 not found. Predicting with LLM only.")
+    except Exception as e:
+        MODEL_STATE = "failed"
+        log.exception("❌ Error loading local model: %s", e)
+    finally:
+        MODEL_LOAD_SECONDS = round(time.perf_counter() - start, 3)
+        MODEL_READY_EVENT.set()
+
+def watch_model_registry():
+    """Poll the registry directory and swap in changed routes and model files"""
+    MODEL_READY_EVENT.wait()
+    while True:
+        time.sleep(MODEL_REGISTRY_POLL_SECONDS)
+        try:
+            apply_model_routes(model_routes())
         except Exception as e:
-            print(f"❌ Error loading local model: {e}")
-            traceback.print_exc()
+            log.warning("⚠️ Model registry poll failed: %s", e)
+
+def start_registry_watcher():
+    """Start polling the registry (in each server process: threads do not survive the pre-fork)"""
+    if MODEL_REGISTRY_DIR and MODEL_REGISTRY_POLL_SECONDS > 0:
+        threading.Thread(target=watch_model_registry, name="model-registry", daemon=True).start()
+
+def initialize_ai_engine():
+    """Initialize both the Local Model and Groq Vision API"""
+    global LLM_GATEWAY, AI_READY
+    
+    # 1. Load Local Model (converted TFLite artifact preferred over the .h5).
+    # Until it is warm, /diagnose runs in LLM-only mode.
+    if PREFORK_PARENT:
+        log.info("Pre-fork parent: serve.py decides where the local model is loaded")
+    elif MODEL_BACKGROUND_LOAD:
+        threading.Thread(target=load_local_model, name="model-loader", daemon=True).start()
+    else:
+        load_local_model()
+    if not PREFORK_PARENT:
+        start_registry_watcher()
 
     # 2. Initialize Groq
     try:
         if not GROQ_API_KEY:
             raise Exception("GROQ_API_KEY not set")
         
-        print("Initializing Groq Llama Vision API...")
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        log.info("Initializing Groq Llama Vision API...")
+        LLM_GATEWAY = LLMGateway(
+            GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            pool_size=LLM_POOL_SIZE,
+            async_pool_size=LLM_ASYNC_POOL_SIZE,
+            timeout_seconds=LLM_TIMEOUT_SECONDS,
+            deadline_seconds=LLM_DEADLINE_SECONDS,
+            max_retries=LLM_MAX_RETRIES,
+            breaker=CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS)
+        )
         
         AI_READY = True
-        print("✅ AI ENGINE READY - Groq Llama Vision Initialized")
+        log.info("✅ AI engine ready - Groq Llama Vision initialized")
         
     except Exception as e:
-        print(f"❌ AI ENGINE FAILURE: {e}")
-        traceback.print_exc()
+        log.error("❌ AI engine failure: %s", e)
         AI_READY = False
 
 # --- INITIALIZE ENGINE ON STARTUP ---
 initialize_ai_engine()
 
-def predict_disease_local(image_data):
-    """Predict crop disease using local network.h5 model"""
-    if not MODEL_LOADED or not TF_AVAILABLE:
-        return None, 0
-    
+def timed_decode(data):
+    """decode_upload for an incoming request, observed as the decode stage"""
+    start = time.perf_counter()
+    upload = decode_upload(data, DECODE_TARGET_EDGE, LEAF_CROPPER)
+    observe_stage("decode", elapsed_ms(start))
+    return upload
+
+def as_upload(image):
+    """Accept raw upload bytes or an already decoded upload"""
+    if isinstance(image, DecodedUpload):
+        return image
+    return decode_upload(image, DECODE_TARGET_EDGE, LEAF_CROPPER)
+
+def preprocess_image_local(image):
+    """Single (224, 224, 3) uint8 model input; scaled to [0, 1] at batch time"""
+    return as_upload(image).model_input(MODEL_INPUT_SIZE)
+
+def classify_local(uploads, model_id):
+    """LocalPredictions for uploads from one model version, held by a lease for the whole call"""
+    with MODEL_REGISTRY.lease(model_id) as model:
+        start = time.perf_counter()
+        predictions = model.classify(uploads, LOCAL_TTA)
+    if METRICS_ENABLED:
+        LOCAL_MODEL_LATENCY.observe(time.perf_counter() - start, model=model_id)
+    return predictions
+
+def compare_shadow(upload, served, shadow_id):
+    """Run the upload on another routed model and count whether it agrees with the served answer"""
     try:
-        # Preprocess image
-        img = Image.open(io.BytesIO(image_data))
-        img = img.convert('RGB')
-        img = img.resize((224, 224))  # Standard input size for most MobileNet/VGG PV models
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        # Predict
-        predictions = DISEASE_MODEL.predict(img_array, verbose=0)
-        result_idx = np.argmax(predictions[0])
-        confidence = float(predictions[0][result_idx]) * 100
-        
-        predicted_class = CLASS_NAMES[result_idx]
-        print(f"DEBUG: Local Prediction: {predicted_class} ({confidence:.2f}%)")
-        
-        return predicted_class, confidence
+        shadow = classify_local([upload], shadow_id)[0]
+        MODEL_ROUTER.record_agreement(served.model, shadow_id, shadow.label == served.label)
     except Exception as e:
-        print(f"Local Prediction Error: {e}")
-        return None, 0
+        log.debug("Shadow prediction on %s failed: %s", shadow_id, e)
 
-def encode_image_to_base64(image_data):
-    """Convert image bytes to base64 string"""
-    return base64.b64encode(image_data).decode('utf-8')
+def routed_predictions(uploads):
+    """LocalPrediction per upload, each from the model version the router picks for it.
 
-def analyze_crop_disease(image_data):
-    """Hybrid approach: Local classification + LLM analysis"""
+    Uploads routed to the same version share one call, so they still fill
+    whole batches. A version swapped out between the pick and the lease is
+    picked again.
+    """
+    predictions = [None] * len(uploads)
+    pending = list(range(len(uploads)))
+    for _ in range(2):
+        loaded = MODEL_REGISTRY.models()
+        groups = {}
+        for i in pending:
+            groups.setdefault(MODEL_ROUTER.choose(uploads[i].raw, loaded), []).append(i)
+        pending = []
+        for model_id, indexes in groups.items():
+            if model_id is None:
+                continue
+            try:
+                for i, prediction in zip(indexes, classify_local([uploads[i] for i in indexes], model_id)):
+                    predictions[i] = prediction
+            except KeyError:
+                pending.extend(indexes)
+                continue
+            MODEL_ROUTER.record(model_id, len(indexes))
+            for i in indexes:
+                shadow_id = MODEL_ROUTER.shadow_for(model_id, loaded)
+                if shadow_id is not None:
+                    PIPELINE_EXECUTOR.submit(compare_shadow, uploads[i], predictions[i], shadow_id)
+        if not pending:
+            break
+    return [prediction or LocalPrediction(None, 0) for prediction in predictions]
+
+def predict_disease_local(image):
+    """Predict crop disease with the local model version routed for this image"""
+    if not MODEL_LOADED:
+        return LocalPrediction(None, 0)
+    
     try:
-        image_base64 = encode_image_to_base64(image_data)
+        # Preprocess, then predict (batched together with any concurrent requests)
+        prediction = routed_predictions([as_upload(image)])[0]
+        if prediction.label is not None:
+            log.debug("Local prediction", extra={
+                "model": prediction.model,
+                "predicted_class": prediction.label,
+                "confidence": round(prediction.confidence, 2),
+                "margin": round(prediction.margin, 2)
+            })
         
-        # 🟢 STEP 1: Local Model Prediction
-        local_prediction, local_confidence = predict_disease_local(image_data)
-        
-        # 🟢 STEP 2: Groq LLM Analysis (using prediction as hint)
-        prompt_hint = ""
-        if local_prediction:
-            prompt_hint = f"\n\nContext: My local classification model predicted this as '{local_prediction}' with {local_confidence:.1f}% confidence. Please verify this prediction from the image."
+        return prediction
+    except Exception as e:
+        log.warning("Local prediction error: %s", e)
+        return LocalPrediction(None, 0)
+
+def predict_many_local(images):
+    """predict_disease_local for several images, queued together so they fill whole batches"""
+    if not MODEL_LOADED:
+        return [LocalPrediction(None, 0)] * len(images)
+    try:
+        return routed_predictions([as_upload(image) for image in images])
+    except Exception as e:
+        log.warning("Local prediction error: %s", e)
+        return [LocalPrediction(None, 0)] * len(images)
 
-        prompt = f"""You are an expert agricultural pathologist.
+def llm_image_url(image):
+    """Data URL for the Groq request, downscaled/recompressed unless disabled"""
+    upload = as_upload(image)
+    if not LLM_IMAGE_SHAPING:
+        sent_bytes = len(upload.raw)
+        url = f"data:image/jpeg;base64,{upload.base64()}"
+    else:
+        image_base64, mime, sent_bytes = upload.llm_payload(LLM_IMAGE_MAX_EDGE, LLM_IMAGE_QUALITY, LLM_IMAGE_FORMAT)
+        url = f"data:{mime};base64,{image_base64}"
+    with LLM_PAYLOAD_LOCK:
+        LLM_PAYLOAD_STATS["requests"] += 1
+        LLM_PAYLOAD_STATS["upload_bytes"] += len(upload.raw)
+        LLM_PAYLOAD_STATS["sent_bytes"] += sent_bytes
+    return url, sent_bytes
+
+def image_cache_key(img):
+    """Hash of the decoded pixel data, so lossless re-encodes of an image share a key"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def lookup_cached_diagnosis(upload):
+    """Check the exact and near-duplicate caches.
+
+    Returns (result, keys): result is the cached diagnosis or None, keys is
+    what store_diagnosis needs to remember a fresh result for this image.
+    """
+    if DIAGNOSIS_CACHE is None and NEAR_DUPLICATE_INDEX is None:
+        return None, (None, None)
+
+    img = upload.image
+
+    cache_key = None
+    if DIAGNOSIS_CACHE is not None:
+        cache_key = image_cache_key(img)
+        cached = DIAGNOSIS_CACHE.get(cache_key)
+        if cached is not None:
+            log.debug("⚡ Diagnosis cache hit")
+            cached["meta"] = {"source": "cache"}
+            return cached, (cache_key, None)
+
+    image_hash = None
+    if NEAR_DUPLICATE_INDEX is not None:
+        image_hash = dhash(img)
+        match = NEAR_DUPLICATE_INDEX.nearest(image_hash, NEAR_DUPLICATE_MAX_DISTANCE)
+        if match is not None:
+            distance, stored = match
+            log.debug("⚡ Near-duplicate hit", extra={"distance": distance})
+            result = json.loads(stored)
+            result["meta"] = {"source": "near_duplicate", "distance": distance}
+            return result, (cache_key, image_hash)
+
+    return None, (cache_key, image_hash)
+
+def store_diagnosis(keys, result):
+    """Remember a successful LLM diagnosis under the keys from lookup_cached_diagnosis"""
+    if result.get("disease") == "Unable to analyze":
+        return
+    if result.get("meta", {}).get("source") == "local":
+        return
+    result = {k: v for k, v in result.items() if k != "meta"}
+    cache_key, image_hash = keys
+    if cache_key is not None:
+        DIAGNOSIS_CACHE.set(cache_key, result)
+    if image_hash is not None:
+        NEAR_DUPLICATE_INDEX.add(image_hash, json.dumps(result))
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def analyze_crop_disease(image, admit=None):
+    """Cached entry point: identical or near-identical images skip inference.
+
+    admit() is called for an admission ticket only if the diagnosis goes to Groq.
+    """
+    start = time.perf_counter()
+    upload = as_upload(image)
+    cached, keys = lookup_cached_diagnosis(upload)
+    if cached is not None:
+        cached["meta"]["timings_ms"] = {"cache_lookup": elapsed_ms(start), "total": elapsed_ms(start)}
+        return cached
+    cache_lookup_ms = elapsed_ms(start)
+
+    result = run_diagnosis(upload, keys, admit=admit)
+    store_diagnosis(keys, result)
+    result["meta"]["timings_ms"]["cache_lookup"] = cache_lookup_ms
+    result["meta"]["timings_ms"]["total"] = elapsed_ms(start)
+    return result
+
+DIAGNOSIS_MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
+DIAGNOSIS_REQUIRED_KEYS = ("disease", "crop")
+
+def build_diagnosis_prompt(local_prediction, local_confidence):
+    """Vision prompt, with the local model's prediction as a hint when available"""
+    prompt_hint = ""
+    if local_prediction:
+        prompt_hint = f"\n\nContext: My local classification model predicted this as '{local_prediction}' with {local_confidence:.1f}% confidence. Please verify this prediction from the image."
+
+    prompt = f"""You are an expert agricultural pathologist.
 {prompt_hint}
 
 Analyze this crop leaf image carefully and provide a detailed diagnosis and a day-wise recovery plan.
@@ -179,165 +797,497 @@ Rules:
 - Be precise and scientific.
 - In 'additional_notes', include specific 'Tips' and 'Cautions'.
 - The 'recovery_plan' MUST have exactly 3 timeline points (e.g., Day 1, Day 3, Day 7)."""
+    return prompt
 
-        # Call Groq Vision API
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                    ]
-                }
-            ],
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            temperature=0.2,
-            max_tokens=1024
-        )
-        
-        # Extract the response
-        response_text = chat_completion.choices[0].message.content
-        print(f"Raw API Response: {response_text[:500]}...")  # Debug log
-        
-        # Llama 4 Scout specific: Remove thinking tags if they exist
-        import re
-        if "<thinking>" in response_text and "</thinking>" in response_text:
-            response_text = re.sub(r'<thinking>.*?</thinking>', '', response_text, flags=re.DOTALL).strip()
-            print("✨ Stripped thinking tags")
-        
-        # Try to parse JSON from response
-        import json
-        
-        # Method 1: Try direct JSON parse after stripping thinking
+def build_diagnosis_request(prompt, image_url):
+    """Keyword arguments for LLM_GATEWAY.chat (chat.completions.create)"""
+    return dict(
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]
+            }
+        ],
+        model=DIAGNOSIS_MODEL_NAME,
+        temperature=0.2,
+        max_tokens=1024
+    )
+
+def json_parse_outcome(response_text, result):
+    """How the model wrapped the JSON object we extracted, for llm_json_parse_total"""
+    if result is None:
+        return "not_found"
+    if response_text.lstrip().startswith("{"):
+        return "bare"
+    if "```" in response_text:
+        return "fenced"
+    return "embedded"
+
+def parse_diagnosis_response(response_text):
+    """Extract the diagnosis JSON object from the raw LLM response"""
+    result = extract_json_object(response_text, DIAGNOSIS_REQUIRED_KEYS)
+    if METRICS_ENABLED:
+        LLM_JSON_PARSES.inc(response="diagnosis", outcome=json_parse_outcome(response_text, result))
+    if result is not None:
+        return normalize_diagnosis(result)
+
+    # No usable object in the response, return a user-friendly error
+    log.warning("⚠️  No diagnosis JSON found in AI response", extra={"preview": response_text[:500]})
+    
+    return {
+        "disease": "Unable to analyze",
+        "crop": "Unknown",
+        "confidence": 50,
+        "severity": "unknown",
+        "symptoms": ["Could not parse AI response"],
+        "treatment": "The AI model returned an unexpected format. Please try again with a different image or check the backend logs.",
+        "affected_area": "N/A",
+        "additional_notes": "Unable to parse the AI response. This may be a temporary issue with the model.",
+        "recovery_plan": []
+    }
+
+def build_local_result(predicted_class, confidence):
+    """Diagnosis in the LLM response schema, from the local class and the knowledge table"""
+    return DISEASE_KNOWLEDGE.diagnose(predicted_class, confidence)
+
+def diagnose_local(upload, fallback=None, local=None):
+    """Offline diagnosis (mode=local): local model + knowledge table, no Groq and no caches.
+
+    local is an already computed (prediction, confidence, ms) for the upload.
+    """
+    start = time.perf_counter()
+    timings = {}
+    local = local or timed_local_prediction(upload)
+    local_prediction, local_confidence, timings["local_inference"] = local
+    if local_prediction is None:
+        raise RuntimeError("Local model returned no prediction")
+    stage = time.perf_counter()
+    result = build_local_result(local_prediction, local_confidence)
+    timings["knowledge_lookup"] = elapsed_ms(stage)
+    timings["total"] = elapsed_ms(start)
+    extra = {"fallback": fallback} if fallback else {}
+    return with_meta(result, "local", timings, mode="local", local_class=local_prediction, **local_details(local), **extra)
+
+def select_diagnosis_mode(requested):
+    """Resolve the ?mode= / form mode of a /diagnose request.
+
+    Returns (mode, fallback, error). mode is "hybrid" or "local"; fallback
+    says why a hybrid request is answered offline; error is a (status,
+    message) pair when the request cannot be served at all.
+    """
+    requested = (requested or "hybrid").lower()
+    if requested not in DIAGNOSIS_MODES:
+        return requested, None, (400, f"Unknown mode '{requested}'. Use one of: {', '.join(DIAGNOSIS_MODES)}")
+    if requested == "hybrid" and AI_READY:
+        return "hybrid", None, None
+    if not MODEL_LOADED:
+        if requested == "local":
+            return requested, None, (503, "Local model is not loaded, so offline diagnosis is unavailable.")
+        return requested, None, (503, "AI Engine is not ready. Please check GROQ_API_KEY configuration.")
+    # Groq is not configured but the local model is: answer offline
+    return "local", (None if requested == "local" else "llm_not_configured"), None
+
+def use_local_fast_path(local):
+    """Whether the routing policy lets this local prediction answer without Groq"""
+    return LOCAL_ROUTING_POLICY.skip_llm(local)
+
+def local_details(local):
+    """Top-k, entropy and margin of a local prediction, for the response metadata"""
+    return {"local_details": local.details()} if isinstance(local, LocalPrediction) and local.top_k else {}
+
+def timed_local_prediction(upload):
+    """(class, confidence, ms) LocalPrediction for the upload"""
+    start = time.perf_counter()
+    return predict_disease_local(upload).timed(elapsed_ms(start))
+
+def timed_llm_diagnosis(prompt, image_url):
+    """Call Groq Vision API and return (response_text, elapsed ms)"""
+    start = time.perf_counter()
+    chat_completion = LLM_GATEWAY.chat(**build_diagnosis_request(prompt, image_url))
+    response_text = chat_completion.choices[0].message.content
+    log.debug("Raw API response: %.500s", response_text)
+    return response_text, elapsed_ms(start)
+
+def local_fallback(local_prediction, local_confidence, timings, error):
+    """Local-only diagnosis while Groq is unavailable; re-raises without a local answer"""
+    if local_prediction is None:
+        raise error
+    log.warning("⚠️  LLM unavailable; answering from the local model", extra={"error": str(error)})
+    result = build_local_result(local_prediction, local_confidence)
+    return with_meta(result, "local", timings, fallback="llm_unavailable")
+
+def enrich_in_background(llm_future, keys):
+    """Cache the LLM diagnosis once it lands, after a fast-path response"""
+    def _store(future):
         try:
-            result = json.loads(response_text)
-            if 'disease' in result and 'crop' in result:
-                print("✅ Direct JSON parse successful")
-                
-                # Ensure additional_notes is a string (prevents frontend crash if it's an object)
-                if isinstance(result.get('additional_notes'), dict):
-                    notes_obj = result['additional_notes']
-                    flattened_notes = " ".join([f"{k}: {v}" for k, v in notes_obj.items()])
-                    result['additional_notes'] = flattened_notes
-                
-                result.setdefault('symptoms', [])
-                result.setdefault('additional_notes', '')
-                result.setdefault('recovery_plan', [])
-                return result
-        except json.JSONDecodeError:
-            pass
+            response_text, _ = future.result()
+            store_diagnosis(keys, parse_diagnosis_response(response_text))
+        except Exception as e:
+            log.warning("Background enrichment failed: %s", e)
+    llm_future.add_done_callback(_store)
+
+def run_diagnosis(image, keys=(None, None), local=None, admit=None):
+    """Hybrid approach: Local classification + LLM analysis.
+
+    local is an already computed (prediction, confidence, ms) for the image;
+    with it the pipeline runs sequentially from the Groq step. admit()
+    returns the admission ticket held for the Groq call (none by default);
+    answers that skip Groq never call it.
+    """
+    admit = admit or no_admission
+    try:
+        timings = {}
+        start = time.perf_counter()
+        upload = as_upload(image)
+        image_url, sent_bytes = llm_image_url(upload)
+        timings["encode"] = elapsed_ms(start)
+        can_enrich = LOCAL_FAST_PATH_ENRICH and keys != (None, None)
+
+        if PIPELINE_MODE == "speculative" and local is None:
+            # 🟢 Local model and Groq run concurrently
+            local_future = PIPELINE_EXECUTOR.submit(timed_local_prediction, upload)
+            local = None
+            if PIPELINE_HINT_WAIT_MS > 0:
+                try:
+                    local = local_future.result(timeout=PIPELINE_HINT_WAIT_MS / 1000)
+                except FutureTimeout:
+                    pass
+
+            if local is not None and use_local_fast_path(local):
+                timings["local_inference"] = local[2]
+                if can_enrich:
+                    prompt = build_diagnosis_prompt(local[0], local[1])
+                    enrich_in_background(PIPELINE_EXECUTOR.submit(timed_llm_diagnosis, prompt, image_url), keys)
+                return with_meta(build_local_result(local[0], local[1]), "local", timings, **local_details(local))
+
+            local_hint = local[0] if local else None
+            prompt = build_diagnosis_prompt(*(local[:2] if local else (None, 0)))
+            ticket = admit()
+            llm_future = PIPELINE_EXECUTOR.submit(timed_llm_diagnosis, prompt, image_url)
+            llm_future.add_done_callback(lambda _: ticket.release())
+
+            if local is None:
+                wait([local_future, llm_future], return_when=FIRST_COMPLETED)
+                if not llm_future.done():
+                    local = local_future.result()
+                    if use_local_fast_path(local):
+                        timings["local_inference"] = local[2]
+                        if can_enrich:
+                            enrich_in_background(llm_future, keys)
+                        return with_meta(build_local_result(local[0], local[1]), "local", timings, **local_details(local))
 
-        
-        # Method 2: Extract from markdown code blocks
-        if "```json" in response_text:
-            try:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted from ```json block")
-                    
-                    if isinstance(result.get('additional_notes'), dict):
-                        notes_obj = result['additional_notes']
-                        result['additional_notes'] = " ".join([f"{k}: {v}" for k, v in notes_obj.items()])
-                        
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    result.setdefault('recovery_plan', [])
-                    return result
-            except (IndexError, json.JSONDecodeError):
-                pass
-        
-        # Method 3: Extract from any code block
-        if "```" in response_text:
-            try:
-                json_str = response_text.split("```")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted from ``` block")
-                    
-                    if isinstance(result.get('additional_notes'), dict):
-                        notes_obj = result['additional_notes']
-                        result['additional_notes'] = " ".join([f"{k}: {v}" for k, v in notes_obj.items()])
-                        
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    result.setdefault('recovery_plan', [])
-                    return result
-            except (IndexError, json.JSONDecodeError):
-                pass
-        
-        # Method 4: Use improved regex to find complete JSON object
-        json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
-        matches = re.findall(json_pattern, response_text, re.DOTALL)
-        
-        for match in matches:
             try:
-                result = json.loads(match)
-                if 'disease' in result and 'crop' in result:
-                    print(f"✅ Extracted using regex (length: {len(match)})")
-                    
-                    if isinstance(result.get('additional_notes'), dict):
-                        notes_obj = result['additional_notes']
-                        result['additional_notes'] = " ".join([f"{k}: {v}" for k, v in notes_obj.items()])
-                        
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    result.setdefault('recovery_plan', [])
-                    return result
-            except json.JSONDecodeError:
-                continue
-        
-        # Method 5: Try to find JSON between curly braces more aggressively
-        brace_start = response_text.find('{')
-        brace_end = response_text.rfind('}')
-        
-        if brace_start != -1 and brace_end != -1 and brace_end > brace_start:
+                response_text, timings["llm"] = llm_future.result()
+            except LLMUnavailableError as e:
+                local = local_future.result()
+                timings["local_inference"] = local[2]
+                return local_fallback(local[0], local[1], timings, e)
+            if local_future.done():
+                timings["local_inference"] = local_future.result()[2]
+        else:
+            # 🟢 STEP 1: Local Model Prediction
+            local = local or timed_local_prediction(upload)
+            local_prediction, local_confidence, timings["local_inference"] = local
+
+            if use_local_fast_path(local):
+                if can_enrich:
+                    prompt = build_diagnosis_prompt(local_prediction, local_confidence)
+                    enrich_in_background(PIPELINE_EXECUTOR.submit(timed_llm_diagnosis, prompt, image_url), keys)
+                return with_meta(
+                    build_local_result(local_prediction, local_confidence), "local", timings, **local_details(local)
+                )
+
+            # 🟢 STEP 2: Groq LLM Analysis (using prediction as hint)
+            local_hint = local_prediction
+            prompt = build_diagnosis_prompt(local_prediction, local_confidence)
             try:
-                json_str = response_text[brace_start:brace_end + 1]
-                result = json.loads(json_str)
-                if 'disease' in result and 'crop' in result:
-                    print("✅ Extracted using brace position")
-                    
-                    if isinstance(result.get('additional_notes'), dict):
-                        notes_obj = result['additional_notes']
-                        result['additional_notes'] = " ".join([f"{k}: {v}" for k, v in notes_obj.items()])
-                        
-                    result.setdefault('symptoms', [])
-                    result.setdefault('additional_notes', '')
-                    result.setdefault('recovery_plan', [])
-                    return result
-            except json.JSONDecodeError:
-                pass
-        
-        # If all methods fail, return a user-friendly error
-        print("⚠️  All JSON parsing methods failed")
-        print(f"Response preview: {response_text[:500]}")
-        
-        return {
-            "disease": "Unable to analyze",
-            "crop": "Unknown",
-            "confidence": 50,
-            "severity": "unknown",
-            "symptoms": ["Could not parse AI response"],
-            "treatment": "The AI model returned an unexpected format. Please try again with a different image or check the backend logs.",
-            "affected_area": "N/A",
-            "additional_notes": "Unable to parse the AI response. This may be a temporary issue with the model.",
-            "recovery_plan": []
-        }
+                with admit():
+                    response_text, timings["llm"] = timed_llm_diagnosis(prompt, image_url)
+            except LLMUnavailableError as e:
+                return local_fallback(local_prediction, local_confidence, timings, e)
+
+        parse_start = time.perf_counter()
+        result = parse_diagnosis_response(response_text)
+        timings["parse"] = elapsed_ms(parse_start)
+        return with_meta(
+            result, "llm", timings,
+            hint_included=bool(local_hint),
+            upload_bytes=len(upload.raw),
+            llm_image_bytes=sent_bytes
+        )
     
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"Vision Analysis Error: {e}")
-        traceback.print_exc()
+        log.exception("Vision analysis error: %s", e)
         raise e
 
+def stream_llm_diagnosis(prompt, image_url):
+    """Yield the Groq Vision completion as it is generated, chunk by chunk"""
+    stream = LLM_GATEWAY.chat(stream=True, **build_diagnosis_request(prompt, image_url))
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def sse_event(event, data):
+    """One Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def result_event(result):
+    """The final SSE `result` event, counted in the metrics"""
+    return sse_event("result", record_diagnosis(result))
+
+def stream_diagnosis(upload, admit=None):
+    """SSE events for /diagnose/stream.
+
+    A cache hit is sent as the final `result` straight away. Otherwise the
+    local model's answer goes out first as `local`, then each top-level field
+    of the LLM diagnosis as a `field` event as soon as it is complete, and
+    finally the parsed diagnosis as `result`. The admission ticket from
+    admit() is taken just before Groq is called; a rejection is an `error`
+    event, since the response has already started.
+    """
+    admit = admit or no_admission
+    try:
+        start = time.perf_counter()
+        cached, keys = lookup_cached_diagnosis(upload)
+        if cached is not None:
+            cached["meta"]["timings_ms"] = {"cache_lookup": elapsed_ms(start), "total": elapsed_ms(start)}
+            yield result_event(cached)
+            return
+        timings = {"cache_lookup": elapsed_ms(start)}
+
+        # 🟢 STEP 1: Local Model Prediction, sent before the LLM is even called
+        local = timed_local_prediction(upload)
+        local_prediction, local_confidence, timings["local_inference"] = local
+        if local_prediction is not None:
+            local_result = build_local_result(local_prediction, local_confidence)
+            yield sse_event("local", with_meta(local_result, "local", dict(timings), mode="stream", **local_details(local)))
+
+        image_url, sent_bytes = llm_image_url(upload)
+        if use_local_fast_path(local):
+            if LOCAL_FAST_PATH_ENRICH and keys != (None, None):
+                prompt = build_diagnosis_prompt(local_prediction, local_confidence)
+                enrich_in_background(PIPELINE_EXECUTOR.submit(timed_llm_diagnosis, prompt, image_url), keys)
+            timings["total"] = elapsed_ms(start)
+            yield result_event(with_meta(local_result, "local", timings, mode="stream", **local_details(local)))
+            return
+
+        # 🟢 STEP 2: Groq LLM Analysis, forwarded field by field
+        try:
+            ticket = admit()
+        except AdmissionRejected as e:
+            yield sse_event("error", {**admission_rejected_body(e), "retry_after": e.retry_after})
+            return
+        prompt = build_diagnosis_prompt(local_prediction, local_confidence)
+        parser = ProgressiveObjectParser()
+        stage = time.perf_counter()
+        with ticket:
+            try:
+                deltas = stream_llm_diagnosis(prompt, image_url)
+                first = next(deltas, "")
+            except LLMUnavailableError as e:
+                result = local_fallback(local_prediction, local_confidence, timings, e)
+                result["meta"]["mode"] = "stream"
+                timings["total"] = elapsed_ms(start)
+                yield result_event(result)
+                return
+            for delta in itertools.chain([first], deltas):
+                if "llm_first_token" not in timings:
+                    timings["llm_first_token"] = elapsed_ms(stage)
+                for key, value in parser.feed(delta):
+                    if key == "additional_notes":
+                        value = flatten_notes(value)
+                    yield sse_event("field", {"field": key, "value": value})
+        timings["llm"] = elapsed_ms(stage)
+        log.debug("Raw API response: %.500s", parser.text)
+
+        stage = time.perf_counter()
+        result = parse_diagnosis_response(parser.text)
+        timings["parse"] = elapsed_ms(stage)
+        store_diagnosis(keys, result)
+
+        timings["total"] = elapsed_ms(start)
+        yield result_event(with_meta(
+            result, "llm", timings,
+            mode="stream",
+            hint_included=bool(local_prediction),
+            upload_bytes=len(upload.raw),
+            llm_image_bytes=sent_bytes
+        ))
+
+    except Exception as e:
+        # Headers are already sent, so the failure travels as an event
+        log.exception("Streaming diagnosis error: %s", e)
+        yield sse_event("error", {"error": str(e), "message": "Failed to analyze image"})
+
+def stream_local_diagnosis(upload, fallback=None):
+    """SSE for an offline diagnosis: a single `result` event"""
+    try:
+        result = diagnose_local(upload, fallback)
+        result["meta"]["mode"] = "stream"
+        yield result_event(result)
+    except Exception as e:
+        log.exception("Streaming diagnosis error: %s", e)
+        yield sse_event("error", {"error": str(e), "message": "Failed to analyze image"})
+
+def decode_batch_file(named_file):
+    """(filename, DecodedUpload or the InvalidImageError raised decoding it)"""
+    filename, data = named_file
+    try:
+        return filename, timed_decode(data)
+    except InvalidImageError as e:
+        return filename, e
+
+def diagnose_batch_item(upload, local, keys):
+    """One hybrid diagnosis of a batch, from its precomputed local prediction"""
+    start = time.perf_counter()
+    result = run_diagnosis(upload, keys, local=local)
+    store_diagnosis(keys, result)
+    result["meta"]["timings_ms"]["total"] = elapsed_ms(start)
+    return result
+
+def batch_error(e):
+    """Per-item error entry, with the status the item would have had on /diagnose"""
+    if isinstance(e, InvalidImageError):
+        return {"error": "Invalid image file", "status": 400}
+    if isinstance(e, LLMUnavailableError):
+        return {"error": str(e), "message": "AI service is temporarily unavailable. Please try again shortly.", "status": 503}
+    return {"error": str(e), "message": "Failed to analyze image", "status": 500}
+
+def iter_batch_diagnoses(items, mode="hybrid", fallback=None):
+    """Yield one entry per (filename, upload) item, in input order.
+
+    An upload may be the InvalidImageError from decoding it. Cache hits are
+    answered first; every other image goes to the local model in one
+    predict_many call. In hybrid mode the Groq calls then run on
+    BATCH_EXECUTOR, and each entry is yielded as soon as it and every entry
+    before it are done.
+    """
+    cached, keys, pending = {}, {}, []
+    for i, (_, upload) in enumerate(items):
+        if isinstance(upload, Exception):
+            continue
+        if mode == "hybrid":
+            start = time.perf_counter()
+            hit, keys[i] = lookup_cached_diagnosis(upload)
+            if hit is not None:
+                hit["meta"]["timings_ms"] = {"cache_lookup": elapsed_ms(start), "total": elapsed_ms(start)}
+                cached[i] = hit
+                continue
+        pending.append(i)
+
+    # 🟢 STEP 1: Local Model Prediction for the whole batch at once
+    start = time.perf_counter()
+    predictions = predict_many_local([items[i][1] for i in pending])
+    local_ms = elapsed_ms(start)
+    local = {i: prediction.timed(local_ms) for i, prediction in zip(pending, predictions)}
+
+    # 🟢 STEP 2: Groq LLM Analysis, bounded fan-out
+    futures = {}
+    if mode == "hybrid":
+        for i in pending:
+            futures[i] = BATCH_EXECUTOR.submit(diagnose_batch_item, items[i][1], local[i], keys[i])
+
+    for i, (filename, upload) in enumerate(items):
+        entry = {"index": i, "filename": filename}
+        try:
+            if isinstance(upload, Exception):
+                raise upload
+            if i in cached:
+                result = cached[i]
+            elif mode == "local":
+                if local[i][0] is None:
+                    raise RuntimeError("Local model returned no prediction")
+                result = diagnose_local(upload, fallback, local=local[i])
+            else:
+                result = futures[i].result()
+            entry.update(ok=True, result=record_diagnosis(result))
+        except Exception as e:
+            log.warning("Batch diagnosis error: %s", e, extra={"upload_filename": filename})
+            entry.update(ok=False, **batch_error(e))
+        yield entry
+
+def run_diagnosis_job(payload, params):
+    """Job handler: what /diagnose does, for an upload taken off the queue"""
+    try:
+        upload = timed_decode(payload)
+    except InvalidImageError as e:
+        raise InvalidImageError("Invalid image file") from e
+    if params.get("mode") == "local":
+        return record_diagnosis(diagnose_local(upload, params.get("fallback")))
+    return record_diagnosis(analyze_crop_disease(upload))
+
+def webhook_url_error(url):
+    """Why the server will not POST to `url` (resolves its host), or None"""
+    try:
+        webhook_address(url, JOBS_WEBHOOK_ALLOWED_HOSTS)
+    except WebhookNotAllowed as e:
+        return str(e)
+    return None
+
+def observe_stage(stage, ms):
+    if METRICS_ENABLED:
+        DIAGNOSIS_STAGE_LATENCY.observe(ms / 1000, stage=stage)
+
+def record_diagnosis(result):
+    """Count a finished diagnosis and observe its stage timings; returns result"""
+    meta = result.get("meta", {})
+    if meta.get("mode") != "local" and "fallback" not in meta and meta.get("source") in LOCAL_ROUTING_STATS:
+        LOCAL_ROUTING_STATS[meta["source"]] += 1
+    if not METRICS_ENABLED:
+        return result
+    DIAGNOSES.inc(source=meta.get("source", "unknown"), fallback=meta.get("fallback", "none"))
+    for stage, ms in meta.get("timings_ms", {}).items():
+        DIAGNOSIS_STAGE_LATENCY.observe(ms / 1000, stage=stage)
+    return result
+
+def with_meta(result, source, timings, **extra):
+    """Attach response metadata (where the answer came from, per-stage timings)"""
+    result["meta"] = {"source": source, "mode": PIPELINE_MODE, "timings_ms": timings, **extra}
+    return result
+
+def admission_client(headers, remote_addr):
+    return client_identity(headers, remote_addr, ADMISSION_TRUST_PROXY)
+
+def no_admission():
+    return Ticket(None, False)
+
+def request_admission(mode="hybrid", cost=1, slot=True):
+    """admit() for this request: a callable returning its admission ticket.
+
+    The diagnosis pipeline calls it only when it is about to call Groq, so
+    cache hits and local answers spend no tokens. Offline requests, and
+    every request when admission control is off, get a ticket that holds
+    nothing.
+    """
+    if ADMISSION is None or mode == "local":
+        return no_admission
+    client = admission_client(request.headers, request.remote_addr)
+    return lambda: ADMISSION.admit(client, cost, slot)
+
+def admit_request(mode="hybrid", cost=1, slot=True):
+    """Admission ticket for this request, taken now; raises AdmissionRejected"""
+    return request_admission(mode, cost, slot)()
+
+def admission_rejected_body(e):
+    return {"error": str(e), "reason": e.reason, "message": "Too many requests. Please retry later."}
+
+def admission_rejected(e):
+    response = jsonify(admission_rejected_body(e))
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
 @app.route("/diagnose", methods=["POST"])
 def diagnose_crop():
     """Endpoint to diagnose crop disease from uploaded image"""
-    if not AI_READY:
-        return jsonify({
-            "error": "AI Engine is not ready. Please check GROQ_API_KEY configuration."
-        }), 503
+    mode, fallback, error = select_diagnosis_mode(request.args.get("mode") or request.form.get("mode"))
+    if error:
+        status, message = error
+        return jsonify({"error": message}), status
     
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
@@ -347,44 +1297,413 @@ def diagnose_crop():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
+    # Admission is only taken if the diagnosis reaches Groq
+    admit = request_admission(mode)
+    
     try:
         # Read image data
         image_data = file.read()
         
-        # Validate it's a valid image
+        # Validate and decode once; every later stage shares the result
         try:
-            img = Image.open(io.BytesIO(image_data))
-            img.verify()  # Verify it's actually an image
-        except Exception:
+            upload = timed_decode(image_data)
+        except InvalidImageError:
             return jsonify({"error": "Invalid image file"}), 400
         
-        # 🟢 CALL HYBRID ANALYSIS (Local Classification + LLM Verification)
-        # Note: We pass raw binary data because analyze_crop_disease needs it 
-        # for BOTH the local model and for Groq encoding.
-        result = analyze_crop_disease(image_data)
+        if mode == "local":
+            # 🟢 OFFLINE: Local Classification + knowledge table
+            result = diagnose_local(upload, fallback)
+        else:
+            # 🟢 CALL HYBRID ANALYSIS (Local Classification + LLM Verification)
+            result = analyze_crop_disease(upload, admit)
         
-        return jsonify(result), 200
+        return jsonify(record_diagnosis(result)), 200
         
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    except LLMUnavailableError as e:
+        # Groq is down and there is no local model to fall back on
+        log.warning("Diagnosis error: %s", e)
+        return jsonify({
+            "error": str(e),
+            "message": "AI service is temporarily unavailable. Please try again shortly."
+        }), 503
     except Exception as e:
-        print(f"Diagnosis Error: {e}")
-        traceback.print_exc()
+        log.exception("Diagnosis error: %s", e)
         return jsonify({
             "error": str(e),
             "message": "Failed to analyze image"
         }), 500
 
+@app.route("/diagnose/stream", methods=["POST"])
+def diagnose_crop_stream():
+    """Same as /diagnose, but streams the diagnosis as Server-Sent Events"""
+    mode, fallback, error = select_diagnosis_mode(request.args.get("mode") or request.form.get("mode"))
+    if error:
+        status, message = error
+        return jsonify({"error": message}), status
+    
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    try:
+        upload = timed_decode(file.read())
+    except InvalidImageError:
+        return jsonify({"error": "Invalid image file"}), 400
+    
+    # Admission is only taken (and held while Groq streams) if the diagnosis reaches Groq
+    return Response(
+        stream_local_diagnosis(upload, fallback) if mode == "local" else stream_diagnosis(upload, request_admission(mode)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/diagnose/batch", methods=["POST"])
+def diagnose_crop_batch():
+    """Diagnose many images in one request (multipart field `files`, repeated).
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    """Health check endpoint"""
+    Answers with every result at once, or one JSON line per image as it
+    completes with ?format=ndjson (or Accept: application/x-ndjson). Results
+    are in upload order; a failed image gets an error entry instead of
+    failing the batch.
+    """
+    mode, fallback, error = select_diagnosis_mode(request.args.get("mode") or request.form.get("mode"))
+    if error:
+        status, message = error
+        return jsonify({"error": message}), status
+    
+    files = [f for f in request.files.getlist("files") + request.files.getlist("file") if f.filename]
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files: {len(files)} (at most {BATCH_MAX_FILES} per batch)"}), 413
+    
+    # One token per image, one Groq slot for the whole batch
+    try:
+        ticket = admit_request(mode, cost=len(files))
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    
+    start = time.perf_counter()
+    items = list(PIPELINE_EXECUTOR.map(decode_batch_file, [(f.filename, f.read()) for f in files]))
+    entries = iter_batch_diagnoses(items, mode, fallback)
+    
+    if request.args.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", ""):
+        return Response(
+            ticket.hold(json.dumps(entry) + "\n" for entry in entries),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    with ticket:
+        results = list(entries)
+    succeeded = sum(1 for entry in results if entry["ok"])
     return jsonify({
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+        "timings_ms": {"total": elapsed_ms(start)}
+    }), 200
+
+@app.route("/jobs/diagnose", methods=["POST"])
+def submit_diagnosis_job():
+    """Queue a diagnosis and return its job id straight away (202).
+
+    Poll GET /jobs/<id> for the result, or pass a `webhook_url` form field to
+    have the finished job POSTed there.
+    """
+    if JOB_QUEUE is None:
+        return jsonify({"error": "Job queue is disabled (JOBS_ENABLED=0)"}), 503
+    
+    mode, fallback, error = select_diagnosis_mode(request.args.get("mode") or request.form.get("mode"))
+    if error:
+        status, message = error
+        return jsonify({"error": message}), status
+    
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    webhook_url = request.form.get("webhook_url") or None
+    webhook_error = webhook_url and webhook_url_error(webhook_url)
+    if webhook_error:
+        return jsonify({"error": webhook_error}), 400
+    
+    # Job workers are a fixed pool, so a submission only pays its token
+    try:
+        admit_request(mode, slot=False)
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    
+    try:
+        job_id = JOB_QUEUE.submit(file.read(), {"mode": mode, "fallback": fallback}, webhook_url)
+    except JobQueueFullError as e:
+        response = jsonify({"error": str(e), "message": "Too many queued diagnoses. Please retry later."})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    
+    status_url = f"/jobs/{job_id}"
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_diagnosis_job(job_id):
+    """Status of a queued diagnosis, with the result once it has succeeded"""
+    if JOB_QUEUE is None:
+        return jsonify({"error": "Job queue is disabled (JOBS_ENABLED=0)"}), 503
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        g.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("metrics_start")
+    if start is not None:
+        endpoint = request.endpoint or "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    if g.pop("metrics_start", None) is not None:
+        HTTP_IN_FLIGHT.dec()
+
+def collect_component_metrics():
+    """Scrape-time samples from the components that keep their own counters"""
+    yield "local_model_ready", "gauge", "1 once the local model is loaded and warm", [({}, MODEL_LOADED)]
+    yield "llm_ready", "gauge", "1 when the Groq client is configured", [({}, AI_READY)]
+
+    # Near-duplicate hits are counted as diagnoses_total{source="near_duplicate"}
+    if DIAGNOSIS_CACHE is not None:
+        cache = DIAGNOSIS_CACHE.stats()
+        yield "diagnosis_cache_hits_total", "counter", "Exact-image cache hits", [({}, cache["hits"])]
+        yield "diagnosis_cache_misses_total", "counter", "Exact-image cache misses", [({}, cache["misses"])]
+        yield "diagnosis_cache_entries", "gauge", "Diagnoses held in memory", [({}, cache["entries"])]
+    if RECOMMENDATION_CACHE is not None:
+        cache = RECOMMENDATION_CACHE.stats()
+        yield "recommendation_cache_hits_total", "counter", "Crop recommendation cache hits", [({}, cache["hits"])]
+        yield "recommendation_cache_misses_total", "counter", "Crop recommendation cache misses", [({}, cache["misses"])]
+        yield "recommendation_cache_entries", "gauge", "Crop recommendations held in memory", [({}, cache["entries"])]
+    if NEAR_DUPLICATE_INDEX is not None:
+        yield "near_duplicate_index_entries", "gauge", "Perceptual hashes in the near-duplicate index", [
+            ({}, NEAR_DUPLICATE_INDEX.stats()["entries"])
+        ]
+
+    if LEAF_CROPPER is not None:
+        yield "leaf_crop_images_total", "counter", "Decoded uploads by crop-to-leaf outcome", [
+            ({"outcome": outcome}, LEAF_CROPPER.outcomes[outcome]) for outcome in ("cropped", "full_frame", "no_leaf")
+        ]
+
+    models = MODEL_REGISTRY.models()
+    batchers = [({"model": model_id}, model.batcher.stats()) for model_id, model in sorted(models.items())]
+    yield "local_batches_total", "counter", "Forward passes run by each model's micro-batcher", [
+        (labels, batcher["batches_run"]) for labels, batcher in batchers
+    ]
+    yield "local_batch_items_total", "counter", "Images classified by each model's micro-batcher", [
+        (labels, batcher["items_run"]) for labels, batcher in batchers
+    ]
+    yield "local_batch_queue_depth", "gauge", "Images waiting for a forward pass", [
+        (labels, batcher["queued"]) for labels, batcher in batchers
+    ]
+    yield "local_model_in_flight", "gauge", "Requests holding a lease on each loaded model version", [
+        ({"model": model_id}, model.in_flight) for model_id, model in sorted(models.items())
+    ]
+    yield "local_model_route_weight", "gauge", "Share of local predictions routed to each model version", [
+        ({"model": model_id}, weight) for model_id, weight in MODEL_ROUTER.routes.items()
+    ]
+    router = MODEL_ROUTER.stats()
+    yield "local_model_predictions_total", "counter", "Local predictions served by each model version", [
+        ({"model": model_id}, count) for model_id, count in router["served"].items()
+    ]
+    yield "local_model_shadow_compared_total", "counter", "Shadow predictions compared with the served model's", [
+        ({"served": pair["served"], "shadow": pair["shadow"]}, pair["compared"]) for pair in router["agreement"]
+    ]
+    yield "local_model_shadow_agreed_total", "counter", "Shadow predictions with the same top class as the served model's", [
+        ({"served": pair["served"], "shadow": pair["shadow"]}, pair["agreed"]) for pair in router["agreement"]
+    ]
+    yield "local_model_swaps_total", "counter", "Model registry loads, reloads, unloads and failed loads", [
+        ({"event": event}, count) for event, count in MODEL_REGISTRY.events.items()
+    ]
+
+    yield "hybrid_diagnoses_routed_total", "counter", "Hybrid diagnoses answered by the local fast path or by Groq", [
+        ({"route": route}, count) for route, count in LOCAL_ROUTING_STATS.items()
+    ]
+    if LOCAL_TTA is not None:
+        tta = LOCAL_TTA.stats()
+        yield "local_tta_requests_total", "counter", "Local predictions by number of TTA views", [
+            ({"views": str(views)}, count) for views, count in tta["views_used"].items()
+        ]
+        yield "local_tta_class_changed_total", "counter", "Augmented predictions whose top class changed", [
+            ({}, tta["class_changed"])
+        ]
+
+    if LLM_GATEWAY is not None:
+        gateway = LLM_GATEWAY.stats()
+        counters = ("calls", "attempts", "retries", "failures", "short_circuited", "retries_exhausted", "deadline_exceeded")
+        yield "llm_gateway_events_total", "counter", "Groq gateway calls, attempts, retries and failures", [
+            ({"event": name}, gateway[name]) for name in counters
+        ]
+        yield "llm_gateway_in_flight", "gauge", "Groq requests holding a pooled connection", [
+            ({"pool": name}, pool["in_flight"]) for name, pool in gateway["pools"].items()
+        ]
+        yield "llm_breaker_open", "gauge", "1 while the Groq circuit breaker is not closed", [
+            ({}, gateway["breaker"]["state"] != "closed")
+        ]
+
+    if JOB_QUEUE is not None:
+        jobs = JOB_QUEUE.stats()
+        yield "diagnosis_jobs", "gauge", "Diagnosis jobs by status", [
+            ({"status": status}, jobs[status]) for status in ("queued", "running", "succeeded", "failed")
+        ]
+        yield "diagnosis_jobs_rejected_total", "counter", "Job submissions refused with 429", [({}, jobs["rejected"])]
+
+    if ADMISSION is not None:
+        admission = ADMISSION.stats()
+        yield "admission_decisions_total", "counter", "Admission decisions for Groq-bound requests", [
+            ({"decision": name}, admission[name])
+            for name in ("admitted", "queued", "rate_limited", "queue_full", "queue_timeout")
+        ]
+        yield "admission_slots_in_use", "gauge", "Requests holding a Groq slot", [({}, admission["in_use"])]
+        yield "admission_queue_depth", "gauge", "Requests waiting for a Groq slot", [({}, admission["waiting"])]
+        yield "admission_queue_wait_seconds_total", "counter", "Time spent waiting for a Groq slot", [
+            ({}, admission["total_wait_seconds"])
+        ]
+
+    memory = process_memory()
+    if memory is not None:
+        yield "process_memory_bytes", "gauge", "Memory of this process (pss/private split shared pages)", [
+            ({"kind": kind}, value) for kind, value in memory.items() if value is not None
+        ]
+
+METRICS.add_collector(collect_component_metrics)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+def llm_skip_rate():
+    """Share of routed hybrid diagnoses the local fast path answered without Groq"""
+    routed = sum(LOCAL_ROUTING_STATS.values())
+    return round(LOCAL_ROUTING_STATS["local"] / routed, 4) if routed else None
+
+def local_models_status():
+    """Loaded model versions, their manifests and usage, and the router's split and agreement"""
+    return {**MODEL_REGISTRY.stats(), "router": MODEL_ROUTER.stats()}
+
+def model_admin_allowed(authorization):
+    """Authorization header check for the model admin endpoints; they are off without MODEL_ADMIN_TOKEN"""
+    return bool(MODEL_ADMIN_TOKEN) and hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {MODEL_ADMIN_TOKEN}".encode()
+    )
+
+def update_model_routes(authorization, payload):
+    """(body, status) for a routes change: written to routes.json, then applied in this process.
+
+    Other server processes pick routes.json up on their next poll. Models
+    the new routes leave out are unloaded once their requests finish.
+    """
+    if not MODEL_REGISTRY_DIR:
+        return {"error": "Model registry is disabled (MODEL_REGISTRY_DIR not set)"}, 404
+    if not model_admin_allowed(authorization):
+        return {"error": "Model admin needs MODEL_ADMIN_TOKEN and a matching bearer token"}, 403
+    if not isinstance(payload, dict):
+        return {"error": "Expected a JSON object of model id -> weight"}, 400
+    try:
+        routes = parse_routes(payload.get("routes", payload))
+    except (TypeError, ValueError) as e:
+        return {"error": f"Invalid routes: {e}"}, 400
+    unknown = sorted(set(routes) - set(MODEL_REGISTRY.discover()))
+    if not routes or unknown:
+        return {"error": "Routes must name models in the registry", "unknown": unknown}, 400
+
+    path = os.path.join(MODEL_REGISTRY_DIR, ROUTES_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(routes, f, indent=2)
+    os.replace(path + ".tmp", path)
+    apply_model_routes(routes)
+    return local_models_status(), 200
+
+@app.route("/models", methods=["GET"])
+def list_local_models():
+    """Loaded local model versions and the traffic split"""
+    return jsonify(local_models_status()), 200
+
+@app.route("/models/routes", methods=["PUT"])
+def put_model_routes():
+    """Change the traffic split across model versions (loads and unloads models as needed)"""
+    body, status = update_model_routes(request.headers.get("Authorization"), request.get_json(silent=True))
+    return jsonify(body), status
+
+def llm_payload_stats():
+    """Consistent snapshot of the LLM image byte counters"""
+    with LLM_PAYLOAD_LOCK:
+        stats = dict(LLM_PAYLOAD_STATS)
+    return {**stats, "saved_bytes": stats["upload_bytes"] - stats["sent_bytes"]}
+
+def health_status():
+    """Health payload shared by the Flask and ASGI servers"""
+    return {
         "status": "online",
         "ai_ready": AI_READY,
         "local_model_ready": MODEL_LOADED,
+        "local_model_state": MODEL_STATE,
+        "local_model_load_seconds": MODEL_LOAD_SECONDS,
+        "local_engine": DISEASE_MODEL.name if MODEL_LOADED else None,
         "hybrid_mode": MODEL_LOADED and AI_READY,
+        "local_models": local_models_status(),
+        "local_tta": LOCAL_TTA.stats() if LOCAL_TTA else None,
+        "leaf_crop": LEAF_CROPPER.stats() if LEAF_CROPPER else None,
+        "local_calibration": None if MODEL_REGISTRY_DIR else LOCAL_CALIBRATION.stats(),
+        "local_routing": {**LOCAL_ROUTING_STATS, "llm_skip_rate": llm_skip_rate(), "policy": LOCAL_ROUTING_POLICY.stats()},
+        "diagnosis_cache": DIAGNOSIS_CACHE.stats() if DIAGNOSIS_CACHE is not None else None,
+        "near_duplicate_index": NEAR_DUPLICATE_INDEX.stats() if NEAR_DUPLICATE_INDEX is not None else None,
+        "recommendation_cache": RECOMMENDATION_CACHE.stats() if RECOMMENDATION_CACHE is not None else None,
+        "crop_recommender": CROP_RECOMMENDER.stats() if CROP_RECOMMENDER else {"engine": RECOMMENDATION_ENGINE},
+        "llm_gateway": LLM_GATEWAY.stats() if LLM_GATEWAY else None,
+        "jobs": JOB_QUEUE.stats() if JOB_QUEUE else None,
+        "admission": ADMISSION.stats() if ADMISSION else None,
+        "disease_knowledge": {**DISEASE_KNOWLEDGE.stats(), "missing_classes": _missing_knowledge},
+        "llm_payload": llm_payload_stats(),
         "model": "Hybrid (Local network.h5 + Groq Llama Scout)",
-        "api_configured": GROQ_API_KEY is not None
-    }), 200
+        "api_configured": GROQ_API_KEY is not None,
+        "process": {"pid": os.getpid(), "worker": PREFORK_WORKER, "memory_mb": in_megabytes(process_memory())}
+    }
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    """Health check endpoint"""
+    return jsonify(health_status()), 200
+
+def is_ready():
+    """Ready to take traffic: model loading has settled and Groq is configured"""
+    return MODEL_READY_EVENT.is_set() and AI_READY
+
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    """Readiness probe for load balancers: 200 only once the instance is warm"""
+    return jsonify({"ready": is_ready(), "local_model_state": MODEL_STATE}), (200 if is_ready() else 503)
 
 @app.route("/", methods=["GET"])
 def home():
@@ -395,33 +1714,41 @@ def home():
         "local_engine": "TensorFlow network.h5 (38 Classes)",
         "cloud_engine": "Groq Llama 4 Scout",
         "endpoints": {
-            "/diagnose": "POST - Upload crop leaf image for hybrid analysis",
+            "/diagnose": "POST - Upload crop leaf image for hybrid analysis (?mode=local for offline diagnosis)",
+            "/diagnose/stream": "POST - Same as /diagnose, streamed as Server-Sent Events (local, field, result)",
+            "/diagnose/batch": "POST - Diagnose many images at once (repeated `files` field; ?format=ndjson to stream)",
+            "/jobs/diagnose": "POST - Queue a diagnosis, returns a job id (optional webhook_url)",
+            "/jobs/<id>": "GET - Status and result of a queued diagnosis",
             "/health": "GET - Check API and Model health status",
-            "/api/planner/recommend_satellite": "POST - Get AI-powered crop recommendations"
+            "/metrics": "GET - Prometheus metrics",
+            "/health/ready": "GET - Readiness probe (503 until the local model is warm)",
+            "/models": "GET - Loaded local model versions and the A/B traffic split",
+            "/models/routes": "PUT - Change the traffic split ({\"model id\": weight}; needs MODEL_ADMIN_TOKEN)",
+            "/api/planner/recommend_satellite": "POST - Get crop recommendations (\"narrative\": true for AI-written reasons)"
         }
     }), 200
 
 
-@app.route("/api/planner/recommend_satellite", methods=["POST", "OPTIONS"])
-def recommend_satellite():
-    """Endpoint for satellite-based crop recommendations using Groq AI"""
-    
-    # Handle CORS preflight request
-    if request.method == "OPTIONS":
-        return jsonify({"status": "ok"}), 200
-    
-    try:
-        data = request.get_json()
-        
-        # Extract data from request
-        coords = data.get('coords', [11.0168, 76.9558, 11.0268, 76.9658])
-        soil_type = data.get('soil_type', 'Red Loam')
-        temperature = data.get('temperature', 28)
-        humidity = data.get('humidity', 65)
-        rainfall = data.get('rainfall', 120)
-        
-        # Use Groq AI to generate intelligent recommendations
-        prompt = f"""You are an agricultural expert system. Based on the following field data, recommend the top 3 best crops to plant.
+def parse_field_request(data):
+    """Field conditions from a SmartPlanner request body, with defaults"""
+    data = data or {}
+    return {
+        "coords": data.get('coords', [11.0168, 76.9558, 11.0268, 76.9658]),
+        "soil_type": data.get('soil_type', 'Red Loam'),
+        "temperature": data.get('temperature', 28),
+        "humidity": data.get('humidity', 65),
+        "rainfall": data.get('rainfall', 120)
+    }
+
+def build_recommendation_request(field):
+    """Keyword arguments for the crop recommendation completion"""
+    coords = field['coords']
+    soil_type = field['soil_type']
+    temperature = field['temperature']
+    humidity = field['humidity']
+    rainfall = field['rainfall']
+
+    prompt = f"""You are an agricultural expert system. Based on the following field data, recommend the top 3 best crops to plant.
 
 Field Data:
 - Location GPS: {coords}
@@ -449,40 +1776,193 @@ Return ONLY a JSON object with this structure:
     ]
 }}"""
 
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            temperature=0.3,
-            max_tokens=800
-        )
+    return dict(
+        messages=[{"role": "user", "content": prompt}],
+        model="meta-llama/llama-4-scout-17b-16e-instruct",
+        temperature=0.3,
+        max_tokens=800
+    )
+
+def parse_recommendation_response(response_text):
+    """Parse the recommendation JSON from the model's reply"""
+    result = extract_json_object(response_text, ("recommendations",))
+    if METRICS_ENABLED:
+        LLM_JSON_PARSES.inc(response="recommendation", outcome=json_parse_outcome(response_text, result))
+    if result is None:
+        raise ValueError("No recommendation JSON found in AI response")
+    return result
+
+def recommendation_cache_key(field):
+    """(cache key, field to ask the LLM about); the key is None when caching is off or the field cannot be quantized"""
+    if RECOMMENDATION_CACHE is None:
+        return None, field
+    try:
+        return RECOMMENDATION_QUANTIZER.quantize(field)
+    except ValueError:
+        return None, field
+
+def lookup_recommendation(field):
+    """(cached response or None, cache key, field to ask the LLM about)"""
+    start = time.perf_counter()
+    key, representative = recommendation_cache_key(field)
+    if key is None:
+        return None, key, representative
+    cached = RECOMMENDATION_CACHE.get(key)
+    if cached is None:
+        return None, key, representative
+    timings = {"cache_lookup": elapsed_ms(start), "total": elapsed_ms(start)}
+    return finish_recommendation(cached, field, "cache", timings, key), key, representative
+
+def store_recommendation(key, result):
+    if key is not None:
+        RECOMMENDATION_CACHE.set(key, result)
+
+def fetch_recommendation(key, representative):
+    """Ask Groq for a recommendation and cache it under key"""
+    chat_completion = LLM_GATEWAY.chat(**build_recommendation_request(representative))
+    result = parse_recommendation_response(chat_completion.choices[0].message.content)
+    store_recommendation(key, result)
+    return result
+
+def finish_recommendation(result, field, source, timings, key, **extra):
+    """Attach the request's own location and the response metadata"""
+    # Add location metadata back
+    result['location'] = {
+        "coords": field['coords'],
+        "temperature": field['temperature'],
+        "humidity": field['humidity'],
+        "rainfall": field['rainfall']
+    }
+    result["meta"] = {"source": source, "cache_key": key, "timings_ms": timings, **extra}
+    return result
+
+def recommend_local(field):
+    """In-process ranking; raises ValueError for unusable coords or climate values"""
+    try:
+        lat, lon = bbox_center(field["coords"])
+        return CROP_RECOMMENDER.recommend(field, lat, lon)
+    except (TypeError, KeyError) as e:
+        raise ValueError(f"Invalid field data: {e}") from e
+
+def wants_narrative(data):
+    return request.args.get("narrative") == "1" or (isinstance(data, dict) and data.get("narrative") is True)
+
+def build_narrative_request(field, result):
+    """Keyword arguments for the completion that rewrites the ranked crops' reasons"""
+    soil = result["soil_data"]
+    crops = "\n".join(f"- {entry['crop']} (suitability {entry['suitability']}): {entry['reason']}"
+                      for entry in result["recommendations"])
+    prompt = f"""You are an agricultural advisor. These crops were ranked for a field by an agronomic model:
+
+{crops}
+
+Field: soil {field['soil_type']} (pH {soil['ph']}, N {soil['n']} g/kg, P {soil['p']} mg/kg, K {soil['k']} mg/kg), avg temperature {field['temperature']}°C, humidity {field['humidity']}%, rainfall {field['rainfall']}mm/month.
+
+For each crop write 2-3 sentences for the farmer explaining why it suits this field and what to watch out for. Do not change the crops or their order.
+
+Return ONLY a JSON object: {{"reasons": {{"<crop name>": "<text>"}}}}"""
+    return dict(
+        messages=[{"role": "user", "content": prompt}],
+        model="meta-llama/llama-4-scout-17b-16e-instruct",
+        temperature=0.3,
+        max_tokens=600
+    )
+
+def parse_narrative_response(response_text):
+    """{crop: reason} from the narrative reply"""
+    result = extract_json_object(response_text, ("reasons",))
+    if METRICS_ENABLED:
+        LLM_JSON_PARSES.inc(response="narrative", outcome=json_parse_outcome(response_text, result))
+    if result is None or not isinstance(result.get("reasons"), dict):
+        raise ValueError("No narrative JSON found in AI response")
+    return result["reasons"]
+
+def apply_narrative(result, reasons):
+    for entry in result["recommendations"]:
+        text = reasons.get(entry["crop"])
+        if isinstance(text, str) and text.strip():
+            entry["reason"] = text.strip()
+
+def lookup_narrative(field, result):
+    """(cache key, True when a cached narrative was applied)"""
+    key, _ = recommendation_cache_key(field)
+    if key is None:
+        return None, False
+    key = "narrative|" + key + "|" + ",".join(entry["crop"] for entry in result["recommendations"])
+    reasons = RECOMMENDATION_CACHE.get(key)
+    if reasons is None:
+        return key, False
+    apply_narrative(result, reasons)
+    return key, True
+
+def narrate_recommendation(field, result):
+    """Let Groq rewrite the reasons; returns the narrative's source, or why it was skipped"""
+    key, hit = lookup_narrative(field, result)
+    if hit:
+        return "cache"
+    if not AI_READY:
+        return "unavailable"
+    try:
+        with admit_request():
+            chat_completion = LLM_GATEWAY.chat(**build_narrative_request(field, result))
+        reasons = parse_narrative_response(chat_completion.choices[0].message.content)
+    except AdmissionRejected:
+        return "rate_limited"
+    except (LLMUnavailableError, ValueError) as e:
+        log.warning("Recommendation narrative failed: %s", e)
+        return "failed"
+    apply_narrative(result, reasons)
+    store_recommendation(key, reasons)
+    return "llm"
+
+@app.route("/api/planner/recommend_satellite", methods=["POST", "OPTIONS"])
+def recommend_satellite():
+    """Endpoint for satellite-based crop recommendations using Groq AI"""
+    
+    # Handle CORS preflight request
+    if request.method == "OPTIONS":
+        return jsonify({"status": "ok"}), 200
+    
+    try:
+        start = time.perf_counter()
+        data = request.get_json()
+        field = parse_field_request(data)
         
-        response_text = chat_completion.choices[0].message.content
+        if RECOMMENDATION_ENGINE == "local":
+            # 🟢 In-process ranking; Groq only writes the narrative, on request
+            try:
+                result = recommend_local(field)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            timings = {"local_recommendation": elapsed_ms(start)}
+            narrative = narrate_recommendation(field, result) if wants_narrative(data) else "not_requested"
+            timings["total"] = elapsed_ms(start)
+            return jsonify(finish_recommendation(result, field, "local", timings, None, narrative=narrative)), 200
         
-        # Clean response if it contains thinking tags or markdown
-        if "<thinking>" in response_text:
-            response_text = re.sub(r'<thinking>.*?</thinking>', '', response_text, flags=re.DOTALL).strip()
+        # Neighbouring fields share a cached answer; hits skip admission too
+        cached, key, representative = lookup_recommendation(field)
+        if cached is not None:
+            return jsonify(cached), 200
         
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-
-        # Parse JSON
-        result = json.loads(response_text)
+        try:
+            ticket = admit_request()
+        except AdmissionRejected as e:
+            return admission_rejected(e)
         
-        # Add location metadata back
-        result['location'] = {
-            "coords": coords,
-            "temperature": temperature,
-            "humidity": humidity,
-            "rainfall": rainfall
-        }
+        # Use Groq AI to generate intelligent recommendations
+        with ticket:
+            result = fetch_recommendation(key, representative)
         
-        return jsonify(result), 200
+        return jsonify(finish_recommendation(result, field, "llm", {"total": elapsed_ms(start)}, key)), 200
         
+    except LLMUnavailableError as e:
+        log.warning("Recommendation error: %s", e)
+        return jsonify({
+            "error": str(e),
+            "message": "AI service is temporarily unavailable. Please try again shortly."
+        }), 503
     except Exception as e:
-        print(f"Recommendation Error: {e}")
-        traceback.print_exc()
+        log.exception("Recommendation error: %s", e)
         return jsonify({
             "error": str(e),
             "message": "Failed to generate crop recommendations"
@@ -490,6 +1970,44 @@ Return ONLY a JSON object with this structure:
 
 
 
+# --- JOB QUEUE ---
+# Only constructed here: the database and workers are started by the server
+# (start_job_queue), never as a side effect of importing this module
+JOB_QUEUE = JobQueue(
+    JOBS_DB,
+    run_diagnosis_job,
+    workers=JOBS_WORKERS,
+    max_depth=JOBS_MAX_DEPTH,
+    max_attempts=JOBS_MAX_ATTEMPTS,
+    retention_seconds=JOBS_RETENTION_SECONDS,
+    webhook_timeout_seconds=JOBS_WEBHOOK_TIMEOUT_SECONDS,
+    webhook_allowed_hosts=JOBS_WEBHOOK_ALLOWED_HOSTS,
+    retryable=(LLMUnavailableError,),
+    retry_backoff_seconds=JOBS_RETRY_BACKOFF_SECONDS,
+    name="diagnosis-jobs"
+) if JOBS_ENABLED else None
+def start_job_queue():
+    """Start the job workers in this process, picking up jobs that were
+    queued or running when the server last stopped (no-op once started)"""
+    if JOB_QUEUE is not None and not PREFORK_PARENT:
+        JOB_QUEUE.start()
+
+@app.before_request
+def ensure_job_queue():
+    # WSGI servers import the app without running __main__
+    start_job_queue()
+
+def init_worker(index):
+    """Per-process setup for a worker forked by serve.py, before it serves"""
+    global PREFORK_WORKER
+    PREFORK_WORKER = index
+    # Already set when the parent loaded the model before forking
+    if not MODEL_READY_EVENT.is_set():
+        load_local_model()
+    start_registry_watcher()
+    if JOB_QUEUE is not None:
+        JOB_QUEUE.start()
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("🌿 CROP DISEASE DETECTION API")
@@ -498,5 +2016,14 @@ if __name__ == "__main__":
     print(f"Model: Groq Llama Vision")
     print(f"API Configured: {GROQ_API_KEY is not None}")
     print("="*60 + "\n")
+    debug = os.getenv("FLASK_DEBUG", "1") == "1"
+    # Under the debug reloader this process only watches files; the child
+    # it spawns (WERKZEUG_RUN_MAIN=true) serves and runs the jobs
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        start_job_queue()
     
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    app.run(
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        debug=debug
+    )
\ No newline at end of file
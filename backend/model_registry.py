@@ -0,0 +1,453 @@
+"""
+Versioned local classifiers: a registry directory, hot swaps and A/B routing.
+
+Each model lives in its own folder of MODEL_REGISTRY_DIR; the folder name
+is the model id. A manifest.json next to the weights says how to feed it:
+
+    {
+      "name": "plantvillage-mobilenet", "version": "2",
+      "file": "network.tflite",                 (or a .h5; default network.h5)
+      "input_size": [224, 224],                 (height, width)
+      "normalization": {"scale": 0.00392156862745098, "mean": [0, 0, 0], "std": [1, 1, 1]},
+      "classes": ["Apple___Apple_scab", ...],   (or "classes_file": "classes.txt", one per line)
+      "calibration": "calibration.json"         (optional, from calibrate_model.py)
+    }
+
+A model input x becomes (x * scale - mean) / std per channel; the defaults
+are the [0, 1] scaling network.h5 was trained with.
+
+Swaps are atomic. A model is loaded and warmed up off to the side, then
+published by replacing the whole id -> model dict under a lock. Requests
+take a lease on a model, so a replaced or unloaded version keeps serving
+the requests it already has. Its batcher is stopped once the last of them
+is done. Nothing ever sees a half-loaded model.
+
+ABRouter splits traffic by weight. The choice is keyed on the image bytes,
+so the same photo always goes to the same model and the diagnosis cache
+stays consistent. A share of requests (the shadow rate) is also run on
+one other routed model, which measures how often two versions agree
+without changing any answer.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from batching import MicroBatcher
+from calibration import Calibration
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+ROUTES_NAME = "routes.json"
+
+
+class ManifestError(ValueError):
+    """A manifest that is missing, unreadable or inconsistent"""
+
+
+class ModelManifest:
+    """How to load a model and feed it: weights, input size, normalization, class list"""
+
+    def __init__(self, model_id, model_path, class_names, input_size=(224, 224), scale=1 / 255.0,
+                 mean=(0.0, 0.0, 0.0), std=(1.0, 1.0, 1.0), name=None, version=None, calibration_path=None,
+                 watched_paths=()):
+        if not class_names:
+            raise ManifestError(f"{model_id}: no class list")
+        self.model_id = model_id
+        self.model_path = model_path
+        self.class_names = list(class_names)
+        self.input_size = tuple(int(v) for v in input_size)
+        self.name = name or model_id
+        self.version = version
+        self.calibration_path = calibration_path
+        self.watched_paths = tuple(watched_paths) or (model_path,)
+        # (x * scale - mean) / std == x * gain + offset, per channel
+        std = np.asarray(std, dtype=np.float32)
+        self.normalization = {"scale": float(scale), "mean": [float(v) for v in mean], "std": std.tolist()}
+        self._gain = (np.float32(scale) / std).astype(np.float32)
+        self._offset = (-np.asarray(mean, dtype=np.float32) / std).astype(np.float32)
+        self._offset_is_zero = not self._offset.any()
+
+    @classmethod
+    def read(cls, directory):
+        """Manifest of the model in `directory`; paths in it are relative to the folder"""
+        model_id = os.path.basename(os.path.normpath(directory))
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ManifestError(f"{model_id}: cannot read {MANIFEST_NAME} ({e})") from e
+
+        classes = data.get("classes")
+        if classes is None and data.get("classes_file"):
+            with open(os.path.join(directory, data["classes_file"])) as f:
+                classes = [line.strip() for line in f if line.strip()]
+        input_size = data.get("input_size", [224, 224])
+        if isinstance(input_size, int):
+            input_size = [input_size, input_size]
+        normalization = data.get("normalization", {})
+        calibration = os.path.join(directory, data.get("calibration", "calibration.json"))
+        model_path = os.path.join(directory, data.get("file", "network.h5"))
+        return cls(
+            model_id, model_path, classes,
+            input_size=input_size[:2],
+            scale=normalization.get("scale", 1 / 255.0),
+            mean=normalization.get("mean", (0.0, 0.0, 0.0)),
+            std=normalization.get("std", (1.0, 1.0, 1.0)),
+            name=data.get("name"),
+            version=None if data.get("version") is None else str(data["version"]),
+            calibration_path=calibration,
+            watched_paths=(manifest_path, model_path, calibration)
+        )
+
+    def fingerprint(self):
+        """Modification times of the files the model is built from; a change means a reload"""
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in self.watched_paths)
+
+    def normalize_into(self, items, out):
+        """Normalize uint8 model inputs into a preallocated float32 buffer; returns the batch view"""
+        batch = out[:len(items)]
+        for i, item in enumerate(items):
+            np.multiply(item, self._gain, out=batch[i])
+            if not self._offset_is_zero:
+                batch[i] += self._offset
+        return batch
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "file": os.path.basename(self.model_path),
+            "input_size": list(self.input_size),
+            "normalization": self.normalization,
+            "classes": len(self.class_names),
+        }
+
+
+class LoadedModel:
+    """One warm model version: engine, its own micro-batcher and calibration, with a lease count"""
+
+    def __init__(self, manifest, engine, calibration, max_batch_size=16, max_wait_ms=5.0, load_seconds=None):
+        self.manifest = manifest
+        self.model_id = manifest.model_id
+        self.engine = engine
+        self.calibration = calibration
+        self.fingerprint = manifest.fingerprint()
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        # Reused by the batcher's worker thread for every batch
+        self._buffer = np.empty((max(1, int(max_batch_size)), *manifest.input_size, 3), dtype=np.float32)
+        self.batcher = MicroBatcher(
+            engine.predict,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name=f"local-batcher-{self.model_id}",
+            collate=lambda items: manifest.normalize_into(items, self._buffer)
+        )
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.retired = False
+        self.requests = 0
+        self.images = 0
+        self.seconds = 0.0
+
+    def warm_up(self, batch_sizes):
+        """Trigger graph tracing / tensor allocation for the batch sizes the batcher will use"""
+        for batch_size in sorted(set(batch_sizes)):
+            self.engine.predict(np.zeros((batch_size, *self.manifest.input_size, 3), dtype=np.float32))
+
+    def classify(self, uploads, tta=None):
+        """Calibrated LocalPrediction per upload, tagged with this model's id"""
+        start = time.perf_counter()
+        height, width = self.manifest.input_size
+        size = (width, height)  # PIL order
+        inputs = [upload.model_input(size) for upload in uploads]
+        rows = self.batcher.predict_many(inputs)
+        if tta is not None:
+            zoomed = [lambda upload=upload: upload.model_input(tta.zoomed_size(size)) for upload in uploads]
+            rows = tta.refine_many(rows, inputs, zoomed, self.batcher.predict_many, self.calibration.apply)
+        predictions = self.calibration.predictions(rows, self.manifest.class_names, model=self.model_id)
+        with self._lock:
+            self.requests += 1
+            self.images += len(uploads)
+            self.seconds += time.perf_counter() - start
+        return predictions
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            idle = self.retired and self.in_flight == 0
+        if idle:
+            self.batcher.close()
+
+    def retire(self):
+        """No new leases will come; stop the batcher once the current ones are done"""
+        with self._lock:
+            self.retired = True
+            idle = self.in_flight == 0
+        if idle:
+            self.batcher.close()
+
+    def stats(self):
+        with self._lock:
+            requests, seconds = self.requests, self.seconds
+            usage = {"requests": requests, "images": self.images, "in_flight": self.in_flight}
+        return {
+            **self.manifest.describe(),
+            "engine": getattr(self.engine, "name", None),
+            "load_seconds": self.load_seconds,
+            "loaded_at": round(self.loaded_at, 3),
+            **usage,
+            "avg_ms": round(seconds / requests * 1000, 3) if requests else None,
+            "batching": self.batcher.stats(),
+            "calibration": self.calibration.stats(),
+        }
+
+
+class ModelRegistry:
+    """The loaded model versions, published as one immutable dict so swaps are atomic.
+
+    load_engine(path) builds an engine (see inference_engine.load_engine).
+    Loads and unloads are serialised; requests are never blocked by them.
+    """
+
+    def __init__(self, root, load_engine, max_batch_size=16, max_wait_ms=5.0, top_k=3, warm_batch_sizes=(1,)):
+        self.root = root
+        self._load_engine = load_engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.top_k = top_k
+        self.warm_batch_sizes = tuple(warm_batch_sizes)
+        self._lock = threading.Lock()  # guards the _models reference and leases
+        self._swap_lock = threading.Lock()  # one load or unload at a time
+        self._models = {}  # model id -> LoadedModel; replaced, never changed in place
+        self.events = {"loaded": 0, "reloaded": 0, "unloaded": 0, "failed": 0}
+        self.errors = {}  # model id -> last load error
+
+    def discover(self):
+        """Ids of the model folders under the registry directory that have a manifest"""
+        if not self.root or not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, MANIFEST_NAME))
+        )
+
+    def manifest(self, model_id):
+        return ModelManifest.read(os.path.join(self.root, model_id))
+
+    def models(self):
+        """Snapshot of the loaded models (id -> LoadedModel)"""
+        return self._models
+
+    def load(self, manifest, force=True, on_warm_up=None):
+        """Build, warm and publish a model, replacing the version with the same id.
+
+        With force=False a loaded version built from the same files is kept.
+        on_warm_up() is called once the engine is built, before warming it.
+        """
+        with self._swap_lock:
+            current = self._models.get(manifest.model_id)
+            if not force and current is not None and current.fingerprint == manifest.fingerprint():
+                return current
+            start = time.perf_counter()
+            try:
+                engine = self._load_engine(manifest.model_path)
+                calibration = Calibration.load(manifest.calibration_path, top_k=self.top_k)
+                model = self._build(manifest, engine, calibration, start)
+                if on_warm_up is not None:
+                    on_warm_up()
+                model.warm_up({1, *self.warm_batch_sizes})
+            except Exception as e:
+                self.events["failed"] += 1
+                self.errors[manifest.model_id] = str(e)
+                raise
+            model.load_seconds = round(time.perf_counter() - start, 3)
+            self._publish(manifest.model_id, model)
+            return model
+
+    def install(self, manifest, engine, calibration=None):
+        """Publish an engine that is already loaded (the legacy network.h5, a benchmark's stand-in)"""
+        with self._swap_lock:
+            model = self._build(manifest, engine, calibration or Calibration(top_k=self.top_k), time.perf_counter())
+            self._publish(manifest.model_id, model)
+            return model
+
+    def unload(self, model_id):
+        """Stop routing to a model; it finishes the requests it has. False if it was not loaded."""
+        with self._swap_lock:
+            return self._publish(model_id, None) is not None
+
+    def _build(self, manifest, engine, calibration, start):
+        return LoadedModel(
+            manifest, engine, calibration,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait_ms,
+            load_seconds=round(time.perf_counter() - start, 3)
+        )
+
+    def _publish(self, model_id, model):
+        with self._lock:
+            models = dict(self._models)
+            old = models.pop(model_id, None)
+            if model is not None:
+                models[model_id] = model
+            self._models = models
+        if model is not None:
+            self.errors.pop(model_id, None)
+            self.events["reloaded" if old is not None else "loaded"] += 1
+            log.info("Local model published", extra={
+                "model": model_id, "version": model.manifest.version, "load_seconds": model.load_seconds
+            })
+        elif old is not None:
+            self.events["unloaded"] += 1
+            log.info("Local model unloaded", extra={"model": model_id})
+        if old is not None:
+            old.retire()
+        return old
+
+    @contextmanager
+    def lease(self, model_id):
+        """The loaded model, kept serving until the block exits even if it is swapped out meanwhile"""
+        with self._lock:
+            model = self._models.get(model_id)
+            if model is None:
+                raise KeyError(model_id)
+            model.acquire()
+        try:
+            yield model
+        finally:
+            model.release()
+
+    def ensure(self, model_ids):
+        """Load the models that are not loaded yet or whose files changed; returns the ids that failed"""
+        failed = []
+        for model_id in model_ids:
+            try:
+                self.load(self.manifest(model_id), force=False)
+            except Exception as e:
+                self.errors[model_id] = str(e)
+                log.warning("⚠️ Could not load local model %s: %s", model_id, e)
+                failed.append(model_id)
+        return failed
+
+    def retain(self, model_ids):
+        """Unload every model not in model_ids"""
+        for model_id in set(self._models) - set(model_ids):
+            self.unload(model_id)
+
+    def stats(self):
+        return {
+            "directory": self.root,
+            "models": {model_id: model.stats() for model_id, model in sorted(self._models.items())},
+            "available": self.discover(),
+            "events": dict(self.events),
+            "errors": dict(self.errors),
+        }
+
+
+def parse_routes(spec):
+    """{model id: weight} from "id:90,id:10", a dict, or a bare "id" (all traffic)"""
+    if isinstance(spec, dict):
+        items = spec.items()
+    else:
+        items = [
+            part.rsplit(":", 1) if ":" in part else (part, 100)
+            for part in (p.strip() for p in (spec or "").split(",")) if part
+        ]
+    routes = {}
+    for model_id, weight in items:
+        weight = float(weight)
+        if weight < 0:
+            raise ValueError(f"Negative weight for {model_id}")
+        routes[str(model_id).strip()] = weight
+    if routes and not any(routes.values()):
+        raise ValueError("All route weights are 0")
+    return routes
+
+
+def read_routes(path):
+    """Routes from a routes.json ({"model id": weight, ...}); None when there is no file"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return parse_routes(json.load(f))
+
+
+class ABRouter:
+    """Weighted, per-image sticky split of local predictions across model versions, with agreement counts"""
+
+    def __init__(self, routes=None, shadow_rate=0.0):
+        self._lock = threading.Lock()
+        self.routes = parse_routes(routes or {})
+        self.shadow_rate = shadow_rate
+        self.served = {}  # model id -> predictions served
+        self.agreement = {}  # (served id, shadow id) -> [compared, agreed]
+
+    def set_routes(self, routes):
+        routes = parse_routes(routes)
+        with self._lock:
+            changed = routes != self.routes
+            self.routes = routes
+        if changed:
+            log.info("Local model routes changed", extra={"routes": routes})
+        return changed
+
+    def choose(self, key, loaded):
+        """Model id for an image: weighted over the routed models that are loaded.
+
+        key is the image bytes, so the same image always lands on the same
+        model. With none of the routed models loaded, falls back to any
+        loaded one rather than dropping the local prediction.
+        """
+        routes = sorted((model_id, weight) for model_id, weight in self.routes.items() if weight > 0 and model_id in loaded)
+        if not routes:
+            return min(loaded) if loaded else None
+        point = zlib.crc32(key) / 2 ** 32 * sum(weight for _, weight in routes)
+        for model_id, weight in routes:
+            point -= weight
+            if point < 0:
+                return model_id
+        return routes[-1][0]
+
+    def shadow_for(self, served, loaded):
+        """Another routed model to compare with on this request, or None (sampled at the shadow rate)"""
+        if self.shadow_rate <= 0 or random.random() >= self.shadow_rate:
+            return None
+        others = [model_id for model_id, weight in self.routes.items() if weight > 0 and model_id in loaded and model_id != served]
+        return random.choice(others) if others else None
+
+    def record(self, model_id, count=1):
+        with self._lock:
+            self.served[model_id] = self.served.get(model_id, 0) + count
+
+    def record_agreement(self, served, shadow, agreed):
+        with self._lock:
+            counts = self.agreement.setdefault((served, shadow), [0, 0])
+            counts[0] += 1
+            counts[1] += bool(agreed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "routes": dict(self.routes),
+                "shadow_rate": self.shadow_rate,
+                "served": dict(self.served),
+                "agreement": [
+                    {"served": served, "shadow": shadow, "compared": compared, "agreed": agreed,
+                     "agreement_rate": round(agreed / compared, 4) if compared else None}
+                    for (served, shadow), (compared, agreed) in sorted(self.agreement.items())
+                ],
+            }
@@ -0,0 +1,110 @@
+"""
+Perceptual-hash index for near-duplicate diagnosis lookup.
+
+Images are reduced to a 64-bit difference hash (dHash) which survives
+resizing, recompression and small framing changes. Hashes are stored in a
+multi-index hash table: the 64 bits are split into 4 chunks of 16 bits, each
+chunk value keyed to the entries that contain it. By the pigeonhole
+principle any hash within Hamming distance r of the query matches at least
+one chunk within distance r // 4, so a lookup only probes a handful of
+buckets and verifies the few candidates found there.
+"""
+import threading
+from collections import OrderedDict
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(img, hash_size=8):
+    """64-bit difference hash of a PIL image"""
+    gray = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class MultiIndexHashTable:
+    """Hamming-distance index over 64-bit hashes with FIFO eviction"""
+
+    def __init__(self, max_entries=100000, chunks=4):
+        self.max_entries = max(1, int(max_entries))
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables = [dict() for _ in range(chunks)]  # chunk value -> {entry id: hash}
+        self._entries = OrderedDict()  # entry id -> (hash, value)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._flip_masks = {}
+
+    def _split(self, h):
+        return [(h >> (i * self.chunk_bits)) & self._mask for i in range(self.chunks)]
+
+    def _masks_within(self, radius):
+        """All bit masks of a chunk with popcount <= radius (cached)"""
+        masks = self._flip_masks.get(radius)
+        if masks is None:
+            masks = [0]
+            for r in range(1, radius + 1):
+                for positions in combinations(range(self.chunk_bits), r):
+                    m = 0
+                    for p in positions:
+                        m |= 1 << p
+                    masks.append(m)
+            self._flip_masks[radius] = masks
+        return masks
+
+    def add(self, h, value):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (h, value)
+            for table, part in zip(self._tables, self._split(h)):
+                table.setdefault(part, {})[entry_id] = h
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        h, _ = self._entries.pop(entry_id)
+        for table, part in zip(self._tables, self._split(h)):
+            bucket = table.get(part)
+            if bucket is not None:
+                bucket.pop(entry_id, None)
+                if not bucket:
+                    del table[part]
+
+    def nearest(self, h, max_distance):
+        """Closest stored (distance, value) within max_distance, or None"""
+        radius = max_distance // self.chunks
+        masks = self._masks_within(radius)
+        best_id = None
+        best_distance = max_distance + 1
+        with self._lock:
+            for table, part in zip(self._tables, self._split(h)):
+                for m in masks:
+                    bucket = table.get(part ^ m)
+                    if not bucket:
+                        continue
+                    for entry_id, stored_hash in bucket.items():
+                        d = (stored_hash ^ h).bit_count()
+                        if d < best_distance:
+                            best_id, best_distance = entry_id, d
+                            if d == 0:
+                                break
+            if best_id is None:
+                return None
+            return best_distance, self._entries[best_id][1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "chunks": self.chunks,
+        }
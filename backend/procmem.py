@@ -0,0 +1,48 @@
+"""
+Memory of a process as Linux accounts for it, read from /proc.
+
+RSS counts every resident page, including pages shared with other
+processes, so adding up the RSS of pre-forked workers counts the shared
+code, tables and model weights once per worker. PSS splits each shared page
+evenly between the processes that map it, so PSS adds up to the real total;
+"private" (USS) is what one worker costs on its own. smaps_rollup (Linux
+4.14+) has all of these in one read; otherwise only statm's RSS and shared
+figures are available.
+"""
+import os
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_memory(pid="self"):
+    """{rss, pss, shared, private} in bytes (None where unknown), or None without /proc"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                parts = rest.split()
+                if len(parts) == 2 and parts[1] == "kB":
+                    fields[name] = int(parts[0]) * 1024
+    except OSError:
+        pass
+    if "Rss" in fields:
+        return {
+            "rss": fields["Rss"],
+            "pss": fields.get("Pss"),
+            "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        }
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident, shared = (int(v) * PAGE_SIZE for v in f.read().split()[1:3])
+    except (OSError, ValueError):
+        return None
+    return {"rss": resident, "pss": None, "shared": shared, "private": resident - shared}
+
+
+def in_megabytes(memory):
+    """process_memory() with the byte counts as MiB, rounded for display"""
+    if memory is None:
+        return None
+    return {name: None if value is None else round(value / 2 ** 20, 1) for name, value in memory.items()}
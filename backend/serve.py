@@ -0,0 +1,255 @@
+"""
+Pre-fork launcher for main.py: one listening socket, N worker processes.
+
+The parent imports main.py once, so the Python code, the knowledge table,
+the crop recommender and the caches are loaded a single time. It then
+freezes the garbage collector's view of those objects (gc.freeze, so the
+workers' collections do not write to the shared pages) and forks. The
+workers share all of it copy-on-write and each runs a threaded WSGI server
+on the inherited socket. Crashed workers are restarted.
+
+How the local model is shared (--model-sharing):
+
+- fork: the parent loads the converted network.tflite before forking. Only
+  safe for a single-threaded interpreter (LOCAL_ENGINE_THREADS=1): a thread
+  pool created in the parent does not exist in the children. With one
+  process per core the interpreter needs no threads of its own anyway.
+- worker: every worker loads the model after the fork. The TFLite
+  interpreter memory-maps the .tflite flatbuffer, so its weights are still
+  shared through the page cache; only tensors and any repacked kernel
+  weights are per worker. A Keras network.h5 is read into each worker's own
+  heap, one full copy per worker: run export_model.py first.
+- auto (default): fork when a fresh network.tflite exists, else worker.
+
+TensorFlow's runtime is not fork-safe, so the Keras engine is never loaded
+in the parent. With LOCAL_ENGINE=tflite and a stale artifact the parent
+runs export_model.py in a subprocess once, before the workers start.
+
+Each worker reports its own /health (with "process": pid, worker index,
+RSS/PSS/shared/private MiB) and /metrics; the parent logs the memory of
+every worker and the PSS total every --memory-report-seconds. Run from the
+backend/ folder:
+
+    python serve.py --workers 4 --port 8000
+    python serve.py --workers 16 --model-sharing worker
+"""
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from inference_engine import is_fresh, tflite_path_for
+from procmem import in_megabytes, process_memory
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# A worker that dies sooner than this after starting is restarted with a delay
+CRASH_LOOP_SECONDS = 5.0
+
+log = logging.getLogger("crop_api.serve")
+
+
+def model_paths():
+    """(network.h5 path, converted artifact path, engine preference), as main.py resolves them"""
+    model_path = os.path.join(os.getcwd(), "network.h5")
+    int8 = os.getenv("LOCAL_ENGINE_INT8", "0") == "1"
+    return model_path, tflite_path_for(model_path, int8), os.getenv("LOCAL_ENGINE", "auto")
+
+
+def prepare_model(requested):
+    """Convert if needed and pick the model sharing mode; returns "fork" or "worker" """
+    model_path, tflite_path, preference = model_paths()
+    if preference == "tflite" and os.path.exists(model_path) and not is_fresh(tflite_path, model_path):
+        # Once here, instead of once per worker (and TensorFlow never runs in the parent)
+        command = [sys.executable, "export_model.py", "--model", model_path]
+        if os.getenv("LOCAL_ENGINE_INT8", "0") == "1":
+            command.append("--int8")
+        print(f"Converting {model_path} -> {tflite_path} before forking...", file=sys.stderr)
+        subprocess.run(command, cwd=BACKEND_DIR, check=True)
+
+    tflite = preference != "keras" and is_fresh(tflite_path, model_path)
+    if tflite:
+        os.environ.setdefault("LOCAL_ENGINE_THREADS", "1")
+    single_threaded = os.environ.get("LOCAL_ENGINE_THREADS") == "1"
+    if requested == "fork" and not (tflite and single_threaded):
+        sys.exit("--model-sharing fork needs a fresh network.tflite (export_model.py), LOCAL_ENGINE other than"
+                 " keras and LOCAL_ENGINE_THREADS=1")
+    if requested == "auto":
+        return "fork" if tflite and single_threaded else "worker"
+    return requested
+
+
+def memory_report(workers):
+    """Per-worker and total memory; PSS adds up, RSS double-counts shared pages"""
+    parent = process_memory(os.getpid())
+    per_worker = {index: process_memory(pid) for pid, index in workers.items()}
+    everyone = [parent, *per_worker.values()]
+    total = {
+        kind: sum(m[kind] for m in everyone if m is not None and m[kind] is not None)
+        for kind in ("rss", "pss")
+    }
+    return {
+        "workers": {index: in_megabytes(m) for index, m in sorted(per_worker.items())},
+        "parent": in_megabytes(parent),
+        "total_mb": in_megabytes(total),
+    }
+
+
+def run_worker(core, index, listener, host, port, ready_fd):
+    """Body of a forked worker; returns when the server has shut down"""
+    from werkzeug.serving import make_server
+
+    # The parent handles Ctrl-C and forwards SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    core.init_worker(index)
+    server = make_server(host, port, core.app, threaded=True, fd=listener.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to notice, so not on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    os.write(ready_fd, f"{index}\n".encode())
+    log.info("Worker serving", extra={"worker": index, "pid": os.getpid(), "local_model_state": core.MODEL_STATE})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def spawn(core, index, listener, args, ready_fd):
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        run_worker(core, index, listener, args.host, args.port, ready_fd)
+    except BaseException:
+        log.exception("Worker %d crashed", index)
+        code = 1
+    finally:
+        logging.shutdown()
+        # Never return into the parent's code
+        os._exit(code)
+
+
+def stop_workers(workers, timeout):
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.05)
+    for pid in workers:
+        log.warning("Worker did not stop in time; killing it", extra={"pid": pid})
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--model-sharing", choices=["auto", "fork", "worker"],
+                        default=os.getenv("SERVE_MODEL_SHARING", "auto"))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--memory-report-seconds", type=float, default=300,
+                        help="How often the parent logs per-worker memory (0 = only once all are ready)")
+    parser.add_argument("--graceful-timeout", type=float, default=30,
+                        help="Seconds workers get to finish in-flight requests on shutdown")
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs fork(); use `python main.py` or asgi.py on this platform")
+
+    sharing = prepare_model(args.model_sharing)
+    os.environ["PREFORK_PARENT"] = "1"
+    os.environ["FLASK_DEBUG"] = "0"
+    import main as core
+
+    if sharing == "fork":
+        core.load_local_model()
+    else:
+        model_path, tflite_path, preference = model_paths()
+        if os.path.exists(model_path) and (preference == "keras" or not os.path.exists(tflite_path)):
+            log.warning("⚠️ Each worker loads its own copy of the Keras model; run export_model.py to share it")
+    stray = [t.name for t in threading.enumerate() if t is not threading.main_thread()]
+    if stray:
+        log.warning("⚠️ Threads running before fork will not exist in the workers", extra={"threads": stray})
+
+    listener = socket.create_server((args.host, args.port), backlog=args.backlog)
+    # Every worker polls the same socket; the ones that lose the race to
+    # accept() get EAGAIN instead of blocking
+    listener.setblocking(False)
+    listener.set_inheritable(True)
+    ready_r, ready_w = os.pipe()
+
+    # Everything allocated so far is shared; keep the GC from touching it
+    gc.collect()
+    gc.freeze()
+
+    workers, started = {}, {}
+    for index in range(args.workers):
+        pid = spawn(core, index, listener, args, ready_w)
+        workers[pid], started[index] = index, time.monotonic()
+    log.info("Pre-fork server starting", extra={
+        "workers": args.workers, "port": args.port, "model_sharing": sharing, "model_state": core.MODEL_STATE
+    })
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+    ready, next_report = set(), None
+    while not stopping:
+        try:
+            readable, _, _ = select.select([ready_r], [], [], 0.5)
+        except InterruptedError:
+            continue
+        if readable:
+            for line in os.read(ready_r, 4096).decode().split():
+                ready.add(int(line))
+            if len(ready) == args.workers and next_report is None:
+                log.info("All workers ready", extra={"workers": args.workers, **memory_report(workers)})
+                next_report = time.monotonic() + args.memory_report_seconds
+        if next_report is not None and args.memory_report_seconds > 0 and time.monotonic() >= next_report:
+            log.info("Worker memory", extra=memory_report(workers))
+            next_report = time.monotonic() + args.memory_report_seconds
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            index = workers.pop(pid)
+            ready.discard(index)
+            log.warning("Worker exited; restarting it", extra={
+                "worker": index, "pid": pid, "exit_code": os.waitstatus_to_exitcode(status)
+            })
+            if time.monotonic() - started[index] < CRASH_LOOP_SECONDS:
+                time.sleep(1.0)
+            pid = spawn(core, index, listener, args, ready_w)
+            workers[pid], started[index] = index, time.monotonic()
+
+    log.info("Stopping workers", extra={"workers": len(workers)})
+    stop_workers(workers, args.graceful_timeout)
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
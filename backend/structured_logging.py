@@ -0,0 +1,75 @@
+"""
+Logging setup shared by the Flask and ASGI servers.
+
+Modules log through the standard logging package with the variable parts of
+a message passed as `extra` fields. configure_logging picks the output:
+
+- LOG_FORMAT=text (default): one readable line per record, with the extra
+  fields appended as key=value.
+- LOG_FORMAT=json: one JSON object per line, for log shippers.
+- LOG_ENABLED=0: logging.disable() for every level, so log calls return
+  before a record is even built.
+
+Raw LLM responses are logged at DEBUG, which the default LOG_LEVEL=INFO
+leaves out.
+"""
+import json
+import logging
+import sys
+import time
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def record_extras(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+
+
+class TextFormatter(logging.Formatter):
+    """`time level logger: message key=value ...`"""
+
+    def format(self, record):
+        line = (
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))} "
+            f"{record.levelname:<7} {record.name}: {record.getMessage()}"
+        )
+        extras = record_extras(record)
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_extras(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level="INFO", fmt="text", enabled=True):
+    """Install one stderr handler on the root logger"""
+    if not enabled:
+        logging.disable(logging.CRITICAL)
+        return
+    logging.disable(logging.NOTSET)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    # httpx logs every Groq request at INFO; the gateway's metrics cover them
+    logging.getLogger("httpx").setLevel(logging.WARNING)
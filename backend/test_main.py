@@ -0,0 +1,69 @@
+"""
+In-process regression tests for main.py, with the benchmarks' stand-in model
+instead of network.h5 and no Groq key.
+
+Run from the backend/ folder:
+    python -m pytest test_main.py
+"""
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+os.environ.setdefault("JOBS_ENABLED", "0")
+os.environ.setdefault("MODEL_BACKGROUND_LOAD", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from admission import AdmissionController
+from benchmarks.bench_tta import SyntheticModel
+
+
+def jpeg(seed=0, size=(96, 96)):
+    """A distinct noise image per seed (flat colours all share one perceptual hash)"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (*size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def client():
+    main.install_local_engine(SyntheticModel(len(main.CLASS_NAMES), 0, 0))
+    return main.app.test_client()
+
+
+def test_batch_reports_a_bad_item_without_failing_the_batch(client):
+    response = client.post("/diagnose/batch?mode=local", data={
+        "files": [(io.BytesIO(jpeg()), "leaf.jpg"), (io.BytesIO(b"not an image"), "broken.jpg")],
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [entry["ok"] for entry in body["results"]] == [True, False]
+    assert body["results"][1]["filename"] == "broken.jpg"
+    assert body["failed"] == 1
+
+
+def test_cache_hit_is_served_with_an_empty_admission_bucket(client, monkeypatch):
+    monkeypatch.setattr(main, "AI_READY", True)
+    admission = AdmissionController(rate_per_second=0.001, burst=1)
+    monkeypatch.setattr(main, "ADMISSION", admission)
+    admission.admit(main.admission_client({}, "127.0.0.1")).release()
+
+    image = jpeg(1)
+    _, keys = main.lookup_cached_diagnosis(main.as_upload(image))
+    main.store_diagnosis(keys, {"disease": "Early Blight", "crop": "Tomato"})
+
+    response = client.post("/diagnose", data={"file": (io.BytesIO(image), "leaf.jpg")})
+    assert response.status_code == 200
+    assert response.get_json()["disease"] == "Early Blight"
+    stream = client.post("/diagnose/stream", data={"file": (io.BytesIO(image), "leaf.jpg")})
+    assert "event: result" in stream.get_data(as_text=True)
+
+    # An upload that has to go to Groq still needs a token
+    response = client.post("/diagnose", data={"file": (io.BytesIO(jpeg(2)), "leaf.jpg")})
+    assert response.status_code == 429
+    assert admission.stats()["rate_limited"] == 1
@@ -0,0 +1,162 @@
+"""
+Test-time augmentation (TTA) for the local disease classifier.
+
+The plain prediction classifies one centre-resized view of the upload. With
+TTA, an upload the model is unsure about is classified again from more
+views: flips, 90° rotations (square inputs only) and 224-pixel windows cut from a 256-pixel
+resize of the same image. The class probabilities of all views are then
+averaged. The views are slices of two small uint8 arrays. They are written
+into one (V, H, W, 3) stack and queued on the micro-batcher together, so
+they run as one forward pass (shared with whatever else is in flight).
+
+The number of views depends on the first view's confidence (calibrated,
+when refine_many is given the model's calibration, so it is the same
+confidence the routing thresholds see), set by a schedule of "min_confidence:views" steps such as "90:1,70:4,0:8". A
+confident first view costs nothing extra; the least sure uploads get the
+most views. Averaging does not always raise the confidence: views that
+disagree lower it. Either way the local fast path then judges the ensemble
+rather than a single view.
+"""
+import threading
+
+import numpy as np
+
+# Views in the order they are added as the view count grows
+VIEW_ORDER = (
+    "identity", "hflip", "crop_center", "vflip", "rot90", "rot270", "crop_center_hflip",
+    "crop_top_left", "crop_top_right", "crop_bottom_left", "crop_bottom_right",
+)
+CROP_VIEWS = {name for name in VIEW_ORDER if name.startswith("crop_")}
+# A 90° rotation of a non-square input has the wrong shape for the stack
+ROTATION_VIEWS = {"rot90", "rot270"}
+
+
+def parse_schedule(text):
+    """"90:1,70:4,0:8" -> [(90.0, 1), (70.0, 4), (0.0, 8)], highest confidence first"""
+    steps = []
+    for part in text.split(","):
+        confidence, _, views = part.partition(":")
+        steps.append((float(confidence), max(1, int(views))))
+    return sorted(steps, reverse=True)
+
+
+def view(name, base, zoomed):
+    """One named view of base (H, W, 3); crops are windows of the larger `zoomed`"""
+    if name == "identity":
+        return base
+    if name == "hflip":
+        return base[:, ::-1]
+    if name == "vflip":
+        return base[::-1]
+    if name == "rot90":
+        return np.rot90(base, 1)
+    if name == "rot270":
+        return np.rot90(base, 3)
+    h, w = base.shape[:2]
+    spare_h, spare_w = zoomed.shape[0] - h, zoomed.shape[1] - w
+    top, left = {
+        "crop_center": (spare_h // 2, spare_w // 2),
+        "crop_center_hflip": (spare_h // 2, spare_w // 2),
+        "crop_top_left": (0, 0),
+        "crop_top_right": (0, spare_w),
+        "crop_bottom_left": (spare_h, 0),
+        "crop_bottom_right": (spare_h, spare_w),
+    }[name]
+    window = zoomed[top:top + h, left:left + w]
+    return window[:, ::-1] if name == "crop_center_hflip" else window
+
+
+def stack_views(names, base, zoomed):
+    """(len(names), H, W, 3) uint8 stack of the named views"""
+    out = np.empty((len(names), *base.shape), dtype=base.dtype)
+    for i, name in enumerate(names):
+        out[i] = view(name, base, zoomed)
+    return out
+
+
+class TestTimeAugmentation:
+    """View schedule, view stacking and probability averaging, with counters"""
+
+    def __init__(self, schedule="90:1,70:4,0:8", crop_resize=256, views=VIEW_ORDER):
+        self.schedule = parse_schedule(schedule) if isinstance(schedule, str) else sorted(schedule, reverse=True)
+        self.views = tuple(views)
+        self.unrotated_views = tuple(name for name in self.views if name not in ROTATION_VIEWS)
+        self.crop_resize = crop_resize  # shorter edge of the image crops are cut from
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.views_used = {}  # view count -> requests
+        self.class_changed = 0
+        self.confidence_gain = 0.0  # summed over augmented requests, in % points
+
+    def views_for(self, confidence, available=None):
+        """View count (first view included) for a first-view confidence in %, at most `available`"""
+        available = len(self.views) if available is None else available
+        for min_confidence, views in self.schedule:
+            if confidence >= min_confidence:
+                return min(views, available)
+        return 1
+
+    def views_of(self, shape):
+        """The views usable for a model input of `shape`: no rotations unless it is square"""
+        return self.views if shape[0] == shape[1] else self.unrotated_views
+
+    def zoomed_size(self, size):
+        """Resize target for the crop views, for a model input of `size`"""
+        scale = max(1.0, self.crop_resize / min(size))
+        return tuple(round(edge * scale) for edge in size)
+
+    def refine_many(self, firsts, bases, zoomed_inputs, predict_many, calibrate=None):
+        """Final probabilities for several uploads from their first-view probabilities.
+
+        bases are the (H, W, 3) uint8 model inputs and zoomed_inputs callables
+        returning the larger resize (only called when a crop view is used).
+        The extra views of every upload that needs them go to predict_many
+        in one call. calibrate maps raw probabilities to the calibrated ones
+        the schedule is read with; the averaged output stays raw.
+        """
+        plans, stacks = [], []
+        for first, base, zoomed_input in zip(firsts, bases, zoomed_inputs):
+            views = self.views_of(base.shape)
+            confidence = float(np.max(calibrate(first) if calibrate else first)) * 100
+            names = views[1:self.views_for(confidence, len(views))]
+            if names:
+                zoomed = zoomed_input() if CROP_VIEWS.intersection(names) else None
+                stacks.append(stack_views(names, base, zoomed))
+            plans.append(len(names))
+        rows = iter(predict_many([row for stack in stacks for row in stack]) if stacks else ())
+
+        results = []
+        for first, extra in zip(firsts, plans):
+            first = np.asarray(first, dtype=np.float32)
+            if not extra:
+                results.append(first)
+                self.record(1, first, first)
+                continue
+            probabilities = np.vstack([first[None], [next(rows) for _ in range(extra)]])
+            combined = probabilities.mean(axis=0)
+            results.append(combined)
+            self.record(extra + 1, first, combined)
+        return results
+
+    def refine(self, first, base, zoomed_input, predict_many, calibrate=None):
+        return self.refine_many([first], [base], [zoomed_input], predict_many, calibrate)[0]
+
+    def record(self, views, first, combined):
+        with self._lock:
+            self.requests += 1
+            self.views_used[views] = self.views_used.get(views, 0) + 1
+            if views > 1:
+                self.class_changed += int(np.argmax(first) != np.argmax(combined))
+                self.confidence_gain += float(np.max(combined) - np.max(first)) * 100
+
+    def stats(self):
+        with self._lock:
+            augmented = self.requests - self.views_used.get(1, 0)
+            return {
+                "schedule": ",".join(f"{c:g}:{v}" for c, v in self.schedule),
+                "requests": self.requests,
+                "augmented": augmented,
+                "views_used": dict(sorted(self.views_used.items())),
+                "class_changed": self.class_changed,
+                "mean_confidence_gain": round(self.confidence_gain / augmented, 2) if augmented else None,
+            }
@@ -0,0 +1,93 @@
+"""
+Precompute crop recommendations for a region into the recommendation cache.
+
+Walks every geohash cell in --bbox and every combination of --soil and the
+temperature/humidity/rainfall bins in the given ranges. Each combination
+not already cached gets a Groq recommendation, stored in the SQLite file
+the server reads (RECOMMENDATION_CACHE_DB, or --db). Start the server with
+the same RECOMMENDATION_CACHE_DB and binning settings and those requests
+are answered from the cache. This warms the RECOMMENDATION_ENGINE=llm path;
+the local engine computes recommendations in process and needs no warming.
+
+    python warm_recommendations.py --db recommendations.db \\
+        --bbox 10.9 76.9 11.1 77.1 --soil "Red Loam" --soil "Black Cotton" \\
+        --temperature 24:34 --humidity 50:80 --rainfall 80:160
+    python warm_recommendations.py ... --dry-run    # only count the combinations
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from field_keys import geohash_bounds
+
+
+def parse_range(text):
+    """'low:high' -> (low, high); a single number is a one-bin range"""
+    low, _, high = text.partition(":")
+    return float(low), float(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.getenv("RECOMMENDATION_CACHE_DB"),
+                        help="SQLite cache file (default: $RECOMMENDATION_CACHE_DB)")
+    parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("LAT_MIN", "LON_MIN", "LAT_MAX", "LON_MAX"))
+    parser.add_argument("--soil", action="append", required=True, help="Soil type (repeatable)")
+    parser.add_argument("--temperature", type=parse_range, default=(28, 28), help="°C range, low:high")
+    parser.add_argument("--humidity", type=parse_range, default=(65, 65), help="%% range, low:high")
+    parser.add_argument("--rainfall", type=parse_range, default=(120, 120), help="mm/month range, low:high")
+    parser.add_argument("--concurrency", type=int, default=4, help="Groq requests in flight")
+    parser.add_argument("--dry-run", action="store_true", help="Print the number of combinations and exit")
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("--db (or RECOMMENDATION_CACHE_DB) is required so the server can read the results")
+
+    # main.py builds the cache from the environment at import time
+    os.environ["RECOMMENDATION_CACHE_DB"] = args.db
+    os.environ["RECOMMENDATION_CACHE_ENABLED"] = "1"
+    os.environ.setdefault("JOBS_ENABLED", "0")
+    import main as core
+
+    quantizer = core.RECOMMENDATION_QUANTIZER
+    cells = quantizer.cells(*args.bbox)
+    climate = [quantizer.bins(name, *getattr(args, name)) for name in ("temperature", "humidity", "rainfall")]
+    fields = []
+    for cell, soil, temperature, humidity, rainfall in itertools.product(cells, args.soil, *climate):
+        lat_min, lon_min, lat_max, lon_max = geohash_bounds(cell)
+        fields.append({
+            "coords": [(lat_min + lat_max) / 2, (lon_min + lon_max) / 2],
+            "soil_type": soil,
+            "temperature": temperature,
+            "humidity": humidity,
+            "rainfall": rainfall,
+        })
+    keyed = dict(quantizer.quantize(field) for field in fields)  # key -> representative field
+    missing = {key: field for key, field in keyed.items() if core.RECOMMENDATION_CACHE.get(key) is None}
+    print(f"{len(cells)} cells x {len(args.soil)} soils x {' x '.join(str(len(c)) for c in climate)} climate bins"
+          f" = {len(keyed)} keys, {len(keyed) - len(missing)} already cached")
+    if args.dry_run or not missing:
+        return
+    if not core.AI_READY:
+        sys.exit("Groq is not configured (GROQ_API_KEY); nothing warmed")
+
+    start = time.perf_counter()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = {pool.submit(core.fetch_recommendation, key, field): key for key, field in missing.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"  {futures[future]}: {e}", file=sys.stderr)
+            if (done + failed) % 50 == 0:
+                print(f"  {done + failed}/{len(missing)}")
+    print(f"warmed {done} keys in {time.perf_counter() - start:.1f} s ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()